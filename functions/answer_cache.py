@@ -0,0 +1,226 @@
+# ================== 상담 답변 캐시 ==================
+# 같은 세션에서 같은 맥락으로 같은 질문이 다시 오면 본 LLM을 다시 부르지 않고 이전 답변을 돌려준다.
+# 응답 필드 "cached" / "cache_age_seconds"는 그대로 (Flutter UI 표시용).
+#
+#   key = answer_cache_key(updated_question, payload_fingerprint(payload), session_key, generation)
+#   hit = get_cached_answer(key)              # (answer, age_s) | None
+#   save_cached_answer(key, answer, session_key=..., question=...)
+#
+# - 키 = sha256(정규화한 updated_question, payload 지문, 세션 키, 세션 세대, ANSWER_CACHE_VERSION)
+#     payload 지문: 압축 payload(원국 간지, 대운, 해석 대상 시점, 개인맞춤입력 …) + 오늘 날짜(KST)
+#     세션 세대 : 저장소 세션 요약의 "turns:last_ts" → 새 턴이 기록되면 바뀐다
+#     답변 저장은 이번 턴을 기록한 뒤의 세대로 → 같은 질문 재시도는 적중, 다른 턴이 끼면 자동 무효
+# - 1차: 프로세스 메모리 LRU (OrderedDict, 조회/저장/내보내기 O(1))
+#     ANSWER_CACHE_MAX (기본 1000 항목) / ANSWER_CACHE_MAX_BYTES (기본 8MB) 중 먼저 닿는 쪽에서 오래 안 쓴 것부터 내보냄
+#     ANSWER_CACHE_TTL_S (기본 3600): 저장 순서 큐 앞쪽부터 만료분을 걷어낸다 (조회 때만 지우지 않음)
+#     세션이 새 세대로 저장되면 그 세션의 이전 세대 항목은 바로 지운다 (다시 맞을 일이 없음)
+# - 2차(선택): 인스턴스 간 공유 — ANSWER_CACHE_SHARED (off | local | gcs | auto, llm_memo와 같은 규칙)
+#     <저장소>/_answer_cache/answers/<key>.json (세대가 키에 들어가므로 무효화 메시지가 필요 없다)
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from env_conf import env_int
+from llm_memo import _shared_get, _shared_mode, _shared_put
+
+_SHARED_ROOT = "_answer_cache"
+_SHARED_CHAIN = "answers"
+_ENTRY_OVERHEAD = 256      # 키/메타데이터 대략치 (바이트 예산 계산용)
+
+
+def _ttl_s() -> int:
+    return env_int("ANSWER_CACHE_TTL_S", 3600, lo=0)
+
+
+def canonical_question(text: str) -> str:
+    """공백/줄바꿈 정리 + 소문자 (표기 차이로 키가 갈리지 않게)"""
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def payload_fingerprint(payload: Optional[dict]) -> str:
+    """답변에 영향을 주는 payload 내용 + 오늘 날짜(KST) 지문"""
+    from core.services import compact_payload
+
+    body = compact_payload(payload or {})
+    (body.get("meta") or {}).pop("question", None)   # 원문 질문은 updated_question으로 따로 들어감
+    today = datetime.now(timezone(timedelta(hours=9))).strftime("%Y-%m-%d")
+    raw = json.dumps([today, body], ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def session_generation(summary: Optional[dict]) -> str:
+    """저장소 세션 요약 → 세대 문자열 (턴이 추가/정리되면 바뀜)"""
+    summary = summary or {}
+    return f"{int(summary.get('turns') or 0)}:{summary.get('last_ts') or ''}"
+
+
+def answer_cache_key(updated_question: str, fingerprint: str, session_key: str, generation: str) -> str:
+    raw = json.dumps(
+        [canonical_question(updated_question), fingerprint, session_key, generation,
+         os.getenv("ANSWER_CACHE_VERSION", "1")],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """LRU + TTL + 바이트 예산 (세션별 인덱스로 세대 교체 시 정리)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()     # key -> entry (최근 사용이 뒤)
+        self._by_age: "OrderedDict[str, float]" = OrderedDict()  # key -> stored_at (저장 순서, TTL 만료용)
+        self._by_session: Dict[str, set] = {}
+        self._bytes = 0
+        self.stats = {"hits_l1": 0, "hits_shared": 0, "misses": 0, "stores": 0,
+                      "evicted": 0, "expired": 0, "invalidated": 0, "shared_errors": 0}
+
+    def _drop(self, key: str) -> Optional[dict]:
+        ent = self._lru.pop(key, None)
+        if ent is None:
+            return None
+        self._by_age.pop(key, None)
+        self._bytes -= ent["nbytes"]
+        keys = self._by_session.get(ent["session"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._by_session.pop(ent["session"], None)
+        return ent
+
+    def _expire(self, now: float, ttl: int) -> None:
+        while self._by_age:
+            key, stored_at = next(iter(self._by_age.items()))
+            if now - stored_at <= ttl:
+                break
+            self._drop(key)
+            self.stats["expired"] += 1
+
+    def get(self, key: str) -> Optional[dict]:
+        ttl, now = _ttl_s(), time.time()
+        with self.lock:
+            self._expire(now, ttl)
+            ent = self._lru.get(key)
+            if ent is None:
+                return None
+            if now - ent["stored_at"] > ttl:   # 공유 계층에서 온 오래된 항목은 저장 순서 큐 중간에 있을 수 있다
+                self._drop(key)
+                self.stats["expired"] += 1
+                return None
+            self._lru.move_to_end(key)
+            ent["hits"] += 1
+            return dict(ent)
+
+    def put(self, key: str, answer: str, *, session: str, question: str = "",
+            stored_at: Optional[float] = None, generation: str = "") -> None:
+        now = time.time()
+        stored_at = stored_at or now
+        ent = {
+            "answer": answer,
+            "stored_at": stored_at,
+            "session": session,
+            "generation": generation,
+            "question": question[:200],
+            "hits": 0,
+            "nbytes": len(answer.encode("utf-8")) + len(question.encode("utf-8")) + _ENTRY_OVERHEAD,
+        }
+        max_items = env_int("ANSWER_CACHE_MAX", 1000, lo=1)
+        max_bytes = env_int("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024, lo=1)
+        with self.lock:
+            self._expire(now, _ttl_s())
+            self._drop(key)
+            # 같은 세션의 이전 세대 항목은 더 이상 맞을 수 없다 → 정리
+            if generation:
+                stale = [k for k in self._by_session.get(session, ()) if self._lru[k]["generation"] != generation]
+                for k in stale:
+                    self._drop(k)
+                self.stats["invalidated"] += len(stale)
+            self._lru[key] = ent
+            self._by_age[key] = stored_at
+            self._by_session.setdefault(session, set()).add(key)
+            self._bytes += ent["nbytes"]
+            while len(self._lru) > max_items or self._bytes > max_bytes:
+                if len(self._lru) <= 1:
+                    break
+                self._drop(next(iter(self._lru)))
+                self.stats["evicted"] += 1
+
+    def invalidate(self, session: str) -> int:
+        """세션 키의 항목 삭제 ("<user_id>::"처럼 ::로 끝나면 그 사용자 전체)"""
+        match = (lambda s: s.startswith(session)) if session.endswith("::") else (lambda s: s == session)
+        with self.lock:
+            keys = [k for s, ks in self._by_session.items() if match(s) for k in ks]
+            for k in keys:
+                self._drop(k)
+            self.stats["invalidated"] += len(keys)
+            return len(keys)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "entries": len(self._lru), "bytes": self._bytes,
+                    "sessions": len(self._by_session)}
+
+
+_CACHE = AnswerCache()
+
+
+def get_cached_answer(key: str) -> Optional[Tuple[str, int]]:
+    """(답변, 저장 후 경과 초) 또는 None. 1차 → 공유 계층 순"""
+    ttl = _ttl_s()
+    if ttl <= 0:
+        return None
+    ent = _CACHE.get(key)
+    if ent is not None:
+        _CACHE.stats["hits_l1"] += 1
+        return ent["answer"], int(time.time() - ent["stored_at"])
+
+    mode = _shared_mode("ANSWER_CACHE_SHARED")
+    if mode != "off":
+        try:
+            rec = _shared_get(mode, _SHARED_CHAIN, key, _SHARED_ROOT)
+            if rec and time.time() - float(rec.get("stored_at") or 0) <= ttl:
+                _CACHE.put(key, rec["answer"], session=rec.get("session") or "", question=rec.get("question") or "",
+                           stored_at=float(rec["stored_at"]), generation=rec.get("generation") or "")
+                _CACHE.stats["hits_shared"] += 1
+                print(f"[ANSWER_CACHE] hit tier={mode}")
+                return rec["answer"], int(time.time() - float(rec["stored_at"]))
+        except Exception as e:
+            _CACHE.stats["shared_errors"] += 1
+            print(f"[ANSWER_CACHE][WARN] shared read failed ({mode}): {e}")
+    _CACHE.stats["misses"] += 1
+    return None
+
+
+def save_cached_answer(key: str, answer: str, *, session_key: str, question: str = "", generation: str = "") -> None:
+    if _ttl_s() <= 0 or not answer:
+        return
+    now = time.time()
+    _CACHE.put(key, answer, session=session_key, question=question, stored_at=now, generation=generation)
+    _CACHE.stats["stores"] += 1
+    mode = _shared_mode("ANSWER_CACHE_SHARED")
+    if mode != "off":
+        try:
+            _shared_put(mode, _SHARED_CHAIN, key, {
+                "answer": answer, "stored_at": now, "session": session_key,
+                "generation": generation, "question": question[:200],
+            }, _SHARED_ROOT)
+        except Exception as e:
+            _CACHE.stats["shared_errors"] += 1
+            print(f"[ANSWER_CACHE][WARN] shared write failed ({mode}): {e}")
+
+
+def invalidate_answer_cache(session: str) -> int:
+    """세션 키("<user_id>::<session_id>") 또는 사용자 접두어("<user_id>::")의 1차 항목 삭제.
+    공유 계층은 세대가 키에 들어가 있어 따로 지우지 않는다."""
+    return _CACHE.invalidate(session)
+
+
+def get_answer_cache_stats() -> dict:
+    return {**_CACHE.snapshot(), "shared": _shared_mode("ANSWER_CACHE_SHARED"), "ttl_s": _ttl_s()}
@@ -0,0 +1,334 @@
+# ================== 답변 전달 (동기 / 스트리밍 / 비동기) ==================
+# ask_saju는 본 상담·점괘 LLM 호출 직전까지 준비한 것을 PendingAnswer로 묶는다.
+# 같은 PendingAnswer를 호출 경로에 따라 다르게 실행한다:
+#   respond()          : 동기 invoke → JSON 응답 (기존 HTTPS 함수)
+#   stream(fmt)        : 동기 .stream() → SSE/NDJSON 청크 응답 (요청 "stream": true)
+#   arespond(offload)  : ainvoke → 본문 dict (asgi_app, 비동기 경로)
+#   astream(fmt, ...)  : .astream() → SSE/NDJSON 비동기 이터레이터 (asgi_app + "stream": true)
+#
+# 스트리밍 형식
+#   SSE    : Accept: text/event-stream 이거나 "stream": "sse"
+#            event: <이벤트>\ndata: <json>\n\n
+#   NDJSON : 그 외 (기본)   {"event": "<이벤트>", ...}\n
+#
+# 이벤트 순서
+#   meta   : 응답 종류/구조화 필드 (fortune이면 본괘/변괘 정보)
+#   header : (fortune) 고정 헤더 블록 — LLM 첫 토큰을 기다리지 않고 바로 전송
+#   delta  : 토큰 조각 {"text"}
+#   done   : {"answer"(전체), "cached", "cache_age_seconds", "ttfb_ms", "first_token_ms", "total_ms", "usage"}
+#   error  : {"error"} (스트림 도중 예외, 이 경우 done 없음)
+#
+# - 턴 기록/캐시 저장/사용량 로깅은 답변이 확정된 뒤 on_complete(full_text, usage)에서 1회 한다.
+# - 요청 정리(저장소 flush, 컨텍스트 해제)는 on_close()로 넘겨받아 스트림/비동기 실행이 끝날 때 한다.
+#   (동기 respond()는 ask_saju finally가 정리하므로 on_close를 부르지 않는다)
+# - 비동기 경로의 on_complete/on_close는 동기 코드(저장소 I/O)라 offload(fn, *args)로 스레드에서 실행한다.
+# - 시간은 모두 요청 시작(request_clock()) 기준:
+#     ttfb_ms        : 첫 바이트(meta/header 포함)
+#     first_token_ms : 첫 LLM 토큰
+#     total_ms       : done 직전 (후처리 포함)
+
+import json
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from stage_scheduler import current_stages
+
+Offload = Callable[..., Awaitable[Any]]
+
+
+def request_clock() -> float:
+    """요청 시작 시각 (AnswerStream/PendingAnswer t0로 넘긴다)"""
+    return time.perf_counter()
+
+
+def stream_format(data: dict, headers: Any = None) -> Optional[str]:
+    """스트리밍 요청이면 "sse" | "ndjson", 아니면 None"""
+    flag = data.get("stream") if isinstance(data, dict) else None
+    if isinstance(flag, str):
+        flag = flag.strip().lower()
+        if flag in ("sse", "ndjson"):
+            return flag
+        flag = flag in ("1", "true", "yes", "on")
+    if not flag:
+        return None
+    accept = ""
+    try:
+        accept = (headers.get("Accept") or "") if headers is not None else ""
+    except Exception:
+        pass
+    return "sse" if "text/event-stream" in accept else "ndjson"
+
+
+def stream_headers(fmt: str) -> dict:
+    content_type = "text/event-stream; charset=utf-8" if fmt == "sse" else "application/x-ndjson; charset=utf-8"
+    return {
+        "Content-Type": content_type,
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",   # 프록시 버퍼링 끔 (토큰 즉시 전달)
+    }
+
+
+def encode_event(fmt: str, event: str, payload: dict) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+
+
+def _chunk_text(chunk: Any) -> str:
+    if chunk is None:
+        return ""
+    if isinstance(chunk, str):
+        return chunk
+    content = getattr(chunk, "content", None)
+    return content if isinstance(content, str) else ""
+
+
+def _merge_usage(total: Optional[dict], usage: Any) -> Optional[dict]:
+    """스트림 청크의 usage_metadata 합산 (stream_usage=True면 마지막 청크에만 들어온다)"""
+    if not isinstance(usage, dict):
+        return total
+    out = dict(total or {})
+    for k, v in usage.items():
+        if isinstance(v, (int, float)):
+            out[k] = out.get(k, 0) + v
+        elif isinstance(v, dict):   # input_token_details {"cache_read": …} 등
+            out[k] = _merge_usage(out.get(k), v)
+    return out
+
+
+def _result_usage(result: Any) -> Optional[dict]:
+    """invoke 결과의 토큰 사용량 (usage_metadata 우선, 없으면 response_metadata.token_usage)"""
+    usage = getattr(result, "usage_metadata", None)
+    meta = getattr(result, "response_metadata", None)
+    token_usage = meta.get("token_usage") if isinstance(meta, dict) else None
+    if usage:
+        if isinstance(token_usage, dict) and token_usage.get("prompt_tokens_details") and "input_token_details" not in usage:
+            # 캐시 토큰 세부 정보가 usage_metadata에 없는 버전 → token_usage 쪽을 함께 싣는다
+            usage = {**usage, "prompt_tokens_details": token_usage["prompt_tokens_details"]}
+        return usage
+    return token_usage
+
+
+class AnswerStream:
+    """LLM 청크 이터레이터 → SSE/NDJSON 스트림 (+ 종료 후 기록/정리). 동기/비동기 겸용"""
+
+    def __init__(
+        self,
+        chunks: Any,
+        *,
+        fmt: str,
+        t0: float,
+        prefix_events: Iterable[tuple[str, dict]] = (),
+        on_complete: Optional[Callable[[str, Optional[dict]], Optional[dict]]] = None,
+        on_close: Optional[Callable[[], None]] = None,
+        done_extra: Optional[dict] = None,
+        stage: str = "stream",
+    ):
+        self.chunks = chunks          # 동기: Iterable / 비동기(aiter_events): AsyncIterable
+        self.fmt = fmt
+        self.t0 = t0
+        self.prefix_events = list(prefix_events)
+        self.on_complete = on_complete
+        self.on_close = on_close
+        self.done_extra = dict(done_extra or {})
+        self.stage = stage
+        self.ttfb_ms: Optional[float] = None
+        self.first_token_ms: Optional[float] = None
+        self._stages = current_stages()   # 스트림은 요청 스레드/컨텍스트 밖에서 돌 수 있어 미리 잡아 둔다
+        self._parts: list[str] = []
+        self._usage: Optional[dict] = None
+        self._status = "error"
+
+    def _ms(self) -> float:
+        return round((time.perf_counter() - self.t0) * 1000, 1)
+
+    def _emit(self, event: str, payload: dict) -> str:
+        if self.ttfb_ms is None:
+            self.ttfb_ms = self._ms()
+        return encode_event(self.fmt, event, payload)
+
+    def _on_chunk(self, chunk: Any) -> Optional[str]:
+        self._usage = _merge_usage(self._usage, getattr(chunk, "usage_metadata", None))
+        text = _chunk_text(chunk)
+        if not text:
+            return None
+        if self.first_token_ms is None:
+            self.first_token_ms = self._ms()
+        self._parts.append(text)
+        return self._emit("delta", {"text": text})
+
+    def _complete(self) -> dict:
+        """on_complete 실행 (동기 코드). 실패해도 답변은 이미 전송됐으니 로깅만"""
+        if self.on_complete is None:
+            return {}
+        try:
+            return self.on_complete("".join(self._parts), self._usage) or {}
+        except Exception as e:
+            import traceback; traceback.print_exc()
+            print(f"[STREAM][ERR] 스트림 후처리 실패: {e}")
+            return {}
+
+    def _done(self, extra: dict) -> str:
+        done = {"answer": "".join(self._parts), "cached": False, "cache_age_seconds": 0, **self.done_extra, **extra}
+        done.update({"ttfb_ms": self.ttfb_ms, "first_token_ms": self.first_token_ms,
+                     "total_ms": self._ms(), "usage": self._usage})
+        self._status = "done"
+        return self._emit("done", done)
+
+    def _error(self, e: Exception) -> str:
+        import traceback; traceback.print_exc()
+        return self._emit("error", {"error": f"스트리밍 중 오류가 발생했습니다: {str(e)}"})
+
+    def _log(self) -> None:
+        print(f"[STREAM] {self.stage} status={self._status} fmt={self.fmt} chunks={len(self._parts)} "
+              f"ttfb_ms={self.ttfb_ms} first_token_ms={self.first_token_ms} total_ms={self._ms()}")
+
+    def _record_stage(self, start: float) -> None:
+        if self._stages is not None:
+            self._stages.record(self.stage, start, time.perf_counter())
+
+    def __iter__(self):
+        try:
+            for event, payload in self.prefix_events:
+                yield self._emit(event, payload)
+            start = time.perf_counter()
+            try:
+                for chunk in self.chunks:
+                    out = self._on_chunk(chunk)
+                    if out:
+                        yield out
+            finally:
+                self._record_stage(start)
+            yield self._done(self._complete())
+        except GeneratorExit:
+            # 클라이언트 연결 끊김: 이후 yield 불가, 어시스턴트 턴은 기록하지 않는다
+            self._status = "disconnected"
+            raise
+        except Exception as e:
+            yield self._error(e)
+        finally:
+            self._log()
+            if self.on_close is not None:
+                try:
+                    self.on_close()
+                except Exception as e:
+                    print(f"[STREAM][ERR] 요청 정리 실패: {e}")
+
+    async def aiter_events(self, offload: Offload):
+        """비동기 경로: self.chunks는 async iterable, on_complete/on_close는 offload로 스레드에서"""
+        try:
+            for event, payload in self.prefix_events:
+                yield self._emit(event, payload)
+            start = time.perf_counter()
+            try:
+                async for chunk in self.chunks:
+                    out = self._on_chunk(chunk)
+                    if out:
+                        yield out
+            finally:
+                self._record_stage(start)
+            extra = await offload(self._complete)
+            yield self._done(extra)
+        except GeneratorExit:
+            self._status = "disconnected"
+            raise
+        except Exception as e:
+            yield self._error(e)
+        finally:
+            self._log()
+            if self.on_close is not None:
+                try:
+                    await offload(self.on_close)
+                except Exception as e:
+                    print(f"[STREAM][ERR] 요청 정리 실패: {e}")
+
+
+def stream_response(stream: AnswerStream):
+    """AnswerStream → 청크 전송 https_fn.Response"""
+    from firebase_functions import https_fn
+
+    return https_fn.Response(response=iter(stream), status=200, headers=stream_headers(stream.fmt))
+
+
+class PendingAnswer:
+    """본 LLM 호출 직전까지 준비된 답변. 동기/스트리밍/비동기 중 하나로 1회 실행한다"""
+
+    def __init__(
+        self,
+        runnable: Any,
+        inputs: dict,
+        *,
+        config: Optional[dict] = None,
+        stage: str,
+        t0: float,
+        fields: Optional[dict] = None,
+        prefix_events: Iterable[tuple[str, dict]] = (),
+        on_complete: Optional[Callable[[str, Optional[dict]], Optional[dict]]] = None,
+        on_close: Optional[Callable[[], None]] = None,
+        done_extra: Optional[dict] = None,
+    ):
+        self.runnable = runnable
+        self.inputs = inputs
+        self.config = config
+        self.stage = stage
+        self.t0 = t0
+        self.fields = dict(fields or {})     # JSON 응답 본문에 같이 내려줄 필드
+        self.prefix_events = list(prefix_events)
+        self.on_complete = on_complete
+        self.on_close = on_close
+        self.done_extra = dict(done_extra or {})
+        self._stages = current_stages()
+
+    def _body(self, text: str, usage: Optional[dict]) -> dict:
+        extra = (self.on_complete(text, usage) or {}) if self.on_complete is not None else {}
+        return {**self.fields, "answer": text, **extra}
+
+    def _record_stage(self, start: float) -> None:
+        if self._stages is not None:
+            self._stages.record(self.stage, start, time.perf_counter())
+
+    def _stream(self, fmt: str, chunks: Any) -> AnswerStream:
+        return AnswerStream(
+            chunks, fmt=fmt, t0=self.t0, stage=self.stage,
+            prefix_events=self.prefix_events, on_complete=self.on_complete,
+            on_close=self.on_close, done_extra=self.done_extra,
+        )
+
+    # ── 동기 ──
+    def respond(self):
+        """invoke → JSON 응답 (요청 정리는 호출부 finally)"""
+        from firebase_functions import https_fn
+
+        start = time.perf_counter()
+        try:
+            result = self.runnable.invoke(self.inputs, config=self.config)
+        finally:
+            self._record_stage(start)
+        body = self._body(getattr(result, "content", str(result)), _result_usage(result))
+        return https_fn.Response(
+            response=json.dumps(body, ensure_ascii=False),
+            status=200,
+            headers={"Content-Type": "application/json; charset=utf-8"},
+        )
+
+    def stream(self, fmt: str):
+        """.stream() → SSE/NDJSON 청크 응답 (요청 정리는 스트림 종료 시 on_close)"""
+        return stream_response(self._stream(fmt, self.runnable.stream(self.inputs, config=self.config)))
+
+    # ── 비동기 ──
+    async def arespond(self, offload: Offload) -> dict:
+        """ainvoke → 응답 본문 dict. 후처리/정리는 offload로 스레드에서"""
+        try:
+            start = time.perf_counter()
+            try:
+                result = await self.runnable.ainvoke(self.inputs, config=self.config)
+            finally:
+                self._record_stage(start)
+            return await offload(self._body, getattr(result, "content", str(result)), _result_usage(result))
+        finally:
+            if self.on_close is not None:
+                await offload(self.on_close)
+
+    def astream(self, fmt: str, offload: Offload):
+        """.astream() → SSE/NDJSON 문자열 비동기 이터레이터"""
+        return self._stream(fmt, self.runnable.astream(self.inputs, config=self.config)).aiter_events(offload)
@@ -0,0 +1,224 @@
+# ================== 비동기(ASGI) 진입점 ==================
+# 같은 ask_saju 파이프라인을 이벤트 루프 위에서 돌려 인스턴스당 동시 대화 수를 늘린다.
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 8080        (uvicorn은 별도 설치: pip install uvicorn)
+#   POST /ask_saju (또는 /) : 본문/응답은 HTTPS 함수 ask_saju와 동일, "stream": true면 SSE/NDJSON
+#   GET  /healthz
+#
+# 요청 1건 흐름 (이벤트 루프 스레드에서는 블로킹 I/O를 하지 않는다)
+#   1) 준비    : _ask_saju_impl(req, defer=True)를 동기 풀에서 → 저장소 로드/메타 추출/회귀 판정 (PendingAnswer 반환)
+#   2) 본 LLM  : PendingAnswer.arespond / astream → ainvoke / astream (루프에서 대기, 스레드 점유 없음)
+#   3) 후처리  : 턴 기록·답변 캐시·저장소 flush를 다시 동기 풀에서
+#   1)과 3)은 요청마다 새로 만든 같은 contextvars.Context에서 실행 → 사용자/저장소 세션 컨텍스트가 이어진다.
+#   (두 단계는 순차라 같은 Context에 동시에 들어가지 않는다)
+#
+# - ASGI_SYNC_WORKERS (기본 32): 1)/3) 동기 단계용 스레드 풀 크기
+# - ASGI_MAX_INFLIGHT (기본 256): 동시 처리 요청 상한 (초과분은 asyncio.Semaphore에서 대기)
+# - ASK_SAJU_ASYNC=1 이면 기존 HTTPS 함수도 ask_saju_via_loop()로 이 경로를 탄다
+#   (프로세스 공유 이벤트 루프 스레드 1개, 스트리밍 요청은 동기 제너레이터 경로 유지)
+
+import asyncio
+import contextvars
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Optional
+
+from answer_stream import PendingAnswer, stream_format, stream_headers
+from env_conf import env_int
+
+_SYNC_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+_SEMAPHORES: dict = {}   # 이벤트 루프 -> asyncio.Semaphore (세마포어는 만든 루프에서만 쓸 수 있다)
+
+_JSON_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+
+
+def _sync_pool() -> ThreadPoolExecutor:
+    global _SYNC_POOL
+    if _SYNC_POOL is None:
+        with _POOL_LOCK:
+            if _SYNC_POOL is None:
+                _SYNC_POOL = ThreadPoolExecutor(max_workers=env_int("ASGI_SYNC_WORKERS", 32, lo=1),
+                                                thread_name_prefix="asgi-sync")
+    return _SYNC_POOL
+
+
+def _inflight() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _SEMAPHORES.get(loop)
+    if sem is None:
+        sem = _SEMAPHORES[loop] = asyncio.Semaphore(env_int("ASGI_MAX_INFLIGHT", 256, lo=1))
+    return sem
+
+
+def _offloader(ctx: contextvars.Context):
+    """동기 함수를 스레드 풀에서 ctx 안에서 실행하는 awaitable 팩토리 (PendingAnswer offload 인자)"""
+    loop = asyncio.get_running_loop()
+
+    async def offload(fn, *args, **kwargs):
+        return await loop.run_in_executor(_sync_pool(), functools.partial(ctx.run, fn, *args, **kwargs))
+
+    return offload
+
+
+class _Headers(dict):
+    """대소문자 무시 헤더 (Accept / accept)"""
+
+    def __init__(self, items):
+        super().__init__((str(k).lower(), v) for k, v in dict(items or {}).items())
+
+    def get(self, key, default=None):
+        return super().get(str(key).lower(), default)
+
+
+class _BodyRequest:
+    """ASGI 본문 → _ask_saju_impl이 쓰는 요청 인터페이스 (get_json / get_data / headers)"""
+
+    def __init__(self, body: bytes, headers: Any):
+        self._body = body or b""
+        self.headers = _Headers(headers)
+
+    def get_data(self, as_text: bool = False):
+        return self._body.decode("utf-8", errors="replace") if as_text else self._body
+
+    def get_json(self, silent: bool = False):
+        try:
+            return json.loads(self._body.decode("utf-8")) if self._body else None
+        except Exception:
+            if silent:
+                return None
+            raise
+
+
+async def handle_ask(body: bytes, headers: Any) -> tuple[int, dict, Any]:
+    """
+    요청 1건 처리. 반환: (status, headers, bytes | AsyncIterator[str])
+    AsyncIterator면 스트리밍 응답이며, 끝까지 소비(또는 aclose)해야 후처리/정리가 실행된다.
+    """
+    from main import _ask_saju_impl
+
+    req = _BodyRequest(body, headers)
+    ctx = contextvars.Context()          # 요청마다 빈 컨텍스트 (이전 요청 값이 새지 않게)
+    offload = _offloader(ctx)
+
+    out = await offload(_ask_saju_impl, req, defer=True)
+    if not isinstance(out, PendingAnswer):
+        # 조기 반환(캐시/중복/조회/오류): 이미 만들어진 https_fn.Response
+        data = await offload(out.get_data)
+        return out.status_code, dict(out.headers), data
+
+    fmt = stream_format(req.get_json(silent=True) or {}, req.headers)
+    if fmt:
+        return 200, stream_headers(fmt), out.astream(fmt, offload)
+    try:
+        answer = await out.arespond(offload)
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        answer_type = out.fields.get("answer_type")
+        err = {"answer_type": answer_type, "error": f"점괘 처리 중 오류: {str(e)}"} if answer_type == "fortune" \
+            else {"error": f"서버 처리 중 오류가 발생했습니다: {str(e)}"}
+        return 500, dict(_JSON_HEADERS), json.dumps(err, ensure_ascii=False).encode("utf-8")
+    return 200, dict(_JSON_HEADERS), json.dumps(answer, ensure_ascii=False).encode("utf-8")
+
+
+# ───────── ASGI 앱 ─────────
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            break
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_simple(send, status: int, headers: dict, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            # 지연 기록(CONVO_WRITE_MODE=async) 큐 비우기
+            try:
+                from conv_store import drain_write_behind
+                await asyncio.get_running_loop().run_in_executor(_sync_pool(), drain_write_behind)
+            except Exception as e:
+                print(f"[ASGI][WARN] shutdown drain 실패: {e}")
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope.get("path", "/"), scope.get("method", "GET")
+    if path == "/healthz":
+        return await _send_simple(send, 200, {"Content-Type": "text/plain"}, b"ok")
+    if path not in ("/", "/ask_saju"):
+        return await _send_simple(send, 404, dict(_JSON_HEADERS), b'{"error": "not found"}')
+    if method != "POST":
+        return await _send_simple(send, 405, dict(_JSON_HEADERS), b'{"error": "method not allowed"}')
+
+    body = await _read_body(receive)
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    async with _inflight():
+        status, out_headers, payload = await handle_ask(body, headers)
+        if isinstance(payload, (bytes, str)):
+            data = payload.encode("utf-8") if isinstance(payload, str) else payload
+            return await _send_simple(send, status, out_headers, data)
+
+        stream: AsyncIterator[str] = payload
+        try:
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in out_headers.items()]})
+            async for piece in stream:
+                await send({"type": "http.response.body", "body": piece.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            # 클라이언트가 끊겨 send가 실패해도 후처리/정리(on_close)는 실행되게
+            await stream.aclose()
+
+
+# ───────── 기존 HTTPS 함수 → 공유 이벤트 루프 ─────────
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    if _LOOP is None:
+        with _LOOP_LOCK:
+            if _LOOP is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ask-saju-loop", daemon=True).start()
+                _LOOP = loop
+                print("[ASGI] shared event loop started")
+    return _LOOP
+
+
+async def _handle_limited(body: bytes, headers: Any) -> tuple[int, dict, Any]:
+    async with _inflight():
+        return await handle_ask(body, headers)
+
+
+def ask_saju_via_loop(req):
+    """HTTPS 함수(Flask 요청) → 공유 루프에서 handle_ask 실행 후 결과를 기다린다 (ASK_SAJU_ASYNC=1)"""
+    from firebase_functions import https_fn
+    from main import _ask_saju_impl
+
+    data = req.get_json(silent=True) or {}
+    if stream_format(data, req.headers):
+        return _ask_saju_impl(req)   # 스트리밍은 동기 제너레이터 경로 그대로
+    fut = asyncio.run_coroutine_threadsafe(_handle_limited(req.get_data(), dict(req.headers)), _background_loop())
+    status, headers, payload = fut.result()
+    return https_fn.Response(response=payload, status=status, headers=headers)
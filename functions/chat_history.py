@@ -0,0 +1,162 @@
+# ================== 세션별 대화 히스토리 레지스트리 ==================
+# RunnableWithMessageHistory가 기록하는 메시지를 (사용자, 세션)별로 분리해 둔다.
+# (이전: 프로세스 전역 ChatMessageHistory 1개에 모든 사용자/세션 메시지가 쌓여 계속 커짐)
+# 상담/점괘 프롬프트는 {history}를 렌더링하지 않는다 — 대화 맥락은 요약(summary)과 회귀 FACT로 들어간다.
+# 그래서 저장소에서 미리 채우지(hydration) 않고, 체인이 남기는 메시지만 상한 안에서 보관한다.
+#
+#   key = history_key(session_id)            # 요청 스레드에서 만들어 config의 session_id로 넘긴다
+#   get_chat_history(key)                    # RunnableWithMessageHistory 팩토리
+#
+# - 키 "<user_id>::<session_id>": 비동기 경로처럼 사용자 컨텍스트가 없는 곳에서 팩토리가 불려도 같은 키.
+# - CHAT_HISTORY_MAX_MESSAGES (기본: CONVO_MAX_TURNS): 세션당 메시지 상한 (저장소 hot 구간과 같은 창)
+# - CHAT_HISTORY_MAX_SESSIONS (기본 512) / CHAT_HISTORY_MAX_BYTES (기본 32MB, 메시지 본문 UTF-8 합)
+#   둘 중 하나라도 넘으면 가장 오래 안 쓴 세션부터 내보낸다.
+
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from conv_store import _max_turns, get_current_user_id
+from env_conf import env_int
+
+
+def _max_messages() -> int:
+    return env_int("CHAT_HISTORY_MAX_MESSAGES", _max_turns(), lo=1)
+
+
+def _msg_bytes(m: BaseMessage) -> int:
+    content = m.content if isinstance(m.content, str) else str(m.content)
+    return len(content.encode("utf-8"))
+
+
+def history_key(session_id: str, user_id: Optional[str] = None) -> str:
+    """(사용자, 세션) 히스토리 키. user_id 없으면 현재 사용자 컨텍스트"""
+    uid = user_id or get_current_user_id() or "anon"
+    return f"{uid}::{session_id}"
+
+
+class BoundedChatHistory(BaseChatMessageHistory):
+    """세션 1개 메시지 (최근 max_messages개만 유지)"""
+
+    def __init__(self, key: str, messages: Sequence[BaseMessage] = (), max_messages: Optional[int] = None):
+        self.key = key
+        self.max_messages = max_messages or _max_messages()
+        self.messages: list[BaseMessage] = list(messages)[-self.max_messages:]
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        with _REGISTRY.lock:
+            self.messages.extend(messages)
+            if len(self.messages) > self.max_messages:
+                del self.messages[:-self.max_messages]
+            _REGISTRY.note_change(self)
+
+    def clear(self) -> None:
+        with _REGISTRY.lock:
+            self.messages = []
+            _REGISTRY.note_change(self)
+
+    def nbytes(self) -> int:
+        return sum(_msg_bytes(m) for m in self.messages)
+
+
+class ChatHistoryRegistry:
+    """세션 히스토리 LRU (세션 수 + 메시지 바이트 예산)"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._items: "OrderedDict[str, BoundedChatHistory]" = OrderedDict()
+        self._bytes: dict[str, int] = {}
+        self._total = 0
+        self.stats = {"evicted": 0}
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self._items
+
+    def get(self, key: str) -> BoundedChatHistory:
+        """키의 히스토리 (없으면 빈 히스토리 생성). 최근 사용으로 표시"""
+        with self.lock:
+            hist = self._items.get(key)
+            if hist is None:
+                hist = self.put(BoundedChatHistory(key))
+            else:
+                self._items.move_to_end(key)
+            return hist
+
+    def put(self, hist: BoundedChatHistory) -> BoundedChatHistory:
+        with self.lock:
+            self._drop(hist.key)
+            self._items[hist.key] = hist
+            self.note_change(hist)
+            return hist
+
+    def note_change(self, hist: BoundedChatHistory) -> None:
+        """메시지 변경 후 바이트 재계산 + 예산 초과분 내보내기 (lock 안에서 호출)"""
+        if self._items.get(hist.key) is not hist:
+            return   # 이미 내보낸 히스토리 (진행 중이던 체인이 뒤늦게 기록) → 무시
+        n = hist.nbytes()
+        self._total += n - self._bytes.get(hist.key, 0)
+        self._bytes[hist.key] = n
+        self._enforce(keep=hist.key)
+
+    def _drop(self, key: str) -> bool:
+        if self._items.pop(key, None) is None:
+            return False
+        self._total -= self._bytes.pop(key, 0)
+        return True
+
+    def _enforce(self, keep: str) -> None:
+        max_sessions = env_int("CHAT_HISTORY_MAX_SESSIONS", 512, lo=1)
+        max_bytes = env_int("CHAT_HISTORY_MAX_BYTES", 32 * 1024 * 1024, lo=1)
+        while len(self._items) > max_sessions or self._total > max_bytes:
+            victim = next((k for k in self._items if k != keep), None)
+            if victim is None:
+                break
+            self._drop(victim)
+            self.stats["evicted"] += 1
+
+    def evict(self, key: str) -> bool:
+        with self.lock:
+            return self._drop(key)
+
+    def evict_prefix(self, prefix: str) -> int:
+        with self.lock:
+            keys = [k for k in self._items if k.startswith(prefix)]
+            for k in keys:
+                self._drop(k)
+            return len(keys)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {**self.stats, "sessions": len(self._items), "bytes": self._total}
+
+
+_REGISTRY = ChatHistoryRegistry()
+
+
+def get_chat_history(key: str) -> BoundedChatHistory:
+    """RunnableWithMessageHistory get_session_history 팩토리 (config session_id = history_key)"""
+    return _REGISTRY.get(key)
+
+
+def evict_chat_history(session_id: str, user_id: Optional[str] = None) -> bool:
+    """세션 히스토리 내보내기 (저장소 삭제/초기화 후)"""
+    return _REGISTRY.evict(history_key(session_id, user_id))
+
+
+def evict_user_chat_histories(user_id: Optional[str]) -> int:
+    """사용자의 모든 세션 히스토리 내보내기 (reset / delete_history)"""
+    if not user_id:
+        return 0
+    return _REGISTRY.evict_prefix(f"{user_id}::")
+
+
+def get_chat_history_stats() -> dict:
+    """{"sessions", "bytes", "evicted"}"""
+    return _REGISTRY.snapshot()
@@ -0,0 +1,723 @@
+# ================== 대화 저장소 백엔드 (ConversationStore) ==================
+# conv_store의 _db_read/_db_write/flush/삭제는 모두 여기 백엔드 객체로 위임된다.
+# 백엔드는 CONVO_BACKEND 로 고른다 (conv_store._store_backend_name 참고):
+#
+#   auto   : 클라우드 환경이면 gcs, 아니면 local (기존 동작)
+#   gcs    : GcsStore        — gs://<GCS_BUCKET>/users/<앱UID>/profiles/<user_id>.json
+#   local  : LocalFileStore  — <CONVO_BASE>/users/<앱UID>/profiles/<user_id>.json (.tmp → os.replace)
+#   sqlite : SQLiteStore     — CONVO_SQLITE_PATH (기본 <CONVO_BASE>/convos.sqlite3), WAL 모드
+#   memory : MemoryStore     — 프로세스 메모리 (테스트/벤치마크)
+#
+# key 는 conv_store._resolve_store_path()가 만든 경로 문자열 그대로다.
+# 파일 백엔드(gcs/local)는 CONVO_STORE_FORMAT(doc|segmented|sessions)을 따른다.
+# sqlite/memory 는 포맷과 무관하게 세션/턴 단위로 저장한다.
+#
+# 동시 요청(재시도 요청, 앱 탭 2개 등)의 낙관적 동시성:
+#   load_with_version()이 돌려준 버전을 apply_ops/save(expected_version=...)에 넘기면
+#   그 사이 다른 요청이 기록한 경우 StoreConflict를 낸다.
+#   → conv_store.StoreSession이 최신본을 다시 읽고 op를 재적용해 재시도한다.
+#   (gcs/local: generation·mtime 조건부 쓰기, sqlite/memory: 프로필 version 비교.
+#    sqlite/memory의 apply_ops는 행/op 단위 반영이라 추가끼리는 충돌하지 않는다.)
+#
+# 트림으로 hot 구간에서 밀려난 턴은 archive_turns()로 세션별 cold 아카이브에 옮긴다.
+#   gcs/local    : 문서 옆 <user_id>.cold/ 압축 청크 (conv_formats), StoreSession이 본 기록 전에 호출
+#   sqlite/memory/segmented: apply_ops의 trim이 실제로 지운 턴을 그 자리에서 옮긴다 (archives_on_trim=True)
+#
+# 클라이언트 request_id의 완료 응답은 save_replay()/load_replay()로 남긴다 (request_replay.py 참고).
+#   gcs/local    : 문서 옆 <user_id>.replay/<hash>.json (conv_formats)
+#   sqlite/memory: replays 테이블 / dict
+
+import os, json, sqlite3, threading
+from contextlib import contextmanager
+
+from conv_store import (
+    _apply_op,
+    _db_manifest,
+    _session_summary,
+    _doc_cache_evict,
+    _doc_read,
+    _doc_write,
+    _json_clone,
+    _doc_read_versioned,
+    _new_db_skeleton,
+    _normalize_db,
+    _store_backend_name,
+    _store_delete,
+    _store_format,
+    StoreConflict,
+    get_current_session,
+)
+
+
+class ConversationStore:
+    """
+    대화 저장소 인터페이스.
+    db 모양은 기존과 같다: {"version": 1, "user"?: {...}, "sessions": {sid: {"meta", "turns"}}}
+    """
+
+    name = "base"
+    archives_on_trim = False     # True면 apply_ops의 trim이 밀려난 턴을 직접 아카이브
+
+    # --- 문서 단위 (기존 호출부 호환) ---
+    def load(self, key: str) -> dict:
+        raise NotImplementedError
+
+    def load_with_version(self, key: str) -> tuple[dict, object]:
+        """(db, 버전). 버전은 apply_ops/save의 expected_version으로 넘긴다 (None = 조건 없음)"""
+        return self.load(key), None
+
+    def save(self, key: str, db: dict, *, expected_version=None) -> None:
+        raise NotImplementedError
+
+    def apply_ops(self, key: str, ops: list[dict], db: dict, *, expected_version=None) -> None:
+        """요청 1건의 op(session/append/trim) 반영. 기본: op를 세션/턴 단위 메서드로 분배"""
+        for op in ops:
+            kind = op["op"]
+            if kind == "session":
+                self.ensure_session(key, op["sid"], op.get("meta") or {})
+            elif kind == "append":
+                self.append_turns(key, op["sid"], [op["turn"]], meta=op.get("meta"))
+            elif kind == "trim":
+                self.trim(key, op["sid"], int(op["max_turns"]))
+        if db.get("user"):
+            self.set_user(key, db["user"])
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    # --- 세션/턴 단위 ---
+    def load_session(self, key: str, session_id: str) -> dict | None:
+        """{"meta", "turns"} 또는 None"""
+        return (self.load(key).get("sessions") or {}).get(session_id)
+
+    def load_session_turns(self, key: str, session_id: str, last_n: int | None = None) -> list[dict] | None:
+        sess = self.load_session(key, session_id)
+        if sess is None:
+            return None
+        turns = list(sess.get("turns") or [])
+        return turns[-last_n:] if last_n else turns
+
+    def ensure_session(self, key: str, session_id: str, meta: dict) -> None:
+        db = self.load(key)
+        _apply_op(db, {"op": "session", "sid": session_id, "meta": meta})
+        self.save(key, db)
+
+    def append_turns(self, key: str, session_id: str, turns: list[dict], *, meta: dict | None = None) -> None:
+        db = self.load(key)
+        for t in turns:
+            _apply_op(db, {"op": "append", "sid": session_id, "turn": t, "meta": meta})
+        self.save(key, db)
+
+    def trim(self, key: str, session_id: str, max_turns: int) -> int:
+        db = self.load(key)
+        sess = (db.get("sessions") or {}).get(session_id) or {}
+        before = len(sess.get("turns") or [])
+        _apply_op(db, {"op": "trim", "sid": session_id, "max_turns": max_turns})
+        self.save(key, db)
+        return max(0, before - max_turns)
+
+    def set_user(self, key: str, user: dict) -> None:
+        pass
+
+    def load_manifest(self, key: str) -> dict[str, dict]:
+        """{sid: 세션 요약} (conv_store 세션 매니페스트 참고). 기본: 문서를 읽어 db["manifest"]"""
+        return _db_manifest(self.load(key))
+
+    def list_sessions(self, key: str) -> list[dict]:
+        """[{session_id, title, created_at, turns, last_ts}] — 매니페스트만 읽는다"""
+        return [
+            {"session_id": sid, "title": e.get("title") or "", "created_at": e.get("created_at") or "",
+             "turns": int(e.get("turns") or 0), "last_ts": e.get("last_ts") or ""}
+            for sid, e in self.load_manifest(key).items()
+        ]
+
+    # --- cold 아카이브 ---
+    def archive_turns(self, key: str, session_id: str, turns: list[dict]) -> None:
+        """hot 구간에서 밀려난 턴을 세션 cold 아카이브에 추가. 기본: 키 경로 옆 압축 청크"""
+        import conv_formats
+        conv_formats.write_cold_chunk(key, session_id, turns)
+
+    def load_archive(self, key: str, session_id: str) -> list[dict]:
+        """세션 cold 턴 (오래된 순). 요청 경로가 아니라 검색/내보내기에서만 호출"""
+        import conv_formats
+        return conv_formats.read_cold_turns(key, session_id)
+
+    # --- 요청 재전송 기록 (request_id → 완료 응답) ---
+    def load_replay(self, key: str, request_id: str) -> dict | None:
+        """{"request_id", "stored_at", "session_id", "body"} 또는 None (만료 판단은 호출부)"""
+        import conv_formats
+        return conv_formats.read_replay(key, request_id)
+
+    def save_replay(self, key: str, request_id: str, rec: dict, *, ttl_s: float = 0) -> None:
+        """ttl_s: 만료분 정리 기준 (파일 백엔드는 읽을 때 정리하므로 쓰지 않음)"""
+        import conv_formats
+        conv_formats.write_replay(key, request_id, rec)
+
+    def delete_replay(self, key: str, request_id: str | None = None) -> bool:
+        """기록 1건 (request_id=None이면 key의 전체) 삭제"""
+        import conv_formats
+        return conv_formats.delete_replay(key, request_id)
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+# ---------------------------------------------------------------- 파일 (gcs/local)
+
+class FileStore(ConversationStore):
+    """경로(gs:// 또는 로컬) 기반 문서 저장. CONVO_STORE_FORMAT을 따른다."""
+
+    name = "file"
+
+    @property
+    def archives_on_trim(self) -> bool:
+        # segmented: append_ops가 최신 manifest에 op를 합치므로 실제로 잘린 턴을 거기서 아카이브
+        return _store_format() == "segmented"
+
+    def load(self, key: str) -> dict:
+        fmt = _store_format()
+        if fmt in ("segmented", "sessions"):
+            import conv_formats
+            if fmt == "segmented":
+                db = conv_formats.read_segmented(key)
+            else:
+                db = conv_formats.read_sessions(key, get_current_session())
+            if db is not None:
+                return db
+        return _doc_read(key)
+
+    def load_with_version(self, key: str) -> tuple[dict, object]:
+        fmt = _store_format()
+        if fmt == "segmented":
+            # manifest generation은 append_ops가 기록 직전에 직접 확인한다
+            import conv_formats
+            db = conv_formats.read_segmented(key)
+            if db is not None:
+                return db, None
+            return _doc_read(key), None
+        if fmt == "sessions":
+            import conv_formats
+            sid = get_current_session()
+            db, version = conv_formats.read_sessions_versioned(key, sid)
+            if db is not None:
+                return db, version
+            # 아직 v1 문서 → 활성 세션 객체는 '없어야 함' 조건으로 첫 기록 (이전 중 경합 감지)
+            return _doc_read(key), ({sid: 0} if sid else None)
+        return _doc_read_versioned(key)
+
+    def save(self, key: str, db: dict, *, expected_version=None) -> None:
+        fmt = _store_format()
+        if fmt == "segmented":
+            import conv_formats
+            conv_formats.write_snapshot(key, db)
+        elif fmt == "sessions":
+            import conv_formats
+            conv_formats.write_sessions(key, db, expected=expected_version)
+        else:
+            _doc_write(key, db, if_generation_match=expected_version)
+
+    def apply_ops(self, key: str, ops: list[dict], db: dict, *, expected_version=None) -> None:
+        fmt = _store_format()
+        if fmt == "segmented":
+            # 이번 요청의 op만 새 세그먼트로 추가 (문서 전체 재기록 X)
+            import conv_formats
+            conv_formats.append_ops(key, ops, db)
+        elif fmt == "sessions":
+            # op가 건드린 세션 객체 + 인덱스만 기록
+            import conv_formats
+            conv_formats.write_sessions(key, db, {op["sid"] for op in ops}, expected=expected_version)
+        else:
+            # doc 포맷은 문서 전체 1회 기록 (요청 세션이 이미 op를 db에 반영해 둠)
+            _doc_write(key, db, if_generation_match=expected_version)
+
+    def delete(self, key: str) -> bool:
+        _doc_cache_evict(key)
+        fmt = _store_format()
+        removed = False
+        if fmt in ("segmented", "sessions"):
+            import conv_formats
+            if fmt == "segmented":
+                removed = conv_formats.delete_segmented(key)
+            else:
+                removed = conv_formats.delete_sessions(key)
+        import conv_formats
+        removed = conv_formats.delete_cold(key) or removed
+        removed = conv_formats.delete_replay(key) or removed
+        return _store_delete(key) or removed
+
+    def load_session_turns(self, key: str, session_id: str, last_n: int | None = None) -> list[dict] | None:
+        fmt = _store_format()
+        if fmt == "segmented":
+            import conv_formats
+            return conv_formats.read_session_tail(key, session_id, last_n)
+        if fmt == "sessions":
+            import conv_formats
+            obj = conv_formats.read_session_object(key, session_id)
+            if obj is None:
+                return None
+            turns = list(obj.get("turns") or [])
+            return turns[-last_n:] if last_n else turns
+        return super().load_session_turns(key, session_id, last_n)
+
+    def load_manifest(self, key: str) -> dict[str, dict]:
+        fmt = _store_format()
+        if fmt in ("segmented", "sessions"):
+            import conv_formats
+            if fmt == "segmented":
+                manifest = conv_formats.read_segmented_manifest(key)
+            else:
+                manifest = conv_formats.read_sessions_manifest(key)
+            if manifest is not None:
+                return manifest
+        return super().load_manifest(key)
+
+    def stats(self) -> dict:
+        from conv_store import get_doc_cache_stats
+        return {"backend": self.name, "format": _store_format(), "doc_cache": get_doc_cache_stats()}
+
+
+class GcsStore(FileStore):
+    """gs://<GCS_BUCKET>/... 객체 (공유 클라이언트 + generation 검증 캐시)"""
+
+    name = "gcs"
+
+    def stats(self) -> dict:
+        from conv_store import get_gcs_stats
+        return {**super().stats(), "gcs": get_gcs_stats()}
+
+
+class LocalFileStore(FileStore):
+    """<CONVO_BASE>/... 로컬 파일 (.tmp → os.replace 원자적 쓰기)"""
+
+    name = "local"
+
+
+# ---------------------------------------------------------------- SQLite (WAL)
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    key        TEXT PRIMARY KEY,
+    user_json  TEXT,
+    version    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    key        TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    meta_json  TEXT NOT NULL,
+    created_at TEXT,
+    PRIMARY KEY (key, session_id)
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    key        TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    ts         TEXT NOT NULL DEFAULT '',
+    turn_json  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_turns_session_ts ON turns (key, session_id, ts);
+CREATE TABLE IF NOT EXISTS cold_chunks (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    key        TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    data       BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cold_session ON cold_chunks (key, session_id);
+CREATE TABLE IF NOT EXISTS replays (
+    key        TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    stored_at  REAL NOT NULL,
+    rec_json   TEXT NOT NULL,
+    PRIMARY KEY (key, request_id)
+);
+CREATE INDEX IF NOT EXISTS idx_replays_stored_at ON replays (stored_at);
+"""
+
+
+class SQLiteStore(ConversationStore):
+    """
+    로컬 SQLite 파일 하나에 프로필/세션/턴을 행 단위로 저장.
+    - journal_mode=WAL, synchronous=NORMAL (읽기와 쓰기가 서로 막지 않음)
+    - 턴 조회/트림은 (key, session_id, ts) 인덱스로 세션 단위 처리
+    - 요청 1건의 op는 한 트랜잭션으로 반영
+    - 트림으로 지우는 턴은 같은 트랜잭션에서 cold_chunks(gzip JSONL)로 옮긴다
+    """
+
+    name = "sqlite"
+    archives_on_trim = True
+
+    def __init__(self, path: str | None = None):
+        base = os.getenv("CONVO_BASE", "./data")
+        self.path = path or os.getenv("CONVO_SQLITE_PATH") or os.path.join(os.path.abspath(base), "convos.sqlite3")
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SQLITE_SCHEMA)
+        print(f"[STORE][SQLITE] {self.path}")
+
+    @contextmanager
+    def _tx(self):
+        """BEGIN IMMEDIATE ~ COMMIT (예외 시 ROLLBACK)"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- 내부 SQL 헬퍼 ---
+    @staticmethod
+    def _ensure_session_row(conn, key: str, session_id: str, meta: dict | None) -> None:
+        probe = {"sessions": {}}
+        _apply_op(probe, {"op": "session", "sid": session_id, "meta": meta})
+        meta = probe["sessions"][session_id]["meta"]
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (key, session_id, meta_json, created_at) VALUES (?, ?, ?, ?)",
+            (key, session_id, json.dumps(meta, ensure_ascii=False), meta.get("created_at") or ""),
+        )
+
+    @staticmethod
+    def _insert_turn(conn, key: str, session_id: str, turn: dict) -> None:
+        conn.execute(
+            "INSERT INTO turns (key, session_id, ts, turn_json) VALUES (?, ?, ?, ?)",
+            (key, session_id, str(turn.get("ts") or ""), json.dumps(turn, ensure_ascii=False)),
+        )
+
+    @staticmethod
+    def _bump_version(conn, key: str, expected_version=None, user: dict | None = None) -> int:
+        """프로필 version +1 (expected_version이 있으면 현재 값과 같아야 함)"""
+        row = conn.execute("SELECT version FROM profiles WHERE key = ?", (key,)).fetchone()
+        current = row[0] if row else 0
+        if expected_version is not None and current != expected_version:
+            raise StoreConflict(key, expected_version)
+        if row:
+            conn.execute("UPDATE profiles SET version = ? WHERE key = ?", (current + 1, key))
+        else:
+            conn.execute("INSERT INTO profiles (key, user_json, version) VALUES (?, NULL, 1)", (key,))
+        if user:
+            conn.execute("UPDATE profiles SET user_json = ? WHERE key = ?", (json.dumps(user, ensure_ascii=False), key))
+        return current + 1
+
+    @staticmethod
+    def _insert_cold(conn, key: str, session_id: str, turns: list[dict]) -> None:
+        import conv_formats
+        if turns:
+            conn.execute(
+                "INSERT INTO cold_chunks (key, session_id, data) VALUES (?, ?, ?)",
+                (key, session_id, conv_formats.encode_cold_chunk(turns)),
+            )
+
+    @classmethod
+    def _trim_rows(cls, conn, key: str, session_id: str, max_turns: int) -> int:
+        rows = conn.execute(
+            """
+            SELECT id, turn_json FROM turns WHERE key = ? AND session_id = ? AND id NOT IN (
+                SELECT id FROM turns WHERE key = ? AND session_id = ?
+                ORDER BY ts DESC, id DESC LIMIT ?
+            ) ORDER BY ts, id
+            """,
+            (key, session_id, key, session_id, max_turns),
+        ).fetchall()
+        if not rows:
+            return 0
+        cls._insert_cold(conn, key, session_id, [json.loads(r[1]) for r in rows])
+        conn.executemany("DELETE FROM turns WHERE id = ?", [(r[0],) for r in rows])
+        return len(rows)
+
+    # --- 문서 단위 ---
+    def load_with_version(self, key: str) -> tuple[dict, object]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM profiles WHERE key = ?", (key,)).fetchone()
+            return self.load(key), (row[0] if row else 0)
+
+    def load(self, key: str) -> dict:
+        with self._lock:
+            db = {"version": 1, "sessions": {}}
+            row = self._conn.execute("SELECT user_json FROM profiles WHERE key = ?", (key,)).fetchone()
+            if row and row[0]:
+                db["user"] = json.loads(row[0])
+            rows = self._conn.execute(
+                "SELECT session_id, meta_json FROM sessions WHERE key = ? ORDER BY rowid", (key,)
+            ).fetchall()
+            if not rows and not row:
+                return _new_db_skeleton()
+            for sid, meta_json in rows:
+                db["sessions"][sid] = {"meta": json.loads(meta_json), "turns": []}
+            for sid, turn_json in self._conn.execute(
+                "SELECT session_id, turn_json FROM turns WHERE key = ? ORDER BY session_id, ts, id", (key,)
+            ):
+                db["sessions"].setdefault(sid, {"meta": {"session_id": sid}, "turns": []})["turns"].append(json.loads(turn_json))
+        return db
+
+    def save(self, key: str, db: dict, *, expected_version=None) -> None:
+        """전체 스냅샷: key의 세션/턴을 db 내용으로 교체"""
+        _normalize_db(db)
+        with self._tx() as conn:
+            self._bump_version(conn, key, expected_version, db.get("user"))
+            conn.execute("DELETE FROM turns WHERE key = ?", (key,))
+            conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            for sid, sess in db["sessions"].items():
+                self._ensure_session_row(conn, key, sid, sess.get("meta") or {"session_id": sid})
+                for t in sess.get("turns") or []:
+                    self._insert_turn(conn, key, sid, t)
+
+    def apply_ops(self, key: str, ops: list[dict], db: dict, *, expected_version=None) -> None:
+        # 행 단위 추가/트림을 한 트랜잭션으로 → 그 사이의 다른 요청 기록과 합쳐진다 (version 검사 생략)
+        with self._tx() as conn:
+            self._bump_version(conn, key, None, db.get("user"))
+            for op in ops:
+                kind = op["op"]
+                if kind in ("session", "append"):
+                    self._ensure_session_row(conn, key, op["sid"], op.get("meta"))
+                if kind == "append":
+                    self._insert_turn(conn, key, op["sid"], op["turn"])
+                elif kind == "trim":
+                    self._trim_rows(conn, key, op["sid"], int(op["max_turns"]))
+
+    def delete(self, key: str) -> bool:
+        with self._tx() as conn:
+            n = conn.execute("DELETE FROM turns WHERE key = ?", (key,)).rowcount or 0
+            n += conn.execute("DELETE FROM sessions WHERE key = ?", (key,)).rowcount or 0
+            n += conn.execute("DELETE FROM profiles WHERE key = ?", (key,)).rowcount or 0
+            n += conn.execute("DELETE FROM cold_chunks WHERE key = ?", (key,)).rowcount or 0
+            n += conn.execute("DELETE FROM replays WHERE key = ?", (key,)).rowcount or 0
+        print(f"[DEL] SQLite {'deleted' if n else 'not found'}: {key}")
+        return n > 0
+
+    # --- 세션/턴 단위 ---
+    def load_session(self, key: str, session_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta_json FROM sessions WHERE key = ? AND session_id = ?", (key, session_id)
+            ).fetchone()
+            if not row:
+                return None
+            turns = [json.loads(r[0]) for r in self._conn.execute(
+                "SELECT turn_json FROM turns WHERE key = ? AND session_id = ? ORDER BY ts, id", (key, session_id)
+            )]
+        return {"meta": json.loads(row[0]), "turns": turns}
+
+    def load_session_turns(self, key: str, session_id: str, last_n: int | None = None) -> list[dict] | None:
+        if not last_n:
+            sess = self.load_session(key, session_id)
+            return None if sess is None else sess["turns"]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT turn_json FROM turns WHERE key = ? AND session_id = ? ORDER BY ts DESC, id DESC LIMIT ?",
+                (key, session_id, last_n),
+            ).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def ensure_session(self, key: str, session_id: str, meta: dict) -> None:
+        with self._tx() as conn:
+            self._ensure_session_row(conn, key, session_id, meta)
+
+    def append_turns(self, key: str, session_id: str, turns: list[dict], *, meta: dict | None = None) -> None:
+        with self._tx() as conn:
+            self._ensure_session_row(conn, key, session_id, meta)
+            for t in turns:
+                self._insert_turn(conn, key, session_id, t)
+
+    def trim(self, key: str, session_id: str, max_turns: int) -> int:
+        with self._tx() as conn:
+            return self._trim_rows(conn, key, session_id, max_turns)
+
+    def set_user(self, key: str, user: dict) -> None:
+        with self._tx() as conn:
+            self._bump_version(conn, key, None, user)
+
+    def archive_turns(self, key: str, session_id: str, turns: list[dict]) -> None:
+        with self._tx() as conn:
+            self._insert_cold(conn, key, session_id, turns)
+
+    def load_archive(self, key: str, session_id: str) -> list[dict]:
+        import conv_formats
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM cold_chunks WHERE key = ? AND session_id = ? ORDER BY id", (key, session_id)
+            ).fetchall()
+        return [t for (data,) in rows for t in conv_formats.decode_cold_chunk(data)]
+
+    def load_replay(self, key: str, request_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rec_json FROM replays WHERE key = ? AND request_id = ?", (key, request_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_replay(self, key: str, request_id: str, rec: dict, *, ttl_s: float = 0) -> None:
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO replays (key, request_id, stored_at, rec_json) VALUES (?, ?, ?, ?)",
+                (key, request_id, float(rec.get("stored_at") or 0), json.dumps(rec, ensure_ascii=False)),
+            )
+            # 만료분 정리 (stored_at 인덱스)
+            if ttl_s:
+                conn.execute("DELETE FROM replays WHERE stored_at < ?", (float(rec.get("stored_at") or 0) - ttl_s,))
+
+    def delete_replay(self, key: str, request_id: str | None = None) -> bool:
+        with self._tx() as conn:
+            if request_id is None:
+                return (conn.execute("DELETE FROM replays WHERE key = ?", (key,)).rowcount or 0) > 0
+            return (conn.execute(
+                "DELETE FROM replays WHERE key = ? AND request_id = ?", (key, request_id)
+            ).rowcount or 0) > 0
+
+    def load_manifest(self, key: str) -> dict[str, dict]:
+        # 세션별 턴 수 + 끝쪽 몇 턴만 (key, session_id, ts) 인덱스로 읽어 요약
+        out = {}
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT s.session_id, s.meta_json, COUNT(t.id)
+                FROM sessions s LEFT JOIN turns t ON t.key = s.key AND t.session_id = s.session_id
+                WHERE s.key = ? GROUP BY s.session_id ORDER BY s.rowid
+                """,
+                (key,),
+            ).fetchall()
+            for sid, meta_json, count in rows:
+                tail = [json.loads(r[0]) for r in reversed(self._conn.execute(
+                    "SELECT turn_json FROM turns WHERE key = ? AND session_id = ? ORDER BY ts DESC, id DESC LIMIT 8",
+                    (key, sid),
+                ).fetchall())]
+                entry = _session_summary(sid, {"meta": json.loads(meta_json), "turns": tail})
+                entry["turns"] = int(count)
+                out[sid] = entry
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            turns = self._conn.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+        return {"backend": self.name, "path": self.path, "sessions": sessions, "turns": turns}
+
+
+# ---------------------------------------------------------------- 메모리
+
+class MemoryStore(ConversationStore):
+    """프로세스 메모리 dict (테스트/벤치마크용). 읽기/쓰기 모두 사본으로 주고받는다."""
+
+    name = "memory"
+    archives_on_trim = True
+
+    def __init__(self):
+        self._docs: dict[str, dict] = {}
+        self._versions: dict[str, int] = {}
+        self._cold: dict[tuple[str, str], list[dict]] = {}
+        self._replays: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self, key: str) -> dict:
+        return self.load_with_version(key)[0]
+
+    def load_with_version(self, key: str) -> tuple[dict, object]:
+        with self._lock:
+            db = self._docs.get(key)
+            version = self._versions.get(key, 0)
+            return (_json_clone(db) if db is not None else _new_db_skeleton()), version
+
+    def save(self, key: str, db: dict, *, expected_version=None) -> None:
+        with self._lock:
+            if expected_version is not None and self._versions.get(key, 0) != expected_version:
+                raise StoreConflict(key, expected_version)
+            self._docs[key] = _json_clone(_normalize_db(db))
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def apply_ops(self, key: str, ops: list[dict], db: dict, *, expected_version=None) -> None:
+        # 현재 문서에 op만 적용 → 다른 요청의 추가와 합쳐진다
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            cur = self._docs.get(key)
+            if cur is None:
+                cur = self._docs[key] = _new_db_skeleton()
+            for op in ops:
+                evicted = _apply_op(cur, _json_clone(op))
+                if evicted:
+                    self._cold.setdefault((key, op["sid"]), []).extend(evicted)
+            if db.get("user"):
+                cur["user"] = _json_clone(db["user"])
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._versions.pop(key, None)
+            for ck in [ck for ck in self._cold if ck[0] == key]:
+                del self._cold[ck]
+            for rk in [rk for rk in self._replays if rk[0] == key]:
+                del self._replays[rk]
+            return self._docs.pop(key, None) is not None
+
+    def archive_turns(self, key: str, session_id: str, turns: list[dict]) -> None:
+        with self._lock:
+            self._cold.setdefault((key, session_id), []).extend(_json_clone(turns))
+
+    def load_archive(self, key: str, session_id: str) -> list[dict]:
+        with self._lock:
+            return _json_clone(self._cold.get((key, session_id)) or [])
+
+    def load_replay(self, key: str, request_id: str) -> dict | None:
+        with self._lock:
+            rec = self._replays.get((key, request_id))
+            return _json_clone(rec) if rec is not None else None
+
+    def save_replay(self, key: str, request_id: str, rec: dict, *, ttl_s: float = 0) -> None:
+        with self._lock:
+            if ttl_s:
+                cutoff = float(rec.get("stored_at") or 0) - ttl_s
+                for rk in [rk for rk, r in self._replays.items() if float(r.get("stored_at") or 0) < cutoff]:
+                    del self._replays[rk]
+            self._replays[(key, request_id)] = _json_clone(rec)
+
+    def delete_replay(self, key: str, request_id: str | None = None) -> bool:
+        with self._lock:
+            keys = [rk for rk in self._replays if rk[0] == key and request_id in (None, rk[1])]
+            for rk in keys:
+                del self._replays[rk]
+            return bool(keys)
+
+    def set_user(self, key: str, user: dict) -> None:
+        with self._lock:
+            self._docs.setdefault(key, _new_db_skeleton())["user"] = _json_clone(user)
+
+    def stats(self) -> dict:
+        with self._lock:
+            turns = sum(len(s.get("turns") or []) for d in self._docs.values() for s in d["sessions"].values())
+            return {"backend": self.name, "profiles": len(self._docs), "turns": turns}
+
+
+# ---------------------------------------------------------------- 선택
+
+_STORES: dict[str, ConversationStore] = {}
+_STORES_LOCK = threading.Lock()
+_BACKENDS = {
+    "gcs": GcsStore,
+    "local": LocalFileStore,
+    "sqlite": SQLiteStore,
+    "memory": MemoryStore,
+}
+
+
+def get_conversation_store(name: str | None = None) -> ConversationStore:
+    """CONVO_BACKEND(또는 name)에 맞는 백엔드 (프로세스당 1개씩 재사용)"""
+    name = (name or _store_backend_name()).strip().lower()
+    store = _STORES.get(name)
+    if store is not None:
+        return store
+    with _STORES_LOCK:
+        store = _STORES.get(name)
+        if store is None:
+            cls = _BACKENDS.get(name)
+            if cls is None:
+                raise ValueError(f"unknown CONVO_BACKEND='{name}' (gcs|local|sqlite|memory|auto)")
+            store = _STORES[name] = cls()
+            print(f"[STORE] backend={name}")
+    return store
+
+
+def reset_conversation_stores() -> None:
+    """테스트/벤치마크에서 백엔드를 바꿀 때 캐시된 인스턴스 제거"""
+    with _STORES_LOCK:
+        _STORES.clear()
@@ -0,0 +1,726 @@
+# ================== 대화 저장 포맷 (segmented / sessions) ==================
+# CONVO_STORE_FORMAT=segmented|sessions 일 때 conv_store가 사용하는 저장 포맷.
+# 두 포맷 모두 읽으면 기존과 같은 {"version": 1, "sessions": {...}} 모양을 돌려준다.
+#
+# ---------------------------------------------------------------- segmented
+#
+# 기존(doc) 포맷은 턴 1개를 추가할 때마다 사용자 문서 전체를 json.dumps(indent=2)로
+# 다시 올린다 → 대화가 길수록 매 메시지 비용이 커진다.
+# 세그먼트 포맷은 문서 경로(<...>/<user_id>.json) 옆에 폴더를 두고:
+#
+#   <user_id>.log/manifest.json                      ← 세션 메타 + 세그먼트 목록 (작음)
+#   <user_id>.log/<session_id>/<seq>-<rand>.jsonl    ← 불변 턴 세그먼트 (1줄 = 1턴)
+#
+#   - 추가: 이번 요청의 턴만 새 세그먼트 1개로 쓰고 manifest만 갱신 → O(턴)
+#   - 트림: manifest의 skip/세그먼트 목록만 조정 (다 잘린 세그먼트는 삭제)
+#   - 읽기: 끝쪽 세그먼트만 골라 읽을 수 있다 (read_session_tail)
+#   - 압축: 세그먼트가 CONVO_SEGMENT_COMPACT_AT(기본 16)개를 넘으면 flush 중에 1개로 합친다
+#   - 호환: manifest가 없으면 conv_store가 기존 {"version": 1, "sessions": {...}} 문서를
+#           그대로 읽고(list→dict 마이그레이션 포함), 첫 기록 때 스냅샷으로 옮겨 적는다.
+#   - 동시성: manifest는 읽은 generation 조건부로 쓴다. 충돌하면 이번에 쓴 세그먼트를 지우고
+#             StoreConflict → conv_store가 다시 읽고 op를 재적용한다.
+#
+# manifest 예)
+#   {"format": "segmented", "version": 2, "user": {...},
+#    "sessions": {"<sid>": {"meta": {...}, "skip": 0, "seq": 3, "summary": {...세션 요약},
+#                           "segments": [{"name": "000001-1a2b3c4d.jsonl", "turns": 2}, ...]}}}
+
+import re, json, uuid, gzip, time, hashlib
+
+from env_conf import env_int
+from conv_store import (
+    StoreConflict,
+    _apply_op,
+    _db_manifest,
+    _session_summary,
+    _summary_add_turn,
+    _summary_new,
+    _doc_cache_evict,
+    _doc_cache_get,
+    _doc_cache_put,
+    _doc_read,
+    _json_clone,
+    _normalize_db,
+    _profile_dir,
+    _profile_index_path,
+    _session_object_path,
+    _turn_key,
+    _store_delete,
+    _store_join,
+    _store_list,
+    _store_read_bytes,
+    _store_write_bytes,
+    _store_write_text,
+)
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_CONTENT_TYPE = "application/x-ndjson"
+_IMMUTABLE = "immutable"   # 세그먼트는 불변이라 캐시 검증 없이 재사용
+
+
+def _compact_at() -> int:
+    return env_int("CONVO_SEGMENT_COMPACT_AT", 16, lo=2)
+
+
+# --- 경로 ---------------------------------------------------------------------
+
+def seg_root(doc_path: str) -> str:
+    """<...>/<user_id>.json → <...>/<user_id>.log"""
+    base = doc_path[:-5] if doc_path.lower().endswith(".json") else doc_path
+    return base + ".log"
+
+
+def _manifest_path(doc_path: str) -> str:
+    return _store_join(seg_root(doc_path), MANIFEST_NAME)
+
+
+def _sid_dir(sid: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_.-]", "_", sid)[:128] or "_"
+
+
+def _segment_path(doc_path: str, sid: str, name: str) -> str:
+    return _store_join(seg_root(doc_path), _sid_dir(sid), name)
+
+
+# --- 읽기 ---------------------------------------------------------------------
+
+def read_manifest(doc_path: str) -> tuple[dict | None, object]:
+    """반환: (manifest|None, generation). generation 조건부 읽기 + 문서 캐시 사용"""
+    mpath = _manifest_path(doc_path)
+    cached = _doc_cache_get(mpath)
+    try:
+        raw, generation, metageneration = _store_read_bytes(
+            mpath, if_generation_not_match=cached["generation"] if cached else None
+        )
+    except FileNotFoundError:
+        _doc_cache_evict(mpath)
+        return None, None
+    if raw is None and cached is not None:
+        return _json_clone(cached["db"]), cached["generation"]
+    try:
+        manifest = json.loads(raw)
+    except json.JSONDecodeError:
+        print(f"[SEG][ERR] manifest 손상: {mpath}")
+        _doc_cache_evict(mpath)
+        return None, None
+    _doc_cache_put(mpath, manifest, generation, metageneration, len(raw))
+    return manifest, generation
+
+
+def _read_segment(doc_path: str, sid: str, name: str) -> list[dict]:
+    path = _segment_path(doc_path, sid, name)
+    cached = _doc_cache_get(path)
+    if cached is not None:
+        return _json_clone(cached["db"])
+    raw, _, _ = _store_read_bytes(path)
+    turns = [json.loads(line) for line in raw.decode("utf-8").splitlines() if line.strip()]
+    _doc_cache_put(path, turns, _IMMUTABLE, None, len(raw))
+    return turns
+
+
+def _live_count(entry: dict) -> int:
+    return sum(int(s.get("turns") or 0) for s in entry.get("segments") or []) - int(entry.get("skip") or 0)
+
+
+def _session_turns(doc_path: str, sid: str, entry: dict, last_n: int | None = None) -> list[dict]:
+    """manifest 항목 기준으로 세션 턴 조립. last_n이면 끝쪽 세그먼트만 읽는다."""
+    segments = list(entry.get("segments") or [])
+    skip = int(entry.get("skip") or 0)
+    start = 0
+    if last_n:
+        need, start = 0, len(segments)
+        while start > 0 and need < last_n:
+            start -= 1
+            need += int(segments[start].get("turns") or 0)
+    turns: list[dict] = []
+    for i in range(start, len(segments)):
+        part = _read_segment(doc_path, sid, segments[i]["name"])
+        if i == 0 and skip:
+            part = part[skip:]
+        turns.extend(part)
+    return turns[-last_n:] if last_n else turns
+
+
+def read_segmented(doc_path: str) -> dict | None:
+    """
+    manifest + 세그먼트를 v1 문서 모양({"version", "sessions": {sid: {meta, turns}}})으로 조립.
+    manifest가 없으면 None (→ conv_store가 기존 문서를 읽음)
+    """
+    for attempt in range(2):
+        manifest, generation = read_manifest(doc_path)
+        if manifest is None:
+            return None
+        key = doc_path + "#seg"
+        cached = _doc_cache_get(key)
+        if cached is not None and cached["generation"] == generation:
+            return _json_clone(cached["db"])
+        try:
+            db = {"version": 1, "sessions": {}}
+            if manifest.get("user"):
+                db["user"] = manifest["user"]
+            db["manifest"] = {}
+            for sid, entry in (manifest.get("sessions") or {}).items():
+                db["sessions"][sid] = {
+                    "meta": dict(entry.get("meta") or {}),
+                    "turns": _session_turns(doc_path, sid, entry),
+                }
+                if entry.get("summary"):
+                    db["manifest"][sid] = dict(entry["summary"])
+        except FileNotFoundError:
+            # 읽는 사이 압축으로 세그먼트가 교체됨 → manifest 다시 읽기
+            print(f"[SEG] 세그먼트 교체 감지 → manifest 재조회 ({attempt + 1})")
+            _doc_cache_evict(_manifest_path(doc_path))
+            continue
+        _normalize_db(db)
+        _doc_cache_put(key, db, generation, None, len(json.dumps(db, ensure_ascii=False)))
+        return db
+    return None
+
+
+def read_segmented_manifest(doc_path: str) -> dict | None:
+    """세션 요약만 ({sid: 요약}, 세그먼트는 읽지 않음). manifest가 없거나 요약이 빠진 세션이 있으면 None"""
+    manifest, _ = read_manifest(doc_path)
+    if manifest is None:
+        return None
+    out = {}
+    for sid, entry in (manifest.get("sessions") or {}).items():
+        if not entry.get("summary"):
+            return None
+        out[sid] = dict(entry["summary"])
+    return out
+
+
+def read_session_tail(doc_path: str, sid: str, n: int | None) -> list[dict] | None:
+    """세션 최근 n턴 (manifest 없으면 None)"""
+    manifest, _ = read_manifest(doc_path)
+    if manifest is None:
+        return None
+    entry = (manifest.get("sessions") or {}).get(sid)
+    if not entry:
+        return []
+    try:
+        return _session_turns(doc_path, sid, entry, n)
+    except FileNotFoundError:
+        _doc_cache_evict(_manifest_path(doc_path))
+        return None
+
+
+# --- 쓰기 ---------------------------------------------------------------------
+
+def _write_segment(doc_path: str, sid: str, entry: dict, turns: list[dict]) -> str:
+    seq = int(entry.get("seq") or 0) + 1
+    name = f"{seq:06d}-{uuid.uuid4().hex[:8]}.jsonl"
+    body = "".join(json.dumps(t, ensure_ascii=False, separators=(",", ":")) + "\n" for t in turns)
+    _store_write_text(_segment_path(doc_path, sid, name), body, SEGMENT_CONTENT_TYPE)
+    _doc_cache_put(_segment_path(doc_path, sid, name), turns, _IMMUTABLE, None, len(body.encode("utf-8")))
+    entry["seq"] = seq
+    entry.setdefault("segments", []).append({"name": name, "turns": len(turns)})
+    return name
+
+
+def _head_turns(doc_path: str, sid: str, entry: dict, pending: list[dict], k: int) -> list[dict]:
+    """_drop_head로 잘릴 앞쪽 k턴 (cold 아카이브용, 앞쪽 세그먼트만 읽는다)"""
+    out: list[dict] = []
+    skip = int(entry.get("skip") or 0)
+    for seg in entry.get("segments") or []:
+        if len(out) >= k:
+            break
+        part = _read_segment(doc_path, sid, seg["name"])[skip:]
+        skip = 0
+        out.extend(part[:k - len(out)])
+    return out + pending[:max(0, k - len(out))]
+
+
+def _drop_head(entry: dict, pending: list[dict], k: int) -> list[str]:
+    """앞쪽 k턴 제거. 다 잘린 세그먼트 이름 목록 반환(삭제 대상)"""
+    garbage = []
+    skip = int(entry.get("skip") or 0) + k
+    segments = entry.get("segments") or []
+    while segments and int(segments[0].get("turns") or 0) <= skip:
+        skip -= int(segments[0].get("turns") or 0)
+        garbage.append(segments.pop(0)["name"])
+    if not segments and skip:
+        del pending[:skip]
+        skip = 0
+    entry["skip"] = skip
+    entry["segments"] = segments
+    return garbage
+
+
+def _write_manifest(doc_path: str, manifest: dict, *, if_generation_match=None) -> None:
+    text = json.dumps(manifest, ensure_ascii=False, separators=(",", ":"))
+    mpath = _manifest_path(doc_path)
+    generation, metageneration = _store_write_text(mpath, text, if_generation_match=if_generation_match)
+    _doc_cache_put(mpath, manifest, generation, metageneration, len(text.encode("utf-8")))
+    _doc_cache_evict(doc_path + "#seg")
+
+
+def _delete_segments(doc_path: str, garbage: list[tuple[str, str]]) -> None:
+    for sid, name in garbage:
+        path = _segment_path(doc_path, sid, name)
+        _doc_cache_evict(path)
+        try:
+            _store_delete(path)
+        except Exception as e:
+            print(f"[SEG][WARN] 세그먼트 삭제 실패(무시): {path} — {e}")
+
+
+def _compact_session(doc_path: str, sid: str, entry: dict, written: list | None = None) -> list[tuple[str, str]]:
+    """세션의 살아있는 턴을 세그먼트 1개로 합친다. 반환: 교체된 옛 세그먼트"""
+    turns = _session_turns(doc_path, sid, entry)
+    old = [(sid, s["name"]) for s in entry.get("segments") or []]
+    entry["segments"] = []
+    entry["skip"] = 0
+    if turns:
+        name = _write_segment(doc_path, sid, entry, turns)
+        if written is not None:
+            written.append((sid, name))
+    print(f"[SEG][COMPACT] session={sid} segments {len(old)}→{len(entry['segments'])} turns={len(turns)}")
+    return old
+
+
+def append_ops(doc_path: str, ops: list[dict], db: dict) -> None:
+    """
+    요청 1건의 op(session/append/trim)를 세그먼트 + manifest 갱신으로 기록.
+    manifest가 아직 없으면(새 사용자 / v1 문서) db 전체를 스냅샷으로 옮긴다.
+    """
+    manifest, generation = read_manifest(doc_path)
+    if manifest is None:
+        _archive_snapshot_evictions(doc_path, ops, db)
+        write_snapshot(doc_path, db, if_generation_match=0)
+        return
+
+    sessions = manifest.setdefault("sessions", {})
+    pending: dict[str, list[dict]] = {}
+    cold: dict[str, list[dict]] = {}
+    garbage: list[tuple[str, str]] = []
+    written: list[tuple[str, str]] = []
+    for op in ops:
+        sid = op["sid"]
+        kind = op["op"]
+        entry = sessions.get(sid)
+        if entry is None and kind in ("session", "append"):
+            probe = {"sessions": {}}
+            _apply_op(probe, {"op": "session", "sid": sid, "meta": op.get("meta"), "ts": op.get("ts")})
+            entry = sessions[sid] = {"meta": probe["sessions"][sid]["meta"], "skip": 0, "seq": 0, "segments": [],
+                                     "summary": _summary_new(sid, probe["sessions"][sid]["meta"])}
+        if entry is None:
+            continue
+        if "summary" not in entry:
+            # 요약 없는 기존 manifest → 이 세션만 한 번 읽어 만든다
+            entry["summary"] = _session_summary(sid, {"meta": entry.get("meta"), "turns": _session_turns(doc_path, sid, entry)})
+        if kind == "append":
+            pending.setdefault(sid, []).append(op["turn"])
+            _summary_add_turn(entry["summary"], op["turn"])
+        elif kind == "trim":
+            buf = pending.setdefault(sid, [])
+            over = _live_count(entry) + len(buf) - int(op["max_turns"])
+            if over > 0:
+                # 실제 manifest 기준으로 잘리는 턴 → cold 아카이브 (다른 요청과 합쳐진 결과 기준)
+                cold.setdefault(sid, []).extend(_head_turns(doc_path, sid, entry, buf, over))
+                garbage.extend((sid, name) for name in _drop_head(entry, buf, over))
+
+    for sid, turns in pending.items():
+        if turns:
+            written.append((sid, _write_segment(doc_path, sid, sessions[sid], turns)))
+        sessions[sid]["summary"]["turns"] = _live_count(sessions[sid])
+
+    limit = _compact_at()
+    for sid, entry in sessions.items():
+        if len(entry.get("segments") or []) > limit:
+            garbage.extend(_compact_session(doc_path, sid, entry, written))
+
+    for sid, turns in cold.items():
+        write_cold_chunk(doc_path, sid, turns)
+
+    if db.get("user"):
+        manifest["user"] = db["user"]
+    try:
+        _write_manifest(doc_path, manifest, if_generation_match=generation)
+    except StoreConflict:
+        # 다른 요청이 먼저 manifest를 바꿈 → 이번에 쓴 세그먼트는 아무도 가리키지 않으므로 정리
+        _delete_segments(doc_path, written)
+        raise
+    # manifest가 더는 가리키지 않는 세그먼트는 manifest 기록 후 삭제
+    _delete_segments(doc_path, garbage)
+
+
+def write_snapshot(doc_path: str, db: dict, *, if_generation_match=None) -> None:
+    """
+    db 전체를 세션당 세그먼트 1개로 기록 (v1 문서 이전 / 요청 세션 밖 저장 / 강제 압축)
+    if_generation_match=0 이면 manifest가 아직 없을 때만 기록 (이전 중 경합 방지)
+    """
+    old, _ = read_manifest(doc_path)
+    written: list[tuple[str, str]] = []
+    manifest = {"format": "segmented", "version": 2, "sessions": {}}
+    if db.get("user"):
+        manifest["user"] = db["user"]
+    summaries = _db_manifest(_normalize_db(db))
+    for sid, sess in (db.get("sessions") or {}).items():
+        entry = {"meta": dict(sess.get("meta") or {}), "skip": 0, "seq": 0, "segments": [],
+                 "summary": dict(summaries.get(sid) or _session_summary(sid, sess))}
+        prev = ((old or {}).get("sessions") or {}).get(sid)
+        if prev:
+            entry["seq"] = int(prev.get("seq") or 0)
+        turns = list(sess.get("turns") or [])
+        if turns:
+            written.append((sid, _write_segment(doc_path, sid, entry, turns)))
+        manifest["sessions"][sid] = entry
+    try:
+        _write_manifest(doc_path, manifest, if_generation_match=if_generation_match)
+    except StoreConflict:
+        _delete_segments(doc_path, written)
+        raise
+    garbage = [
+        (sid, s["name"])
+        for sid, entry in ((old or {}).get("sessions") or {}).items()
+        for s in entry.get("segments") or []
+    ]
+    _delete_segments(doc_path, garbage)
+    print(f"[SEG][SNAPSHOT] {seg_root(doc_path)} sessions={len(manifest['sessions'])}")
+
+
+def compact_store(doc_path: str) -> int:
+    """유지보수용: 세그먼트가 2개 이상인 세션을 모두 1개로 합친다. 반환: 압축한 세션 수"""
+    manifest, _ = read_manifest(doc_path)
+    if manifest is None:
+        return 0
+    garbage: list[tuple[str, str]] = []
+    count = 0
+    for sid, entry in (manifest.get("sessions") or {}).items():
+        if len(entry.get("segments") or []) > 1 or int(entry.get("skip") or 0):
+            garbage.extend(_compact_session(doc_path, sid, entry))
+            count += 1
+    if count:
+        _write_manifest(doc_path, manifest)
+        _delete_segments(doc_path, garbage)
+    return count
+
+
+def delete_segmented(doc_path: str) -> bool:
+    """세그먼트 폴더 전체 삭제. 하나라도 지웠으면 True"""
+    root = seg_root(doc_path)
+    _doc_cache_evict(_manifest_path(doc_path))
+    _doc_cache_evict(doc_path + "#seg")
+    removed = False
+    for path in _store_list(root):
+        _doc_cache_evict(path)
+        removed = _store_delete(path) or removed
+    return removed
+
+
+# ================== sessions 레이아웃: 세션당 객체 1개 ==================
+# 프로필의 모든 세션이 문서 1개에 있으면, 세션 하나만 필요해도 전부 받아 파싱해야 한다.
+# sessions 레이아웃은:
+#
+#   <...>/profiles/<user_id>/index.json            ← {"format": "sessions", "version": 2, "user",
+#                                                      "sessions": {sid: {title, created_at, turns, updated_at}}}
+#   <...>/profiles/<user_id>/sessions/<sid>.json   ← {"session_id", "meta", "turns"}
+#
+#   - 읽기: 인덱스 + 활성 세션(set_current_session) 객체만 → 활성 세션 크기에만 비례
+#           활성 세션이 없으면 인덱스의 모든 세션을 읽는다.
+#   - 쓰기: 이번 요청의 op가 건드린 세션 객체 + 인덱스만 기록
+#   - 돌려주는 db는 일부 세션만 담을 수 있으므로, 쓰기는 인덱스에서 세션을 지우지 않는다.
+#   - 인덱스가 없으면 기존 v1 문서를 읽고, 첫 기록(또는 migrate_document) 때 세션별로 나눈다.
+
+
+def read_sessions_index(doc_path: str) -> tuple[dict | None, object]:
+    """반환: (index|None, generation). generation 조건부 읽기 + 문서 캐시 사용"""
+    ipath = _profile_index_path(doc_path)
+    cached = _doc_cache_get(ipath)
+    try:
+        raw, generation, metageneration = _store_read_bytes(
+            ipath, if_generation_not_match=cached["generation"] if cached else None
+        )
+    except FileNotFoundError:
+        _doc_cache_evict(ipath)
+        return None, None
+    if raw is None and cached is not None:
+        return _json_clone(cached["db"]), cached["generation"]
+    try:
+        index = json.loads(raw)
+    except json.JSONDecodeError:
+        print(f"[SESS][ERR] index 손상: {ipath}")
+        _doc_cache_evict(ipath)
+        return None, None
+    _doc_cache_put(ipath, index, generation, metageneration, len(raw))
+    return index, generation
+
+
+def read_session_object(doc_path: str, sid: str) -> dict | None:
+    """세션 객체 1개 ({"session_id", "meta", "turns"}). 없으면 None"""
+    return _read_session_object(doc_path, sid)[0]
+
+
+def _read_session_object(doc_path: str, sid: str) -> tuple[dict | None, object]:
+    """(세션 객체|None, generation). 없으면 generation=0"""
+    spath = _session_object_path(doc_path, sid)
+    cached = _doc_cache_get(spath)
+    try:
+        raw, generation, metageneration = _store_read_bytes(
+            spath, if_generation_not_match=cached["generation"] if cached else None
+        )
+    except FileNotFoundError:
+        _doc_cache_evict(spath)
+        return None, 0
+    if raw is None and cached is not None:
+        return _json_clone(cached["db"]), generation
+    try:
+        obj = json.loads(raw)
+    except json.JSONDecodeError:
+        print(f"[SESS][ERR] 세션 객체 손상: {spath}")
+        _doc_cache_evict(spath)
+        return None, generation
+    _doc_cache_put(spath, obj, generation, metageneration, len(raw))
+    return obj, generation
+
+
+def read_sessions(doc_path: str, active_sid: str | None = None) -> dict | None:
+    """
+    인덱스 + 세션 객체를 v1 문서 모양으로 조립. 인덱스가 없으면 None (→ 기존 문서 읽기)
+    active_sid가 있으면 그 세션만 담는다.
+    """
+    return read_sessions_versioned(doc_path, active_sid)[0]
+
+
+def read_sessions_versioned(doc_path: str, active_sid: str | None = None) -> tuple[dict | None, dict | None]:
+    """read_sessions + 읽은 세션 객체별 generation ({sid: gen}, 없던 세션은 0)"""
+    index, _ = read_sessions_index(doc_path)
+    if index is None:
+        return None, None
+    db = {"version": 1, "sessions": {}}
+    if index.get("user"):
+        db["user"] = index["user"]
+    listed = index.get("sessions") or {}
+    # 세션 요약은 인덱스에서 (읽지 않는 세션 포함). 예전 인덱스 항목(요약 필드 없음)은 읽은 세션만 다시 만든다
+    db["manifest"] = {sid: _index_summary(sid, e) for sid, e in listed.items() if e.get("last_role") is not None}
+    sids = [active_sid] if active_sid else list(listed.keys())
+    versions: dict[str, object] = {}
+    for sid in sids:
+        obj, generation = _read_session_object(doc_path, sid) if sid in listed else (None, 0)
+        versions[sid] = generation
+        if obj is None:
+            continue
+        db["sessions"][sid] = {"meta": obj.get("meta") or {}, "turns": obj.get("turns") or []}
+    return _normalize_db(db), versions
+
+
+def _index_entry(summary: dict, ts: str) -> dict:
+    return {**summary, "updated_at": ts}
+
+
+def _index_summary(sid: str, entry: dict) -> dict:
+    out = {k: v for k, v in entry.items() if k != "updated_at"}
+    out["session_id"] = sid
+    return out
+
+
+def read_sessions_manifest(doc_path: str) -> dict | None:
+    """인덱스만 읽어 {sid: 요약}. 인덱스가 없거나 예전 형식 항목이 있으면 None"""
+    index, _ = read_sessions_index(doc_path)
+    if index is None:
+        return None
+    listed = index.get("sessions") or {}
+    if any(e.get("last_role") is None for e in listed.values()):
+        return None
+    return {sid: _index_summary(sid, e) for sid, e in listed.items()}
+
+
+def write_sessions(doc_path: str, db: dict, sids: set[str] | None = None, *, expected: dict | None = None) -> None:
+    """
+    db의 세션 중 sids(없으면 전부)를 세션 객체로 쓰고 인덱스를 병합 갱신.
+    인덱스에만 있고 db에 없는 세션은 그대로 둔다(부분 로드된 db이므로).
+    - expected({sid: generation})가 있으면 세션 객체를 조건부로 쓴다 → 다르면 StoreConflict
+    - 인덱스는 요약 정보라 충돌 시 다시 읽어 병합한다 (최대 5회)
+    """
+    from datetime import datetime, timezone
+
+    ts = datetime.now(timezone.utc).isoformat()
+    sessions = db.get("sessions") or {}
+    summaries = _db_manifest(db)
+    if sids is not None and read_sessions_index(doc_path)[0] is None:
+        # 인덱스가 아직 없음 = db는 기존 v1 문서 전체 → 모든 세션을 옮긴다
+        sids = None
+    entries: dict[str, dict] = {}
+    for sid in (sids if sids is not None else sessions.keys()):
+        sess = sessions.get(sid)
+        if sess is None:
+            continue
+        obj = {"session_id": sid, "meta": sess.get("meta") or {}, "turns": sess.get("turns") or []}
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        spath = _session_object_path(doc_path, sid)
+        match = (expected or {}).get(sid)
+        generation, metageneration = _store_write_text(spath, text, if_generation_match=match)
+        _doc_cache_put(spath, obj, generation, metageneration, len(text.encode("utf-8")))
+        entries[sid] = _index_entry(summaries.get(sid) or _session_summary(sid, sess), ts)
+
+    ipath = _profile_index_path(doc_path)
+    for attempt in range(5):
+        index, index_gen = read_sessions_index(doc_path)
+        if index is None:
+            index, index_gen = {"format": "sessions", "version": 2, "sessions": {}}, 0
+        if db.get("user"):
+            index["user"] = db["user"]
+        index.setdefault("sessions", {}).update(entries)
+        text = json.dumps(index, ensure_ascii=False, separators=(",", ":"))
+        try:
+            generation, metageneration = _store_write_text(ipath, text, if_generation_match=index_gen)
+        except StoreConflict:
+            print(f"[SESS][CONFLICT] index 재병합 ({attempt + 1})")
+            continue
+        _doc_cache_put(ipath, index, generation, metageneration, len(text.encode("utf-8")))
+        return
+    raise StoreConflict(ipath, None)
+
+
+def migrate_document(doc_path: str, *, delete_source: bool = False) -> int:
+    """
+    기존 v1 문서를 세션 객체 + 인덱스로 나눈다 (이미 있는 세션 객체는 문서 내용으로 덮어씀).
+    반환: 옮긴 세션 수. delete_source=True면 옮긴 뒤 원본 문서 삭제.
+    """
+    db = _doc_read(doc_path)
+    sessions = db.get("sessions") or {}
+    if not sessions:
+        print(f"[SESS][MIGRATE] 옮길 세션 없음: {doc_path}")
+        return 0
+    write_sessions(doc_path, db)
+    print(f"[SESS][MIGRATE] {doc_path} → {_profile_dir(doc_path)} sessions={len(sessions)}")
+    if delete_source:
+        _doc_cache_evict(doc_path)
+        _store_delete(doc_path)
+    return len(sessions)
+
+
+def delete_sessions(doc_path: str) -> bool:
+    """프로필 폴더(index + 세션 객체) 전체 삭제. 하나라도 지웠으면 True"""
+    removed = False
+    for path in _store_list(_profile_dir(doc_path)):
+        _doc_cache_evict(path)
+        removed = _store_delete(path) or removed
+    return removed
+
+
+# ================== cold 아카이브: hot 구간에서 밀려난 턴 ==================
+# 트림(CONVO_MAX_TURNS / max_history)으로 hot 구간을 넘은 턴은 버리지 않고
+# 세션별 압축 청크로 옮긴다. 요청 경로에서는 읽지 않는다 (과거 대화 검색/내보내기 전용).
+#
+#   <...>/<user_id>.cold/<session_id>/<ms>-<rand>.jsonl.gz   ← 불변 청크 (트림 1회 = 1개, gzip JSONL)
+#
+#   - 쓰기: 청크를 새 이름으로 쓰기만 한다 (읽기-수정-쓰기 없음 → 충돌 없음)
+#   - 읽기: 세션 폴더의 청크를 이름(기록 시각)순으로 풀어 이어 붙이고 (ts, role, text) 중복 제거
+#   - 포맷(doc/segmented/sessions)과 무관하게 문서 경로 옆에 둔다
+
+COLD_CONTENT_TYPE = "application/gzip"
+
+
+def cold_root(doc_path: str) -> str:
+    """<...>/<user_id>.json → <...>/<user_id>.cold"""
+    base = doc_path[:-5] if doc_path.lower().endswith(".json") else doc_path
+    return base + ".cold"
+
+
+def encode_cold_chunk(turns: list[dict]) -> bytes:
+    body = "".join(json.dumps(t, ensure_ascii=False, separators=(",", ":")) + "\n" for t in turns)
+    return gzip.compress(body.encode("utf-8"), compresslevel=6)
+
+
+def decode_cold_chunk(raw: bytes) -> list[dict]:
+    return [json.loads(line) for line in gzip.decompress(raw).decode("utf-8").splitlines() if line.strip()]
+
+
+def write_cold_chunk(doc_path: str, sid: str, turns: list[dict]) -> str | None:
+    if not turns:
+        return None
+    name = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+    raw = encode_cold_chunk(turns)
+    _store_write_bytes(_store_join(cold_root(doc_path), _sid_dir(sid), name), raw, COLD_CONTENT_TYPE)
+    print(f"[COLD] session='{sid}' +{len(turns)} turns → {name} ({len(raw)} bytes)")
+    return name
+
+
+def _archive_snapshot_evictions(doc_path: str, ops: list[dict], db: dict) -> None:
+    """첫 세그먼트 스냅샷: 기존 문서 + 이번 추가 턴 중 db(트림 후)에 없는 턴을 아카이브"""
+    trimmed = {op["sid"] for op in ops if op["op"] == "trim"}
+    if not trimmed:
+        return
+    prior = _doc_read(doc_path).get("sessions") or {}
+    for sid in trimmed:
+        before = list((prior.get(sid) or {}).get("turns") or [])
+        before += [op["turn"] for op in ops if op["op"] == "append" and op["sid"] == sid]
+        hot = {_turn_key(t) for t in ((db.get("sessions") or {}).get(sid) or {}).get("turns") or []}
+        write_cold_chunk(doc_path, sid, [t for t in before if _turn_key(t) not in hot])
+
+
+def read_cold_turns(doc_path: str, sid: str) -> list[dict]:
+    """세션의 cold 턴 (오래된 순, 중복 제거)"""
+    turns: list[dict] = []
+    seen = set()
+    for path in sorted(p for p in _store_list(_store_join(cold_root(doc_path), _sid_dir(sid))) if p.endswith(".gz")):
+        try:
+            raw, _, _ = _store_read_bytes(path)
+            chunk = decode_cold_chunk(raw)
+        except (FileNotFoundError, OSError, ValueError) as e:
+            print(f"[COLD][WARN] 청크 읽기 실패(건너뜀): {path} — {e}")
+            continue
+        for t in chunk:
+            k = _turn_key(t)
+            if k not in seen:
+                seen.add(k)
+                turns.append(t)
+    return turns
+
+
+def delete_cold(doc_path: str) -> bool:
+    """사용자의 cold 아카이브 전체 삭제. 하나라도 지웠으면 True"""
+    removed = False
+    for path in _store_list(cold_root(doc_path)):
+        removed = _store_delete(path) or removed
+    return removed
+
+
+# ================== 요청 재전송 기록: request_id → 완료 응답 ==================
+# 클라이언트가 붙인 request_id의 완료 응답을 사용자 문서 옆에 둔다 (request_replay.py 참고).
+#
+#   <...>/<user_id>.replay/<sha256(request_id)[:32]>.json   ← {"request_id", "stored_at", "session_id", "body"}
+#
+#   - id마다 객체 1개 (읽기-수정-쓰기 없음 → 동시 요청끼리 충돌 없음)
+#   - 만료(REQUEST_REPLAY_TTL_S)는 읽는 쪽에서 판단하고, 만료된 객체는 그때 지운다
+#   - 사용자 저장소 삭제(delete) 시 함께 지운다
+
+REPLAY_CONTENT_TYPE = "application/json"
+
+
+def replay_root(doc_path: str) -> str:
+    """<...>/<user_id>.json → <...>/<user_id>.replay"""
+    base = doc_path[:-5] if doc_path.lower().endswith(".json") else doc_path
+    return base + ".replay"
+
+
+def _replay_path(doc_path: str, request_id: str) -> str:
+    digest = hashlib.sha256(request_id.encode("utf-8")).hexdigest()[:32]
+    return _store_join(replay_root(doc_path), f"{digest}.json")
+
+
+def read_replay(doc_path: str, request_id: str) -> dict | None:
+    try:
+        raw, _, _ = _store_read_bytes(_replay_path(doc_path, request_id))
+    except FileNotFoundError:
+        return None
+    rec = json.loads(raw.decode("utf-8"))
+    # 해시 충돌/다른 id 방어
+    return rec if rec.get("request_id") == request_id else None
+
+
+def write_replay(doc_path: str, request_id: str, rec: dict) -> None:
+    _store_write_text(_replay_path(doc_path, request_id),
+                      json.dumps(rec, ensure_ascii=False, separators=(",", ":")), REPLAY_CONTENT_TYPE)
+
+
+def delete_replay(doc_path: str, request_id: str | None = None) -> bool:
+    """request_id 기록 1건 (None이면 사용자 전체) 삭제. 하나라도 지웠으면 True"""
+    if request_id is not None:
+        return _store_delete(_replay_path(doc_path, request_id))
+    removed = False
+    for path in _store_list(replay_root(doc_path)):
+        removed = _store_delete(path) or removed
+    return removed
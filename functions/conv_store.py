@@ -2,11 +2,14 @@
 # 기존 코드와 최대한 어울리게, 함수명/스타일을 유지하면서 '현재 사용자' 개념만 주입합니다.
 
 from typing import Optional
-import os, re, json, unicodedata, hashlib
+import os, re, json, unicodedata, hashlib, threading, time, random
 import os.path as p
+from collections import OrderedDict
 from contextlib import contextmanager
-from contextvars import ContextVar
+from contextvars import ContextVar, Token
+from env_conf import env_float, env_int
 from google.cloud import storage
+from google.api_core.exceptions import NotFound, NotModified, PreconditionFailed
 
 
 
@@ -68,6 +71,7 @@ def user_from_payload(payload: dict | None) -> dict | None:
 _CUR_USER_ID: ContextVar[str | None]  = ContextVar("_CUR_USER_ID",  default=None)
 _CUR_USER_META: ContextVar[dict | None] = ContextVar("_CUR_USER_META", default=None)
 _CUR_APP_UID: ContextVar[str | None] = ContextVar("_CUR_APP_UID", default=None)
+_CUR_SESSION_ID: ContextVar[str | None] = ContextVar("_CUR_SESSION_ID", default=None)
 
 # --- 파일키 유틸들 ---------------------------------------------------------
 
@@ -113,6 +117,7 @@ def set_current_user_context(
         _CUR_USER_ID.set(None)
         _CUR_USER_META.set(None)
         _CUR_APP_UID.set(None)
+        _CUR_SESSION_ID.set(None)
         return
 
     
@@ -152,6 +157,18 @@ def get_current_app_uid() -> str | None:
     return (app_uid or "").strip() or None
 
 
+def set_current_session(session_id: str | None) -> None:
+    """
+    현재 요청의 활성 세션 ID.
+    sessions 레이아웃(CONVO_STORE_FORMAT=sessions)에서는 _db_load()가 이 세션 객체만 읽는다.
+    """
+    _CUR_SESSION_ID.set((session_id or "").strip() or None)
+
+
+def get_current_session() -> str | None:
+    return _CUR_SESSION_ID.get()
+
+
 
 @contextmanager
 def user_context(*, user: dict | None = None, name: str | None = None, birth: str | None = None):
@@ -169,6 +186,27 @@ def user_context(*, user: dict | None = None, name: str | None = None, birth: st
     finally:
         set_current_user_context(reset=True)
 
+def _store_backend_name() -> str:
+    """
+    CONVO_BACKEND (conv_backends 참고)
+      - auto   : (기본) 클라우드 환경(K_SERVICE/FUNCTION_TARGET/FIREBASE_CONFIG)이면 gcs, 아니면 local
+      - gcs    : GCS 객체 (gs://<GCS_BUCKET>/...)
+      - local  : 로컬 파일 (<CONVO_BASE>/..., .tmp → os.replace)
+      - sqlite : 로컬 SQLite(WAL) 파일 하나
+      - memory : 프로세스 메모리 (테스트/벤치마크용, 재시작 시 사라짐)
+    """
+    name = (os.getenv("CONVO_BACKEND") or "auto").strip().lower()
+    if name == "auto":
+        in_cloud = any(os.getenv(k) for k in ("K_SERVICE", "FUNCTION_TARGET", "FIREBASE_CONFIG"))
+        return "gcs" if in_cloud else "local"
+    return name
+
+
+def _use_gcs() -> bool:
+    """경로를 gs:// 로 만들지 여부 (gcs 백엔드일 때만)"""
+    return _store_backend_name() == "gcs"
+
+
 def _resolve_store_path_for_user(user_id: str) -> str:    
     """
     Cloud: gs://<GCS_BUCKET>/users/<앱UID>/profiles/<user_id>.json
@@ -201,7 +239,7 @@ def _resolve_store_path_for_user(user_id: str) -> str:
         app_uid = app_uid.replace("/", "_").replace("\\", "_")
 
     # 3) 클라우드/로컬 분기
-    in_cloud = any(os.getenv(k) for k in ("K_SERVICE", "FUNCTION_TARGET", "FIREBASE_CONFIG"))
+    in_cloud = _use_gcs()
     if in_cloud:
         bucket = os.getenv("GCS_BUCKET")
         if not bucket:
@@ -232,6 +270,34 @@ def _resolve_store_path_for_user(user_id: str) -> str:
     
     return path
 
+# --- 세션 단위 객체 레이아웃 경로 --------------------------------------------
+# <...>/profiles/<user_id>.json 문서 경로를 기준으로:
+#   <...>/profiles/<user_id>/index.json              ← 프로필 인덱스 (세션 목록/메타)
+#   <...>/profiles/<user_id>/sessions/<sid>.json     ← 세션 1개 (meta + turns)
+
+def _profile_dir(doc_path: str) -> str:
+    return doc_path[:-5] if doc_path.lower().endswith(".json") else doc_path
+
+
+def _profile_index_path(doc_path: str) -> str:
+    return _store_join(_profile_dir(doc_path), "index.json")
+
+
+def _session_object_path(doc_path: str, session_id: str) -> str:
+    key = unicodedata.normalize("NFKC", (session_id or "").strip())
+    key = key.replace("/", "_").replace("\\", "_") or "_"
+    return _store_join(_profile_dir(doc_path), "sessions", f"{key}.json")
+
+
+def _resolve_session_path_for_user(user_id: str, session_id: str) -> str:
+    """
+    _resolve_store_path_for_user()의 세션 단위 버전
+    Cloud: gs://<GCS_BUCKET>/users/<앱UID>/profiles/<user_id>/sessions/<session_id>.json
+    Local: <CONVO_BASE>/users/<앱UID>/profiles/<user_id>/sessions/<session_id>.json
+    """
+    return _session_object_path(_resolve_store_path_for_user(user_id), session_id)
+
+
 def _new_db_skeleton() -> dict:
     """
     새 JSON을 만들 때의 기본 스키마.
@@ -252,28 +318,117 @@ def _new_db_skeleton() -> dict:
 
 
 
+# ================== 공유 GCS 클라이언트 / 버킷 핸들 ==================
+# storage.Client()를 호출마다 만들면 인증 탐색 + TCP/TLS 연결을 매번 다시 한다.
+# 프로세스당 클라이언트 1개(지연 생성) + 버킷 핸들 캐시 + keep-alive 커넥션 풀을 공유한다.
+#   GCS_TIMEOUT        : 요청 타임아웃(초, 기본 10)
+#   GCS_RETRY_DEADLINE : 재시도 총 허용 시간(초, 기본 30, 0이면 재시도 안 함)
+#   GCS_POOL_SIZE      : 호스트당 커넥션 풀 크기(기본 16)
+
+_GCS_CLIENT = None
+_GCS_BUCKETS: dict = {}
+_GCS_ADAPTER = None
+_GCS_LOCK = threading.Lock()
+_GCS_STATS = {"clients_created": 0}
+
+
+def _gcs_timeout() -> float:
+    return env_float("GCS_TIMEOUT", 10.0, lo=0.1)
+
+
+def _gcs_retry():
+    """재시도 정책 (google.cloud.storage 기본 정책 + 총 허용 시간)"""
+    from google.cloud.storage.retry import DEFAULT_RETRY
+    deadline = env_float("GCS_RETRY_DEADLINE", 30.0, lo=0)
+    if deadline <= 0:
+        return None
+    return DEFAULT_RETRY.with_deadline(deadline)
+
+
+def _gcs_client():
+    """프로세스 공유 storage.Client (최초 호출 시 생성)"""
+    global _GCS_CLIENT, _GCS_ADAPTER
+    if _GCS_CLIENT is not None:
+        return _GCS_CLIENT
+    with _GCS_LOCK:
+        if _GCS_CLIENT is None:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+            from requests.adapters import HTTPAdapter
+
+            pool = env_int("GCS_POOL_SIZE", 16, lo=1)
+            creds, project = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/devstorage.read_write"]
+            )
+            http = AuthorizedSession(creds)
+            adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+            http.mount("https://", adapter)
+            _GCS_ADAPTER = adapter
+            _GCS_CLIENT = storage.Client(project=project, credentials=creds, _http=http)
+            _GCS_STATS["clients_created"] += 1
+            print(f"[GCS] client created (pool={pool}, timeout={_gcs_timeout()}s)")
+    return _GCS_CLIENT
+
+
+def _gcs_bucket(bucket: str):
+    bkt = _GCS_BUCKETS.get(bucket)
+    if bkt is None:
+        bkt = _gcs_client().bucket(bucket)
+        _GCS_BUCKETS[bucket] = bkt
+    return bkt
+
+
+def _gcs_blob(gs_path: str):
+    """gs:// 경로 → 공유 버킷 핸들 위의 Blob (Blob 자체는 요청마다 새로 만든다)"""
+    bucket, name = _parse_gs_path(gs_path)
+    return _gcs_bucket(bucket).blob(name)
+
+
+def get_gcs_stats() -> dict:
+    """
+    공유 클라이언트 현황 (벤치마크에서 웜 인스턴스 재사용 확인용)
+    - connections_created: 풀에서 지금까지 새로 연 TCP/TLS 연결 수
+    """
+    conns = 0
+    adapter = _GCS_ADAPTER
+    if adapter is not None:
+        try:
+            for pool in adapter.poolmanager.pools._container.values():
+                conns += getattr(pool, "num_connections", 0)
+        except Exception:
+            pass
+    return {**_GCS_STATS, "buckets": len(_GCS_BUCKETS), "connections_created": conns}
+
+
 def _gcs_delete(gs_path: str) -> bool:
     """지정 GCS 객체 삭제. 존재하지 않아도 False로만 리턴(예외 방지)."""
-    bucket, name = _parse_gs_path(gs_path)
-    client = storage.Client()
-    bkt = client.bucket(bucket)
-    blob = bkt.blob(name)
+    blob = _gcs_blob(gs_path)
     try:
-        if not blob.exists(client):
-            print(f"[DEL] GCS object not found: {gs_path}")
-            return False
-        blob.delete()  # 성공 시 204
+        blob.delete(timeout=_gcs_timeout(), retry=_gcs_retry())  # 성공 시 204
         print(f"[DEL] GCS deleted: {gs_path}")
         return True
+    except NotFound:
+        print(f"[DEL] GCS object not found: {gs_path}")
+        return False
     except Exception as e:
         print(f"[DEL][ERR] GCS delete failed: {gs_path} — {e}")
         return False
 
 def _local_delete(path: str) -> bool:
-    """로컬 파일 삭제. 없으면 False."""
+    """로컬 파일 삭제. 없으면 False. 조건부 쓰기가 남긴 <file>.lock도 함께 지운다."""
     try:
-        if p.exists(path):
-            os.remove(path)
+        if p.exists(path + ".lock"):
+            # 쓰는 중인 요청이 끝난 뒤 지운다 (잠금을 쥔 채 파일 + 잠금 파일 제거)
+            with _local_write_lock(path):
+                existed = p.exists(path)
+                if existed:
+                    os.remove(path)
+                os.remove(path + ".lock")
+        else:
+            existed = p.exists(path)
+            if existed:
+                os.remove(path)
+        if existed:
             print(f"[DEL] Local deleted: {path}")
             return True
         print(f"[DEL] Local file not found: {path}")
@@ -290,7 +445,10 @@ def delete_user_store_by_id(user_id: str) -> bool:
     # _resolve_store_path_for_user는 .json 확장자 붙이고 안전화함
     path = _resolve_store_path_for_user(user_id)
     print(f"[DEL] target → {path}")
-    return _gcs_delete(path) if _is_gs_path(path) else _local_delete(path)
+    sess = _CUR_STORE.get()
+    if sess is not None:
+        sess.forget(path)
+    return _conversation_store().delete(path)
 
 def delete_current_user_store() -> bool:
     """
@@ -334,30 +492,17 @@ def _max_turns() -> int:
     
 def _trim_session_turns(db: dict, session_id: str, *, max_turns: int | None = None) -> int:
     """
-    세션 내 turns를 뒤에서부터(최신 우선) max_turns만 남기고 앞부분(오래된 것) 삭제.
-    반환: 삭제된 개수
+    세션의 hot 구간을 최근 max_turns(없으면 CONVO_MAX_TURNS)개로 유지.
+    밀려난 턴은 버리지 않고 세션별 cold 아카이브로 옮긴다 (_db_apply의 trim op).
+    반환: hot 구간에서 빠진 개수
     """
     limit = max_turns or _max_turns()
     sess = (db.get("sessions") or {}).get(session_id) or {}
-    turns = list(sess.get("turns") or [])
-    before = len(turns)
-
-    # 방어: limit가 비정상(예: 0/음수/작게 들어옴)이어도 최소 10 유지
-    if limit < 10:
-        print(f"[TRIM][GUARD] limit<{10} detected ({limit}) -> force=10")
-        limit = 10
-
-    if before <= limit:
-        print(f"[TRIM] session='{session_id}' before={before} <= limit={limit} -> no trim")
+    before = len(sess.get("turns") or [])
+    if limit < 1 or before <= limit:
         return 0
-
-    kept = turns[-limit:]              # ✅ '최근 limit개' 유지
-    removed = before - len(kept)
-    sess["turns"] = kept
-    db["sessions"][session_id] = sess
-
-    #print(f"[TRIM] session='{session_id}' before={before} removed={removed} kept={len(kept)} limit={limit}")
-    return removed
+    _db_apply(db, {"op": "trim", "sid": session_id, "max_turns": limit})
+    return before - len(db["sessions"][session_id]["turns"])
 
 
 def _resolve_store_path() -> str:
@@ -375,7 +520,7 @@ def _resolve_store_path() -> str:
         return path
     
     # (전역 파일로 저장하는 *레거시* 경로 — 사용자 미지정 요청 전용)
-    in_cloud = bool(os.getenv("K_SERVICE") or os.getenv("FUNCTION_TARGET") or os.getenv("FIREBASE_CONFIG"))
+    in_cloud = _use_gcs()
     if in_cloud:
         bucket = os.getenv("GCS_BUCKET")
         if not bucket:
@@ -392,39 +537,297 @@ def _resolve_store_path() -> str:
     return path
 
 
-def _gcs_read_text(gs_path: str) -> str:
-    bucket, name = _parse_gs_path(gs_path)
-    client = storage.Client()
-    bkt = client.bucket(bucket)
-    blob = bkt.blob(name)
-    if not blob.exists(client):
+# ================== 프로세스 문서 캐시 (generation 검증) ==================
+# 웜 인스턴스에서 같은 사용자 파일을 매 턴 다시 받아 파싱하지 않도록,
+# 파싱된 db + 객체 generation/metageneration을 프로세스 LRU에 보관한다.
+#   - GCS  : if_generation_not_match=<캐시 generation> 조건부 다운로드
+#            → 304(NotModified)면 캐시 사본 사용, 바뀌었을 때만 다운로드/파싱
+#   - 로컬 : (st_ino, st_mtime_ns, st_size)를 generation 대용으로 비교 (_local_version)
+#            .tmp → os.replace로 쓰므로 기록마다 inode가 바뀐다 → mtime 해상도가 거친 파일시스템에서도 구분
+#   - 우리 쓰기 : 업로드가 돌려준 generation으로 캐시 갱신
+#   - 삭제 : delete_user_store_by_id()에서 제거
+# 용량은 직렬화 바이트 합계(CONVO_CACHE_MAX_BYTES, 기본 32MB)로 제한한다.
+
+_DOC_CACHE: "OrderedDict[str, dict]" = OrderedDict()   # path -> {db, generation, metageneration, size}
+_DOC_CACHE_BYTES = 0
+_DOC_CACHE_LOCK = threading.Lock()
+_DOC_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+_LOCAL_WRITE_LOCK = threading.Lock()
+
+
+class StoreConflict(Exception):
+    """조건부 쓰기 실패 — 읽은 뒤 다른 요청이 먼저 같은 객체를 기록함"""
+
+    def __init__(self, path: str, expected=None):
+        super().__init__(f"store conflict: {path} (expected generation={expected})")
+        self.path = path
+        self.expected = expected
+
+
+def _doc_cache_max_bytes() -> int:
+    return env_int("CONVO_CACHE_MAX_BYTES", 32 * 1024 * 1024, lo=0)
+
+
+def _json_clone(obj):
+    """JSON 호환 구조(dict/list/원시값) 깊은 복사. copy.deepcopy보다 가볍다."""
+    if isinstance(obj, dict):
+        return {k: _json_clone(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_json_clone(v) for v in obj]
+    return obj
+
+
+def _doc_cache_get(path: str) -> dict | None:
+    with _DOC_CACHE_LOCK:
+        entry = _DOC_CACHE.get(path)
+        if entry is not None:
+            _DOC_CACHE.move_to_end(path)
+        return entry
+
+
+def _doc_cache_put(path: str, db: dict, generation, metageneration, size: int) -> None:
+    """db는 호출자 소유 그대로 두고 사본을 보관한다."""
+    global _DOC_CACHE_BYTES
+    limit = _doc_cache_max_bytes()
+    if generation is None or size > limit:
+        _doc_cache_evict(path)
+        return
+    entry = {"db": _json_clone(db), "generation": generation,
+             "metageneration": metageneration, "size": size}
+    with _DOC_CACHE_LOCK:
+        old = _DOC_CACHE.pop(path, None)
+        if old is not None:
+            _DOC_CACHE_BYTES -= old["size"]
+        _DOC_CACHE[path] = entry
+        _DOC_CACHE_BYTES += size
+        while _DOC_CACHE_BYTES > limit and _DOC_CACHE:
+            _, ev = _DOC_CACHE.popitem(last=False)
+            _DOC_CACHE_BYTES -= ev["size"]
+            _DOC_CACHE_STATS["evictions"] += 1
+
+
+def _doc_cache_evict(path: str) -> None:
+    global _DOC_CACHE_BYTES
+    with _DOC_CACHE_LOCK:
+        old = _DOC_CACHE.pop(path, None)
+        if old is not None:
+            _DOC_CACHE_BYTES -= old["size"]
+
+
+def get_doc_cache_stats() -> dict:
+    """문서 캐시 현황 (진단용)"""
+    with _DOC_CACHE_LOCK:
+        return {**_DOC_CACHE_STATS, "entries": len(_DOC_CACHE), "bytes": _DOC_CACHE_BYTES}
+
+
+def _gcs_read_bytes(gs_path: str, *, if_generation_not_match=None) -> tuple[bytes | None, object, object]:
+    """
+    반환: (raw, generation, metageneration)
+    - if_generation_not_match와 같은 generation이면 raw=None (본문 전송 없음)
+    - 객체 없으면 FileNotFoundError
+    """
+    blob = _gcs_blob(gs_path)
+    try:
+        raw = blob.download_as_bytes(
+            timeout=_gcs_timeout(),
+            retry=_gcs_retry(),
+            if_generation_not_match=if_generation_not_match,
+        )
+    except NotModified:
+        return None, if_generation_not_match, None
+    except NotFound:
         raise FileNotFoundError(gs_path)
-    return blob.download_as_text(encoding="utf-8", timeout=10)
+    # 다운로드 응답 헤더(x-goog-generation/metageneration)로 채워짐
+    return raw, blob.generation, blob.metageneration
 
-def _gcs_write_text(gs_path: str, text: str) -> None:
-    bucket, name = _parse_gs_path(gs_path)
-    client = storage.Client()
-    bkt = client.bucket(bucket)
-    blob = bkt.blob(name)
+
+def _gcs_read_text(gs_path: str) -> str:
+    raw, _, _ = _gcs_read_bytes(gs_path)
+    return raw.decode("utf-8")
+
+
+def _gcs_write_text(gs_path: str, text: str, content_type: str = "application/json",
+                    *, if_generation_match=None) -> tuple[object, object]:
+    """
+    업로드 후 (generation, metageneration) 반환
+    - if_generation_match: 읽을 때의 generation (0 = 객체가 없어야 함). 다르면 StoreConflict
+    """
+    blob = _gcs_blob(gs_path)
     blob.cache_control = "no-store"
-    blob.content_type = "application/json"
-    blob.upload_from_string(text, content_type="application/json", timeout=10)
+    blob.content_type = content_type
+    # 전체 객체 덮어쓰기(또는 조건부 쓰기)라 재시도해도 결과가 같다 → 재시도 허용
+    try:
+        blob.upload_from_string(text, content_type=content_type,
+                                timeout=_gcs_timeout(), retry=_gcs_retry(),
+                                if_generation_match=if_generation_match)
+    except PreconditionFailed:
+        raise StoreConflict(gs_path, if_generation_match)
     #print(f"[JSON-SAVE] GCS {gs_path} 저장 완료 (size={len(text)} bytes)")
+    return blob.generation, blob.metageneration
 
 
-def _db_save(db: dict) -> None:
-    path = _resolve_store_path()
+def _local_version(st: os.stat_result) -> tuple[int, int, int]:
+    """로컬 파일 generation 대용 (inode, mtime_ns, size)"""
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _local_read_bytes(path: str, *, if_generation_not_match=None) -> tuple[bytes | None, object, object]:
+    """로컬 파일용 (raw, _local_version, size). 캐시와 같은 파일이면 raw=None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise FileNotFoundError(path)
+    version = _local_version(st)
+    if if_generation_not_match is not None and if_generation_not_match == version:
+        return None, version, st.st_size
+    with open(path, "rb") as f:
+        raw = f.read()
+    return raw, version, st.st_size
+
+
+# --- 경로 독립 I/O 프리미티브 (GCS/로컬 공용, 포맷 모듈에서 사용) ----------------
+
+def _store_join(path: str, *parts: str) -> str:
+    if _is_gs_path(path):
+        return "/".join([path.rstrip("/"), *parts])
+    return os.path.join(path, *parts)
+
+
+def _store_read_bytes(path: str, *, if_generation_not_match=None) -> tuple[bytes | None, object, object]:
+    """반환: (raw|None, generation, metageneration). 없으면 FileNotFoundError"""
+    if _is_gs_path(path):
+        return _gcs_read_bytes(path, if_generation_not_match=if_generation_not_match)
+    return _local_read_bytes(path, if_generation_not_match=if_generation_not_match)
+
+
+@contextmanager
+def _local_write_lock(path: str):
+    """로컬 조건부 쓰기용 잠금 (프로세스 내 Lock + 가능하면 <file>.lock flock)"""
+    with _LOCAL_WRITE_LOCK:
+        try:
+            import fcntl
+        except ImportError:      # Windows 로컬 개발: 프로세스 내 잠금만
+            yield
+            return
+        with open(path + ".lock", "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _store_write_text(path: str, text: str, content_type: str = "application/json",
+                      *, if_generation_match=None) -> tuple[object, object]:
+    """
+    전체 기록 (GCS 업로드 또는 로컬 .tmp → replace). 반환: (generation, metageneration)
+    - if_generation_match가 있으면 조건부 쓰기 (GCS: 412 / 로컬: _local_version 비교) → 다르면 StoreConflict
+    """
+    if _is_gs_path(path):
+        return _gcs_write_text(path, text, content_type, if_generation_match=if_generation_match)
+    # (B) 로컬 원자적 쓰기: <file>.tmp → replace
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if if_generation_match is None:
+        return _local_replace(path, text)
+    with _local_write_lock(path):
+        try:
+            current = _local_version(os.stat(path))
+        except OSError:
+            current = 0
+        if current != if_generation_match:
+            raise StoreConflict(path, if_generation_match)
+        return _local_replace(path, text)
+
+
+def _local_replace(path: str, text: str) -> tuple[object, object]:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+    st = os.stat(path)
+    return _local_version(st), st.st_size
+
+
+def _store_write_bytes(path: str, raw: bytes, content_type: str = "application/octet-stream") -> None:
+    """불변 객체(압축 아카이브 등) 기록. 매번 새 이름으로 쓰므로 조건부 쓰기 없음"""
+    if _is_gs_path(path):
+        blob = _gcs_blob(path)
+        blob.content_type = content_type
+        blob.upload_from_string(raw, content_type=content_type, timeout=_gcs_timeout(), retry=_gcs_retry())
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+
+
+def _store_delete(path: str) -> bool:
+    return _gcs_delete(path) if _is_gs_path(path) else _local_delete(path)
+
+
+def _store_list(prefix: str) -> list[str]:
+    """prefix(디렉터리) 아래 객체 경로 목록"""
+    if _is_gs_path(prefix):
+        bucket, name = _parse_gs_path(prefix)
+        blobs = _gcs_client().list_blobs(bucket, prefix=name.rstrip("/") + "/", timeout=_gcs_timeout())
+        return [f"gs://{bucket}/{b.name}" for b in blobs]
+    out = []
+    for root, _, files in os.walk(prefix):
+        out.extend(os.path.join(root, f) for f in files)
+    return out
+
+
+def _store_format() -> str:
+    """
+    CONVO_STORE_FORMAT
+      - doc       : (기본) 사용자당 JSON 문서 1개를 통째로 읽고/쓴다
+      - segmented : 세션별 불변 JSONL 세그먼트 + manifest (conv_formats 참고)
+      - sessions  : 세션당 객체 1개 + 프로필 인덱스 (활성 세션만 읽음, conv_formats 참고)
+    """
+    return (os.getenv("CONVO_STORE_FORMAT") or "doc").strip().lower()
+
+
+def _normalize_db(db: dict) -> dict:
+    """list → dict 마이그레이션 + sessions 루트 보정"""
+    sess = db.get("sessions")
+    if isinstance(sess, list):
+        new_sessions = {}
+        for s in sess:
+            sid = (s.get("meta") or {}).get("session_id") or s.get("id") or f"migrated_{len(new_sessions)+1}"
+            new_sessions[sid] = s
+        db["sessions"] = new_sessions
+    if "sessions" not in db or not isinstance(db["sessions"], dict):
+        db["sessions"] = {}
+    _db_manifest(db)
+    return db
+
+
+def _conversation_store():
+    """설정(CONVO_BACKEND)에 맞는 ConversationStore (프로세스 공유)"""
+    import conv_backends
+    return conv_backends.get_conversation_store()
+
+
+def _db_write(path: str, db: dict) -> None:
+    """path에 db 전체를 기록 (백엔드에 위임)"""
+    _conversation_store().save(path, db)
+
+
+def _db_read(path: str) -> dict:
+    """path에서 db를 읽어 정규화 (백엔드에 위임, 없으면 새 구조)"""
+    return _conversation_store().load(path)
+
+
+def _doc_write(path: str, db: dict, *, if_generation_match=None) -> object:
+    """
+    v1 문서 전체 기록 (GCS 업로드 또는 로컬 원자적 쓰기) + 문서 캐시 갱신
+    반환: 새 generation. if_generation_match와 다르면 StoreConflict
+    """
     payload = json.dumps(db, ensure_ascii=False, indent=2)
     #print(f"path : {path}, payload : {payload}") // payload: 모든 대화내용 출력 , path :  gs://chatsaju-5cd67-convos/conversations.json
-    if _is_gs_path(path):
-        _gcs_write_text(path, payload)
-    else:
-        # (B) 로컬 원자적 쓰기: <file>.tmp → replace
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        tmp = path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            f.write(payload)
-        os.replace(tmp, path)
+    generation, metageneration = _store_write_text(path, payload, if_generation_match=if_generation_match)
+    _doc_cache_put(path, db, generation, metageneration, len(payload.encode("utf-8")))
 
     # 진단용: 총 턴 수 출력
     sessions = db.get("sessions", {})
@@ -433,20 +836,32 @@ def _db_save(db: dict) -> None:
         for s in sessions.values():
             turns += len(s.get("turns", []))
     #print(f"[JSON-SAVE] {path} 저장 완료 (세션 수: {len(sessions)}, 총 턴 수: {turns})")       #저장 로그: 
+    return generation
 
 
-def _db_load() -> dict:    
-    path = _resolve_store_path()
-    #print(f"[PATH] {_resolve_store_path.__name__} → {path}")       //[PATH] _resolve_store_path → gs://chatsaju-5cd67-convos/김지은__19880716.json
-    
+def _doc_read(path: str) -> dict:
+    """v1 문서({"version": 1, "sessions": {...}}) 읽기 + 문서 캐시"""
+    return _doc_read_versioned(path)[0]
+
+
+def _doc_read_versioned(path: str) -> tuple[dict, object]:
+    """
+    _doc_read + 읽은 시점의 generation (조건부 쓰기용)
+    - 객체가 없으면 generation=0 (GCS if_generation_match=0 의미: '없어야 함')
+    """
+    cached = _doc_cache_get(path)
+    since = cached["generation"] if cached else None
+    version = 0
     try:
-        if _is_gs_path(path):
-            raw = _gcs_read_text(path)
-            db = json.loads(raw)
-        else:
-            with open(path, "r", encoding="utf-8") as f:
-                db = json.load(f)
+        raw, generation, metageneration = _store_read_bytes(path, if_generation_not_match=since)
+        version = generation
+        if raw is None and cached is not None:
+            _DOC_CACHE_STATS["hits"] += 1
+            return _json_clone(cached["db"]), version
+        _DOC_CACHE_STATS["misses"] += 1
+        db = json.loads(raw)
     except (FileNotFoundError, json.JSONDecodeError):
+        _doc_cache_evict(path)
         print(f"[JSON-LOAD] {path} 없음/비어있음 → 새 DB 구조 생성")
         db = {"version": 1, "sessions": {}}
         # (A) 사용자 컨텍스트가 잡혀 있으면 user 메타 주입
@@ -458,26 +873,587 @@ def _db_load() -> dict:
                 db["user"] = {"id": uid, **um}
         except Exception:
             pass
+        generation = None
 
     # list → dict 마이그레이션 유지
-    sess = db.get("sessions")
-    if isinstance(sess, list):
-        new_sessions = {}
-        for s in sess:
-            sid = (s.get("meta") or {}).get("session_id") or s.get("id") or f"migrated_{len(new_sessions)+1}"
-            new_sessions[sid] = s
-        db["sessions"] = new_sessions
-    if "sessions" not in db or not isinstance(db["sessions"], dict):
-        db["sessions"] = {}
+    _normalize_db(db)
+    if generation is not None:
+        _doc_cache_put(path, db, generation, metageneration, len(raw))
+    return db, version
+
+
+# ================== 요청 단위 저장소 세션 (Unit of Work) ==================
+# ask_saju 한 번 동안:
+#   - 사용자 파일은 처음 _db_load() 때 1회만 읽고, 이후 호출은 같은 메모리 사본을 돌려준다.
+#   - _db_save()는 즉시 업로드하지 않고 '변경됨' 표시만 남긴다.
+#   - 새 세션/유저 턴/어시스턴트 턴/트림은 _db_apply()로 op 목록에 쌓인다.
+#   - 요청이 끝날 때 end_store_session()이 변경된 파일을 1회 쓴다.
+# 세션이 열려 있지 않으면(스크립트 등) 기존처럼 매번 읽고/쓴다.
+
+class StoreSession:
+    """요청 1건 동안의 저장소 사본 + 보류 중인 변경(op) + 읽기/쓰기 카운터"""
+
+    def __init__(self):
+        self.docs: dict[str, dict] = {}         # path -> db (요청 동안 공유되는 사본)
+        self.dirty: set[str] = set()            # 요청 끝에 써야 하는 path
+        self.ops: dict[str, list[dict]] = {}    # path -> 보류 중인 변경 목록
+        self.versions: dict[str, object] = {}   # path -> 읽을 때의 버전(generation 등, 조건부 쓰기용)
+        self.cold: dict[str, dict[str, list[dict]]] = {}   # path -> sid -> cold로 옮길 턴 (기록 전)
+        self.archived: dict[str, set] = {}                 # path -> 이번 요청에서 이미 아카이브한 턴 키
+        self.reads = 0
+        self.writes = 0
+        self.conflicts = 0
+
+    def forget(self, path: str) -> None:
+        """삭제된 파일은 사본/보류 변경을 버린다 (끝에 다시 써서 되살리지 않도록)"""
+        self.docs.pop(path, None)
+        self.ops.pop(path, None)
+        self.versions.pop(path, None)
+        self.cold.pop(path, None)
+        self.archived.pop(path, None)
+        self.dirty.discard(path)
+
+    def stage_cold(self, path: str, sid: str, turns: list[dict]) -> None:
+        """hot 구간에서 밀려난 턴을 보류 (flush 때 본 문서보다 먼저 아카이브)"""
+        seen = self.archived.setdefault(path, set())
+        fresh = [t for t in turns if _turn_key(t) not in seen]
+        if fresh:
+            seen.update(_turn_key(t) for t in fresh)
+            self.cold.setdefault(path, {}).setdefault(sid, []).extend(fresh)
+
+    def _archive_cold(self, store, path: str) -> None:
+        # 아카이브 먼저 → 본 문서 기록이 실패/충돌해도 밀려난 턴은 남는다 (중복은 읽을 때 제거)
+        staged = self.cold.pop(path, None) or {}
+        if store.archives_on_trim:
+            # sqlite/memory: apply_ops의 trim이 실제로 지운 행을 같은 트랜잭션에서 옮긴다
+            return
+        for sid, turns in staged.items():
+            store.archive_turns(path, sid, turns)
+
+    def flush(self) -> int:
+        """변경된 파일을 path당 1회씩 기록. 반환: 기록한 파일 수"""
+        written = 0
+        store = _conversation_store()
+        for path in list(self.dirty):
+            db = self.docs.get(path)
+            if db is None:
+                continue
+            self._archive_cold(store, path)
+            if self.ops.get(path):
+                # 백엔드/포맷이 op만 반영할 수 있으면 그렇게 (세그먼트/세션 객체/행 단위)
+                self._apply_with_retry(store, path, self.ops[path], db)
+            else:
+                store.save(path, db)
+            self.writes += 1
+            written += 1
+        self.dirty.clear()
+        self.ops.clear()
+        return written
+
+    def _apply_with_retry(self, store, path: str, ops: list[dict], db: dict) -> None:
+        """
+        읽은 버전 기준 조건부 쓰기. 충돌하면 최신본을 다시 읽고 op(세션/턴 추가/트림)를
+        재적용해 재시도한다 (CONVO_WRITE_RETRIES회, 지수 백오프 + 지터).
+        """
+        expected = self.versions.get(path)
+        retries = env_int("CONVO_WRITE_RETRIES", 4, lo=0)
+        base_ms = env_float("CONVO_WRITE_BACKOFF_MS", 50.0, lo=0)
+        attempt = 0
+        while True:
+            try:
+                store.apply_ops(path, ops, db, expected_version=expected)
+                return
+            except StoreConflict as e:
+                attempt += 1
+                self.conflicts += 1
+                _CONTENTION_STATS["conflicts"] += 1
+                if attempt > retries:
+                    _CONTENTION_STATS["gave_up"] += 1
+                    print(f"[STORE][CONFLICT] 재시도 한도 초과 ({retries}) — {e}")
+                    raise
+                delay = min(1000.0, base_ms * (2 ** (attempt - 1))) * (0.5 + random.random())
+                print(f"[STORE][CONFLICT] {path} attempt={attempt} backoff={delay:.0f}ms → 재로드 후 op {len(ops)}개 재적용")
+                time.sleep(delay / 1000.0)
+                _CONTENTION_STATS["retries"] += 1
+                db, expected = store.load_with_version(path)
+                for op in ops:
+                    evicted = _apply_op(db, op)
+                    if evicted:
+                        # 최신본 기준으로 더 밀려난 턴이 있으면 그것도 아카이브
+                        self.stage_cold(path, op["sid"], evicted)
+                self.docs[path] = db
+                self._archive_cold(store, path)
+
+    def stats(self) -> dict:
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "conflicts": self.conflicts,
+            "pending_ops": sum(len(v) for v in self.ops.values()),
+        }
+
+
+# 프로세스 누적 경합 카운터 (요청당 동시성 상향 시 모니터링용)
+_CONTENTION_STATS = {"conflicts": 0, "retries": 0, "gave_up": 0}
+
+
+def get_store_contention_stats() -> dict:
+    """조건부 쓰기 충돌/재시도/포기 누적 횟수"""
+    return dict(_CONTENTION_STATS)
+
+
+_CUR_STORE: ContextVar[StoreSession | None] = ContextVar("_CUR_STORE", default=None)
+
+
+def begin_store_session() -> Token:
+    """
+    요청 시작 시 호출. 반환된 토큰은 반드시 end_store_session()에 넘긴다.
+    사용자 컨텍스트(_CUR_USER_ID/_CUR_APP_UID)는 따로 세팅하며, 경로는 호출 시점마다 해석된다.
+    """
+    return _CUR_STORE.set(StoreSession())
+
+
+def end_store_session(token: Token, *, flush: bool = True) -> dict:
+    """
+    보류 중인 변경을 1회 기록하고 세션을 닫는다.
+    - CONVO_WRITE_MODE=sync (기본) : 여기서 바로 기록 (응답 반환 전 내구성 보장)
+    - CONVO_WRITE_MODE=async       : 백그라운드 flusher 큐에 넘기고 바로 반환
+    반환: {"reads", "writes", "pending_ops", "ops", "flush_ms", "deferred"} (이번 요청의 저장소 I/O)
+    """
+    sess = _CUR_STORE.get()
+    ops = sess.stats()["pending_ops"] if sess else 0
+    deferred = False
+    t0 = time.perf_counter()
+    try:
+        if flush and sess is not None and sess.dirty:
+            if _write_mode() == "async":
+                deferred = _WRITE_BEHIND.submit(sess)
+            if not deferred:
+                _timed_flush(sess)
+    finally:
+        _CUR_STORE.reset(token)
+    critical_ms = (time.perf_counter() - t0) * 1000
+    _WB_STATS["critical_ms_total"] += critical_ms
+    stats = sess.stats() if sess else {"reads": 0, "writes": 0, "conflicts": 0, "pending_ops": 0}
+    stats["ops"] = ops
+    stats["flush_ms"] = round(critical_ms, 1)
+    stats["deferred"] = deferred
+    gcs = get_gcs_stats()
+    print(f"[STORE][UOW] reads={stats['reads']} writes={'queued' if deferred else stats['writes']} ops={ops} "
+          f"conflicts={stats['conflicts']} critical_ms={critical_ms:.1f} gcs_conns={gcs['connections_created']}")
+    return stats
+
+
+# ================== 지연 기록 (write-behind) ==================
+# 요청 세션의 변경(유저 턴/어시스턴트 턴/트림)은 이미 메모리에 모였다가 요청 끝에 1회 기록된다.
+# CONVO_WRITE_MODE 로 그 1회 기록을 어디서 할지 정한다:
+#   sync  : (기본) end_store_session()에서 응답 반환 전에 기록 → 반환 시점에 내구성 보장
+#   async : 제한 크기 큐(CONVO_WRITE_QUEUE_MAX, 기본 256)에 넘기고 백그라운드 스레드가 기록
+#           - 큐가 가득 차면 그 요청은 동기 기록으로 대체 (역압)
+#           - 같은 사용자 파일을 다시 읽을 때는 보류 중인 기록이 끝나길 기다린다 (최대 CONVO_WRITE_WAIT_S초)
+#           - 인스턴스 종료(SIGTERM/atexit) 시 큐를 비운다 (최대 CONVO_WRITE_DRAIN_S초)
+#           - 강제 종료되면 큐에 남은 턴은 유실될 수 있다
+# get_write_behind_stats()의 saved_ms_total = 백그라운드로 옮겨 응답 경로에서 빠진 기록 시간
+
+_WB_STATS = {
+    "sync_flushes": 0, "async_flushes": 0, "inline_fallbacks": 0, "errors": 0,
+    "flush_ms_total": 0.0, "critical_ms_total": 0.0, "saved_ms_total": 0.0, "queue_high_water": 0,
+}
+
+
+def _write_mode() -> str:
+    return (os.getenv("CONVO_WRITE_MODE") or "sync").strip().lower()
+
+
+def _timed_flush(sess: StoreSession, *, background: bool = False) -> None:
+    t0 = time.perf_counter()
+    try:
+        sess.flush()
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        _WB_STATS["flush_ms_total"] += ms
+        if background:
+            _WB_STATS["async_flushes"] += 1
+            _WB_STATS["saved_ms_total"] += ms
+        else:
+            _WB_STATS["sync_flushes"] += 1
+
+
+class WriteBehindFlusher:
+    """요청 세션 flush를 받아 백그라운드 스레드 1개에서 순서대로 기록"""
+
+    def __init__(self):
+        import queue
+        self._queue = queue.Queue(maxsize=env_int("CONVO_WRITE_QUEUE_MAX", 256, lo=1))
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._pending: dict[str, int] = {}          # path -> 보류 중인 flush 수
+        self._cond = threading.Condition()
+
+    def submit(self, sess: StoreSession) -> bool:
+        """큐에 넣었으면 True, 가득 차서 못 넣었으면 False (호출부가 동기 기록)"""
+        import contextvars, queue
+        self._ensure_worker()
+        paths = list(sess.dirty)
+        with self._cond:
+            for path in paths:
+                self._pending[path] = self._pending.get(path, 0) + 1
+        try:
+            # 사용자/세션 컨텍스트(충돌 시 재로드 경로 해석용)를 그대로 들고 간다
+            self._queue.put_nowait((contextvars.copy_context(), sess, paths))
+        except queue.Full:
+            self._done(paths)
+            _WB_STATS["inline_fallbacks"] += 1
+            print("[STORE][WB] 큐 가득 참 → 동기 기록")
+            return False
+        _WB_STATS["queue_high_water"] = max(_WB_STATS["queue_high_water"], self._queue.qsize())
+        return True
+
+    def wait_path(self, path: str, timeout: float | None = None) -> bool:
+        """path에 보류 중인 기록이 끝날 때까지 대기 (read-your-writes). 시간 초과면 False"""
+        if not self._pending.get(path):
+            return True
+        timeout = env_float("CONVO_WRITE_WAIT_S", 5.0, lo=0) if timeout is None else timeout
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending.get(path), timeout=timeout)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """큐가 빌 때까지 대기 (종료 훅). 모두 기록했으면 True"""
+        if self._thread is None:
+            return True
+        timeout = env_float("CONVO_WRITE_DRAIN_S", 8.0, lo=0) if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            ok = self._cond.wait_for(lambda: not any(self._pending.values()), timeout=max(0.0, deadline - time.monotonic()))
+        print(f"[STORE][WB] drain {'완료' if ok else '시간 초과'} (남은 큐={self._queue.qsize()})")
+        return ok
+
+    def _done(self, paths: list[str]) -> None:
+        with self._cond:
+            for path in paths:
+                n = self._pending.get(path, 0) - 1
+                if n > 0:
+                    self._pending[path] = n
+                else:
+                    self._pending.pop(path, None)
+            self._cond.notify_all()
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="convo-write-behind", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            ctx, sess, paths = self._queue.get()
+            try:
+                ctx.run(_timed_flush, sess, background=True)
+            except Exception as e:
+                _WB_STATS["errors"] += 1
+                print(f"[STORE][WB][ERR] 지연 기록 실패: {paths} — {e}")
+            finally:
+                self._done(paths)
+                self._queue.task_done()
+
+
+_WRITE_BEHIND = WriteBehindFlusher()
+
+
+def get_write_behind_stats() -> dict:
+    """지연 기록 현황 (saved_ms_total: 응답 경로에서 빠진 기록 시간 누적)"""
+    out = {k: (round(v, 1) if isinstance(v, float) else v) for k, v in _WB_STATS.items()}
+    out["mode"] = _write_mode()
+    out["queued"] = _WRITE_BEHIND._queue.qsize()
+    return out
+
+
+def drain_write_behind(timeout: float | None = None) -> bool:
+    return _WRITE_BEHIND.drain(timeout)
+
+
+def _install_shutdown_hooks() -> None:
+    """atexit + SIGTERM(Cloud Run 종료 신호)에서 지연 기록 큐 비우기"""
+    import atexit, signal
+    atexit.register(drain_write_behind)
+    try:
+        prev = signal.getsignal(signal.SIGTERM)
+
+        def _on_sigterm(signum, frame):
+            drain_write_behind()
+            if callable(prev):
+                prev(signum, frame)
+            else:
+                raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, _on_sigterm)
+    except (ValueError, AttributeError):
+        # 메인 스레드가 아니거나 SIGTERM 미지원(Windows) → atexit만
+        pass
+
+
+if _write_mode() == "async":
+    _install_shutdown_hooks()
+
+
+@contextmanager
+def store_session():
+    """
+    예)
+      with store_session():
+          ensure_session(sid)
+          record_turn_message(...)
+    - 이미 요청 세션이 열려 있으면 그대로 합류(중첩 시 flush는 바깥에서 1회)
+    """
+    if _CUR_STORE.get() is not None:
+        yield _CUR_STORE.get()
+        return
+    token = begin_store_session()
+    try:
+        yield _CUR_STORE.get()
+    finally:
+        end_store_session(token)
+
+
+def get_store_session_stats() -> dict | None:
+    """현재 요청 세션의 읽기/쓰기 카운터 (세션이 없으면 None)"""
+    sess = _CUR_STORE.get()
+    return sess.stats() if sess else None
+
+
+def _apply_op(db: dict, op: dict) -> list[dict]:
+    """
+    변경 op 1개를 db에 적용.
+      {"op": "session", "sid", "meta"}       : 세션이 없으면 생성
+      {"op": "append",  "sid", "turn"}       : 턴 추가 (세션 없으면 자동 생성)
+      {"op": "trim",    "sid", "max_turns"}  : 최근 max_turns개만 hot 구간에 유지
+    반환: trim으로 hot 구간에서 밀려난 턴 (cold 아카이브 대상, 그 외 op는 [])
+    """
+    sessions = db.setdefault("sessions", {})
+    manifest = _db_manifest(db)
+    sid = op["sid"]
+    kind = op["op"]
+    if kind in ("session", "append") and sid not in sessions:
+        meta = op.get("meta") or {"session_id": sid, "created_at": op.get("ts") or "", "title": "사주 대화"}
+        sessions[sid] = {"meta": dict(meta), "turns": []}
+        if sid not in manifest:
+            manifest[sid] = _summary_new(sid, sessions[sid]["meta"])
+    if kind == "append":
+        sessions[sid].setdefault("turns", []).append(op["turn"])
+        _summary_add_turn(manifest.setdefault(sid, _summary_new(sid, sessions[sid]["meta"])), op["turn"])
+    elif kind == "trim":
+        sess = sessions.get(sid)
+        limit = max(0, int(op["max_turns"]))
+        if sess and isinstance(sess.get("turns"), list) and len(sess["turns"]) > limit:
+            cut = len(sess["turns"]) - limit
+            evicted = sess["turns"][:cut]
+            sess["turns"] = sess["turns"][cut:]
+            if sid in manifest:
+                manifest[sid]["turns"] = len(sess["turns"])
+            return evicted
+    return []
+
+
+# ================== 세션 매니페스트 (프로필 단위 세션 요약) ==================
+# 세션마다 턴 수 / 마지막 user·assistant 턴(id, ts, 질문 해시) / 제목 / 생성 시각을 db["manifest"]에 둔다.
+# _apply_op가 변경마다 갱신하므로 히스토리 게이트·중복 체크·세션 목록이 턴 목록을 훑지 않는다.
+#   doc/memory : 문서의 "manifest" 루트에 함께 저장 (문서 캐시에도 그대로 실림)
+#   sessions   : index.json 세션 항목 (세션 객체를 읽지 않고 전체 세션 요약)
+#   segmented  : manifest.json 세션 항목의 "summary"
+#   sqlite     : 조회 시 (key, session_id, ts) 인덱스로 계산
+# 매니페스트가 없는 기존 문서는 읽을 때(_normalize_db) 한 번 만들어진다.
+
+def _text_hash(text) -> str:
+    """중복 질문 비교용 짧은 해시 (공백 정규화)"""
+    norm = " ".join(str(text or "").split())
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()[:16] if norm else ""
+
+
+def _summary_new(sid: str, meta: dict | None) -> dict:
+    meta = meta or {}
+    return {
+        "session_id": sid,
+        "title": meta.get("title") or "",
+        "created_at": meta.get("created_at") or "",
+        "turns": 0,
+        "last_ts": "",
+        "last_role": "",
+        "last_user_id": "", "last_user_ts": "", "last_user_hash": "", "last_user_uq_hash": "",
+        "last_assistant_id": "", "last_assistant_ts": "",
+    }
+
+
+def _summary_note_turn(entry: dict, turn: dict) -> None:
+    """turn이 그 역할의 마지막 턴이라고 보고 last_user_* / last_assistant_* 갱신"""
+    ts = str(turn.get("ts") or "")
+    tid = str(turn.get("id") or ts)
+    role = turn.get("role")
+    if role == "user":
+        entry.update(last_user_id=tid, last_user_ts=ts,
+                     last_user_hash=_text_hash(turn.get("text")),
+                     last_user_uq_hash=_text_hash(turn.get("updated_question")))
+    elif role == "assistant":
+        entry.update(last_assistant_id=tid, last_assistant_ts=ts)
+
+
+def _summary_add_turn(entry: dict, turn: dict) -> None:
+    entry["turns"] = int(entry.get("turns") or 0) + 1
+    entry["last_ts"] = str(turn.get("ts") or "")
+    entry["last_role"] = turn.get("role") or ""
+    _summary_note_turn(entry, turn)
+
+
+def _session_summary(sid: str, sess: dict) -> dict:
+    """세션 전체에서 요약 만들기 (마지막 user/assistant는 끝에서부터 찾는다)"""
+    entry = _summary_new(sid, sess.get("meta"))
+    turns = sess.get("turns") or []
+    entry["turns"] = len(turns)
+    if turns:
+        entry["last_ts"] = str(turns[-1].get("ts") or "")
+        entry["last_role"] = turns[-1].get("role") or ""
+    seen = set()
+    for t in reversed(turns):
+        role = t.get("role")
+        if role in ("user", "assistant") and role not in seen:
+            seen.add(role)
+            _summary_note_turn(entry, t)
+            if len(seen) == 2:
+                break
+    return entry
+
+
+def _db_manifest(db: dict) -> dict:
+    """db["manifest"] 보장 (빠진 세션만 turns에서 만든다). 반환: {sid: 요약}"""
+    manifest = db.get("manifest")
+    if not isinstance(manifest, dict):
+        manifest = db["manifest"] = {}
+    for sid, sess in (db.get("sessions") or {}).items():
+        if sid not in manifest and isinstance(sess, dict):
+            manifest[sid] = _session_summary(sid, sess)
+    return manifest
+
+
+def get_session_manifest() -> dict[str, dict]:
+    """
+    현재 사용자의 {session_id: 요약}.
+    요청 세션에 문서가 이미 올라와 있으면 그 사본에서, 아니면 백엔드가 요약만 읽는다
+    (sessions: index.json, segmented: manifest.json, sqlite: 인덱스 쿼리).
+    """
+    path = _resolve_store_path()
+    sess = _CUR_STORE.get()
+    if sess is not None and path in sess.docs:
+        return _db_manifest(sess.docs[path])
+    _WRITE_BEHIND.wait_path(path)
+    return _conversation_store().load_manifest(path)
+
+
+def get_session_summary(session_id: str) -> dict | None:
+    """세션 1개의 요약 (없으면 None)"""
+    return get_session_manifest().get(session_id)
+
+
+def _turn_key(turn: dict) -> tuple:
+    """cold 아카이브 중복 제거용 턴 식별자"""
+    return (turn.get("ts"), turn.get("role"), turn.get("text"))
+
+
+def _db_apply(db: dict, op: dict) -> None:
+    """op를 db에 적용하고, 요청 세션이 열려 있으면 보류 목록에 기록 (저장은 _db_save)"""
+    evicted = _apply_op(db, op)
+    path = _resolve_store_path()
+    sess = _CUR_STORE.get()
+    if sess is not None:
+        sess.ops.setdefault(path, []).append(op)
+        if evicted:
+            sess.stage_cold(path, op["sid"], evicted)
+    elif evicted:
+        # 요청 세션 밖: 곧 이어질 _db_save보다 먼저 아카이브
+        _conversation_store().archive_turns(path, op["sid"], evicted)
+
+
+def _db_save(db: dict) -> None:
+    path = _resolve_store_path()
+    sess = _CUR_STORE.get()
+    if sess is not None:
+        # 요청 세션 중에는 표시만 하고, end_store_session()에서 1회 기록
+        sess.docs[path] = db
+        sess.dirty.add(path)
+        return
+    _db_write(path, db)
+
+
+def _db_load() -> dict:    
+    path = _resolve_store_path()
+    #print(f"[PATH] {_resolve_store_path.__name__} → {path}")       //[PATH] _resolve_store_path → gs://chatsaju-5cd67-convos/김지은__19880716.json
+    sess = _CUR_STORE.get()
+    if sess is not None and path in sess.docs:
+        return sess.docs[path]
+
+    # async 지연 기록이 보류 중이면 끝나길 기다렸다 읽는다 (직전 턴 누락 방지)
+    _WRITE_BEHIND.wait_path(path)
+    if sess is None:
+        return _db_read(path)
+    db, version = _conversation_store().load_with_version(path)
+    sess.reads += 1
+    sess.docs[path] = db
+    sess.versions[path] = version
     return db
 
 
+def load_session_tail(session_id: str, n: int | None = None) -> list[dict]:
+    """
+    세션의 최근 n개 턴만 읽기 (n=None이면 전체)
+    - 요청 세션에 문서가 이미 올라와 있으면 그 사본에서 자른다.
+    - 그 외에는 백엔드가 세션 단위로 읽는다
+      (segmented: 끝쪽 세그먼트, sessions: 세션 객체, sqlite: LIMIT 쿼리)
+    """
+    path = _resolve_store_path()
+    sess = _CUR_STORE.get()
+    if not (sess is not None and path in sess.docs):
+        turns = _conversation_store().load_session_turns(path, session_id, n)
+        if turns is not None:
+            return turns
+    db = _db_load()
+    turns = ((db.get("sessions") or {}).get(session_id) or {}).get("turns") or []
+    return list(turns[-n:]) if n else list(turns)
+
+
+def load_session_archive(session_id: str) -> list[dict]:
+    """
+    세션의 cold 아카이브(hot 구간에서 밀려난 오래된 턴)를 시간순으로 읽기.
+    요청 경로에서는 읽지 않는다 — 과거 대화 검색/내보내기 등 필요할 때만 호출.
+    """
+    path = _resolve_store_path()
+    turns = _conversation_store().load_archive(path, session_id)
+    sess = _CUR_STORE.get()
+    if sess is not None:
+        # 아직 기록 전인 이번 요청의 밀려난 턴도 포함
+        turns = turns + list((sess.cold.get(path) or {}).get(session_id) or [])
+    seen, out = set(), []
+    for t in turns:
+        k = _turn_key(t)
+        if k not in seen:
+            seen.add(k)
+            out.append(t)
+    return out
+
+
+def load_full_session_history(session_id: str) -> list[dict]:
+    """cold 아카이브 + hot 구간을 이어 붙인 세션 전체 기록 (내보내기용)"""
+    hot = load_session_tail(session_id)
+    cold = load_session_archive(session_id)
+    hot_keys = {_turn_key(t) for t in hot}
+    return [t for t in cold if _turn_key(t) not in hot_keys] + hot
+
+
 
 def trim_session_history(session_id: str, max_turns: int = MAX_TURNS) -> bool:
     """
     db["sessions"][session_id]["turns"] 길이가 max_turns 를 넘으면
-    뒤에서 max_turns 개만 남기고 앞은 잘라낸다(밀어내기).
-    성공적으로 잘랐으면 True, 변화가 없으면 False 반환.
+    뒤에서 max_turns 개만 hot 구간에 남기고 앞은 cold 아카이브로 옮긴다(밀어내기).
+    옮겼으면 True, 변화가 없으면 False 반환.
     """
     
 
@@ -505,12 +1481,12 @@ def trim_session_history(session_id: str, max_turns: int = MAX_TURNS) -> bool:
         return False
 
     # 최근 max_turns 개만 남기기 (밀어내기)
-    new_turns = turns[-max_turns:]
-    sess["turns"] = new_turns
+    before = len(turns)
+    _db_apply(db, {"op": "trim", "sid": session_id, "max_turns": max_turns})
 
     try:
         _db_save(db)
-        print(f"[TRIM] 세션 {session_id} turn {len(turns)}→{len(new_turns)} 로 잘라냄 (max={max_turns})")
+        print(f"[TRIM] 세션 {session_id} turn {before}→{len(sess['turns'])} (나머지 cold 아카이브, max={max_turns})")
         return True
     except Exception as e:
         print(f"[TRIM] _db_save 실패: {e}")
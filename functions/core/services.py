@@ -1,5 +1,6 @@
 
 import json
+import os
 import hashlib
 from typing import Optional, List
 from datetime import date, datetime
@@ -7,7 +8,8 @@ import re
 
 from ganjiArray import extract_comparison_slices, format_comparison_block, parse_compare_specs
 from ganji_converter import Scope, get_ilju, get_wolju_from_date, get_year_ganji_from_json, JSON_PATH
-from regress_conversation import get_extract_chain, _today, _maybe_override_target_date
+from llm_memo import memo_json
+from regress_conversation import _EXTRACT_PROMPT, get_extract_chain, _today, _maybe_override_target_date, _normalize_meta, _structure_timing_question
 from converting_time import extract_target_ganji_v2, convert_relative_time, parse_korean_date_safe, is_month_only_question
 from sip_e_un_sung import _branch_of, unseong_for, branch_for, pillars_unseong, seun_unseong, sinsal_for, pillars_sinsal, check_4dae_hyungsal
 from Sipsin import _norm_stem, branch_from_any, get_sipshin, get_ji_sipshin_only, stem_from_any
@@ -161,6 +163,82 @@ def mirror_target_times_to_legacy(payload: dict) -> None:
         payload["resolved"]["flow_now"]["target"][s] = (dict(slot) if slot else None)
 
 
+# ── LLM 프롬프트용 payload 직렬화 (압축) ──
+# make_saju_payload 결과에는 같은 사실이 여러 번 들어 있다
+#   target_time == resolved.flow_now.target (mirror), saju.* == resolved.pillars.*.ganji,
+#   current_daewoon ≈ resolved.flow_now.daewoon, meta.entities(타겟 간지 재나열), 고정 canon 어휘
+# PAYLOAD_FORMAT=compact(기본)이면 각 사실을 한 번만, 빈 값(None/""/[]/{})은 빼고, 공백 없는 구분자로 직렬화한다.
+# 생략 규칙은 SAJU_COUNSEL_SYSTEM의 [입력 JSON 생략 규칙]에 적혀 있다 (키 이름은 프롬프트가 참조하는 그대로 유지).
+# PAYLOAD_FORMAT=full 이면 기존과 같은 json.dumps(payload, ensure_ascii=False).
+_PAYLOAD_INTERNAL_KEYS = ("app_uid",)                 # 서버 내부용 (모델에 불필요)
+_PAYLOAD_INTERNAL_META = ("session_id", "entities")
+
+
+def _prune_empty(v):
+    """None / "" / [] / {} 재귀 제거 (False/0은 값으로 유지)"""
+    if isinstance(v, dict):
+        out = {k: _prune_empty(x) for k, x in v.items()}
+        return {k: x for k, x in out.items() if x not in (None, "", [], {})}
+    if isinstance(v, list):
+        out = [_prune_empty(x) for x in v]
+        return [x for x in out if x not in (None, "", [], {})]
+    return v
+
+
+def compact_payload(payload: dict) -> dict:
+    """프롬프트용 압축 payload (원본은 수정하지 않음)"""
+    p = _prune_empty(payload)
+    for k in _PAYLOAD_INTERNAL_KEYS:
+        p.pop(k, None)
+    meta = p.get("meta") or {}
+    for k in _PAYLOAD_INTERNAL_META:
+        meta.pop(k, None)
+    if meta.get("daewoon_list") == meta.get("daewoon"):
+        meta.pop("daewoon_list", None)
+
+    resolved = p.get("resolved") or {}
+    flow = resolved.get("flow_now") or {}
+    resolved.pop("canon", None)                          # 어휘 목록은 시스템 프롬프트에 있음
+
+    if p.get("target_time") == flow.get("target"):
+        p.pop("target_time", None)
+    dw, rdw = p.get("current_daewoon"), flow.get("daewoon")
+    if dw and rdw and all(rdw.get(k) == v for k, v in dw.items()):
+        p.pop("current_daewoon", None)
+    pillars = resolved.get("pillars") or {}
+    saju = p.get("saju")
+    if saju and all((pillars.get(k) or {}).get("ganji") == v for k, v in saju.items()):
+        p.pop("saju", None)
+
+    tt = p.get("target_times") or []
+    if len(tt) == 1:
+        # 단일 시점이면 legacy(flow_now.target)와 같은 내용 → 비교 모드가 아니므로 생략
+        slot = (flow.get("target") or {}).get(tt[0].get("scope")) or {}
+        if all(slot.get(k) == v for k, v in tt[0].items() if k not in ("label", "scope")):
+            p.pop("target_times", None)
+    return p
+
+
+def record_payload_sample(payload: dict) -> None:
+    """PAYLOAD_CORPUS_PATH가 있으면 payload 원본을 JSONL로 덧붙인다 (scripts/payload_tokens.py 비교용, 개발 환경 전용)"""
+    path = os.getenv("PAYLOAD_CORPUS_PATH")
+    if not path:
+        return
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(payload, ensure_ascii=False, default=str) + "\n")
+    except Exception as e:
+        print(f"[PAYLOAD][WARN] corpus 기록 실패 ({path}): {e}")
+
+
+def dump_payload(payload: dict, fmt: Optional[str] = None) -> str:
+    """프롬프트 {payload} 문자열 (PAYLOAD_FORMAT: compact | full)"""
+    fmt = (fmt or os.getenv("PAYLOAD_FORMAT") or "compact").strip().lower()
+    if fmt == "full":
+        return json.dumps(payload, ensure_ascii=False)
+    return json.dumps(compact_payload(payload), ensure_ascii=False, separators=(",", ":"))
+
+
 def calculate_daewoon_by_age(daewoon_list: List[str], first_luck_age: Optional[int], birth_year: Optional[int] = None, day_stem_hj: Optional[str] = None) -> List[dict]:
     """
     대운 배열과 대운 시작 나이를 받아서 나이대별 대운을 계산합니다.
@@ -997,6 +1075,8 @@ def make_saju_payload(data: dict, focus: str, updated_question: str) -> dict:
 def extract_meta_and_convert(question: str) -> tuple[dict, str]:
     """메타 추출 + 상대시간 → 절대/간지 치환까지 한 번에.
     반환: (parsed_meta(dict), updated_question(str))
+    parsed_meta: msg_keywords/target_date/time/kind/notes + timing_structure/absolute_keywords/updated_question
+    → 요청 메타로 등록(set_request_meta)하면 회귀 빌더/턴 기록이 메타 LLM을 다시 부르지 않는다.
     """
     # 1) LLM 메타 추출
     parsed: dict = {}
@@ -1006,20 +1086,22 @@ def extract_meta_and_convert(question: str) -> tuple[dict, str]:
         parsed = {}
     else:
         try:
-            ext_res = extract_chain.invoke({"text": question})
-            raw = ext_res.content if hasattr(ext_res, "content") else str(ext_res)
-            parsed = json.loads(raw)
+            def _invoke_extract() -> dict:
+                ext_res = extract_chain.invoke({"text": question})
+                raw = ext_res.content if hasattr(ext_res, "content") else str(ext_res)
+                return json.loads(raw)
+
+            # regress_conversation._extract_meta와 같은 "extract" 메모 키 → 같은 문장이면 결과 공유
+            parsed = memo_json("extract", {"text": question}, _invoke_extract,
+                               model=os.environ.get("EXTRACT_MODEL", "gpt-4o-mini"),
+                               prompt=_EXTRACT_PROMPT)
             print(f"[META] JSON 파싱 성공: {parsed}")
         except Exception as e:
             print(f"[META] 예외 → 빈 메타 사용: {e}")
             parsed = {}
 
-    # 2) 기본 필드 보정
-    parsed.setdefault("msg_keywords", [])
-    parsed.setdefault("target_date", None)
-    parsed.setdefault("time", None)
-    parsed.setdefault("kind", None)
-    parsed.setdefault("notes", "")
+    # 2) 기본 필드 보정 (regress_conversation._extract_meta와 같은 스키마/정규화)
+    _normalize_meta(question, parsed)
     parsed.setdefault("_facts", {})
 
     # [NEW] Month Granularity Fix: 
@@ -1108,5 +1190,7 @@ def extract_meta_and_convert(question: str) -> tuple[dict, str]:
 
     parsed["absolute_keywords"] = abs_kws
     parsed["updated_question"] = updated_q
+    # target_date가 위에서 확정/보정됐을 수 있으니 시간 질문 구조화는 마지막 값 기준으로 다시
+    parsed["timing_structure"] = _structure_timing_question(question, parsed)
 
     return parsed, updated_q
@@ -0,0 +1,38 @@
+# ================== 환경변수 설정값 파싱 ==================
+# 모듈마다 따로 두던 _env_int/_env_float 대신 이 두 함수를 쓴다. 허용 범위는 호출부가 lo/hi로 밝힌다.
+#
+#   ttl  = env_int("ANSWER_CACHE_TTL_S", 3600, lo=0)        # 0이면 끔
+#   size = env_int("ASGI_SYNC_WORKERS", 32, lo=1)
+#   wait = env_float("SINGLE_FLIGHT_WAIT_S", 45, lo=0)
+#
+# - 없거나 빈 값이면 default (default는 범위 보정하지 않음)
+# - 숫자가 아니면 [CONF] invalid ... 로그 후 default
+# - lo/hi 밖이면 경계값으로 맞춘다
+# (google 등 무거운 모듈을 import하지 않는다 — 어느 모듈에서나 가볍게 쓸 수 있게)
+
+import os
+from typing import Optional
+
+
+def _env_number(name: str, default, cast, lo, hi):
+    raw = os.getenv(name)
+    if raw is None or str(raw).strip() == "":
+        return default
+    try:
+        val = cast(str(raw).strip())
+    except Exception:
+        print(f"[CONF] invalid {name}='{raw}', fallback={default}")
+        return default
+    if lo is not None and val < lo:
+        val = lo
+    if hi is not None and val > hi:
+        val = hi
+    return val
+
+
+def env_int(name: str, default: int, *, lo: Optional[int] = None, hi: Optional[int] = None) -> int:
+    return _env_number(name, default, int, lo, hi)
+
+
+def env_float(name: str, default: float, *, lo: Optional[float] = None, hi: Optional[float] = None) -> float:
+    return _env_number(name, default, float, lo, hi)
@@ -0,0 +1,267 @@
+# ================== 보조 LLM 체인 메모이제이션 ==================
+# 메타 추출 / 회귀 판정 / 이어짐 판정 / 결론 정제 체인은 모두 temperature=0 + JSON 응답이라
+# 같은 입력이면 사실상 같은 결과다. ("내년 재물운" 같은 질문이 반복해서 들어온다)
+# 파싱된 JSON(dict)을 키 = sha256(체인 id, 모델, 프롬프트 버전, 입력)으로 캐시한다.
+#
+#   data = memo_json("continuation", inputs, lambda: json.loads(...chain.invoke(inputs)...),
+#                    model="gpt-4o-mini", prompt=_CONTINUATION_DETECT_PROMPT)
+#
+# - 1차: 프로세스 메모리 LRU (LLM_MEMO_MAX 항목, 기본 2048)
+# - 2차(선택): 인스턴스 간 공유 — LLM_MEMO_SHARED
+#     off   : (기본) 사용 안 함
+#     local : <CONVO_BASE>/_llm_memo/<chain>/<key>.json
+#     gcs   : gs://<GCS_BUCKET>/_llm_memo/<chain>/<key>.json
+#     auto  : CONVO_BACKEND가 gcs면 gcs, local이면 local, 그 외 off
+# - LLM_MEMO_TTL_S (기본 86400): 두 계층 공통 유효 시간. 0이면 메모이제이션 끔
+# - 프롬프트 버전: 프롬프트 템플릿 본문 해시 → 프롬프트를 고치면 키가 바뀌어 예전 결과는 자동 무효.
+#   LLM_MEMO_VERSION을 바꾸면 모든 체인 결과를 한꺼번에 무효화 (공유 계층 포함)
+# - compute()가 예외를 내거나 빈 결과를 주면 저장하지 않는다 (폴백 값이 캐시되지 않게)
+# - 반환값은 항상 복사본 (호출부가 setdefault 등으로 고쳐도 캐시는 그대로)
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from env_conf import env_int
+
+_LOCK = threading.Lock()
+_L1: "OrderedDict[str, tuple[float, str, Any]]" = OrderedDict()   # key -> (stored_at, chain_id, data)
+_PROMPT_VERSIONS: Dict[int, str] = {}
+MEMO_CHAINS = ("extract", "regression", "continuation", "refine")   # invalidate_memo(shared=True) 대상
+_STATS = {"hits_l1": 0, "hits_shared": 0, "misses": 0, "stores": 0, "shared_errors": 0}
+
+
+def _ttl_s() -> int:
+    return env_int("LLM_MEMO_TTL_S", 86400, lo=0)
+
+
+def _max_entries() -> int:
+    return env_int("LLM_MEMO_MAX", 2048, lo=1)
+
+
+def _shared_mode(env: str = "LLM_MEMO_SHARED") -> str:
+    """공유 계층 모드 (off | local | gcs). answer_cache도 같은 규칙으로 쓴다 (env만 다름)"""
+    mode = (os.getenv(env) or "off").strip().lower()
+    if mode == "auto":
+        from conv_store import _store_backend_name
+        backend = _store_backend_name()
+        return backend if backend in ("gcs", "local") else "off"
+    return mode if mode in ("local", "gcs") else "off"
+
+
+def prompt_version(prompt: Any) -> str:
+    """프롬프트 템플릿 본문 해시 (12자). 문자열이면 그 자체가 버전"""
+    if prompt is None:
+        return "-"
+    if isinstance(prompt, str):
+        return prompt
+    ver = _PROMPT_VERSIONS.get(id(prompt))
+    if ver is None:
+        try:
+            body = prompt.pretty_repr()
+        except Exception:
+            body = repr(prompt)
+        ver = hashlib.sha256(body.encode("utf-8")).hexdigest()[:12]
+        _PROMPT_VERSIONS[id(prompt)] = ver
+    return ver
+
+
+def _canon(v: Any) -> Any:
+    """입력 정규화: 문자열 공백 정리 (앞뒤/연속 공백 차이로 캐시가 갈리지 않게)"""
+    if isinstance(v, str):
+        return re.sub(r"\s+", " ", v).strip()
+    if isinstance(v, dict):
+        return {str(k): _canon(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_canon(x) for x in v]
+    return v
+
+
+def memo_key(chain_id: str, inputs: Dict[str, Any], *, model: str = "", prompt: Any = None) -> str:
+    raw = json.dumps(
+        [chain_id, model, prompt_version(prompt), os.getenv("LLM_MEMO_VERSION", "1"), _canon(inputs)],
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ───────── 공유 계층 (local / gcs) ─────────
+def _safe_chain(chain_id: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_.-]", "_", chain_id)
+
+
+def _shared_path(mode: str, chain_id: str, key: str = "", root: str = "_llm_memo") -> str:
+    chain = _safe_chain(chain_id)
+    if mode == "gcs":
+        bucket = os.getenv("GCS_BUCKET")
+        if not bucket:
+            raise RuntimeError(f"GCS_BUCKET is required for shared tier ({root})")
+        base = f"gs://{bucket}/{root}/{chain}"
+        return f"{base}/{key}.json" if key else base + "/"
+    base = os.path.join(os.path.abspath(os.getenv("CONVO_BASE", "./data")), root, chain)
+    return os.path.join(base, f"{key}.json") if key else base
+
+
+def _shared_get(mode: str, chain_id: str, key: str, root: str = "_llm_memo") -> Optional[dict]:
+    path = _shared_path(mode, chain_id, key, root)
+    if mode == "gcs":
+        from google.api_core.exceptions import NotFound
+        from conv_store import _gcs_blob, _gcs_retry, _gcs_timeout
+        try:
+            raw = _gcs_blob(path).download_as_bytes(timeout=_gcs_timeout(), retry=_gcs_retry())
+        except NotFound:
+            return None
+    else:
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+    return json.loads(raw.decode("utf-8"))
+
+
+def _shared_put(mode: str, chain_id: str, key: str, rec: dict, root: str = "_llm_memo") -> None:
+    path = _shared_path(mode, chain_id, key, root)
+    body = json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if mode == "gcs":
+        from conv_store import _gcs_blob, _gcs_retry, _gcs_timeout
+        _gcs_blob(path).upload_from_string(body, content_type="application/json",
+                                           timeout=_gcs_timeout(), retry=_gcs_retry())
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def _shared_clear(mode: str, chain_id: str) -> int:
+    path = _shared_path(mode, chain_id)
+    n = 0
+    if mode == "gcs":
+        from conv_store import _gcs_bucket, _parse_gs_path
+        bucket, prefix = _parse_gs_path(path)
+        for blob in _gcs_bucket(bucket).list_blobs(prefix=prefix):
+            try:
+                blob.delete()
+                n += 1
+            except Exception:
+                pass
+        return n
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            try:
+                os.remove(os.path.join(path, name))
+                n += 1
+            except OSError:
+                pass
+    return n
+
+
+# ───────── 1차 LRU ─────────
+def _l1_get(key: str, ttl: int):
+    with _LOCK:
+        ent = _L1.get(key)
+        if ent is None:
+            return None
+        if time.time() - ent[0] > ttl:
+            _L1.pop(key, None)
+            return None
+        _L1.move_to_end(key)
+        return ent
+
+
+def _l1_put(key: str, chain_id: str, data: Any, stored_at: float) -> None:
+    with _LOCK:
+        _L1[key] = (stored_at, chain_id, data)
+        _L1.move_to_end(key)
+        limit = _max_entries()
+        while len(_L1) > limit:
+            _L1.popitem(last=False)
+
+
+def memo_json(
+    chain_id: str,
+    inputs: Dict[str, Any],
+    compute: Callable[[], Any],
+    *,
+    model: str = "",
+    prompt: Any = None,
+) -> Any:
+    """
+    inputs가 같으면 이전 compute() 결과를 돌려준다 (없으면 compute() 실행 후 저장).
+    compute 예외는 그대로 올라간다 (호출부의 기존 폴백 처리 유지).
+    """
+    ttl = _ttl_s()
+    if ttl <= 0:
+        return compute()
+
+    key = memo_key(chain_id, inputs, model=model, prompt=prompt)
+    ent = _l1_get(key, ttl)
+    if ent is not None:
+        _STATS["hits_l1"] += 1
+        print(f"[MEMO] hit chain={chain_id} tier=l1 age={int(time.time() - ent[0])}s")
+        return copy.deepcopy(ent[2])
+
+    mode = _shared_mode()
+    if mode != "off":
+        try:
+            rec = _shared_get(mode, chain_id, key)
+            if rec and time.time() - float(rec.get("stored_at") or 0) <= ttl:
+                _l1_put(key, chain_id, rec["data"], float(rec["stored_at"]))
+                _STATS["hits_shared"] += 1
+                print(f"[MEMO] hit chain={chain_id} tier={mode} age={int(time.time() - float(rec['stored_at']))}s")
+                return copy.deepcopy(rec["data"])
+        except Exception as e:
+            _STATS["shared_errors"] += 1
+            print(f"[MEMO][WARN] shared read failed ({mode}): {e}")
+
+    _STATS["misses"] += 1
+    data = compute()
+    if not data:
+        return data
+
+    now = time.time()
+    _l1_put(key, chain_id, copy.deepcopy(data), now)
+    _STATS["stores"] += 1
+    if mode != "off":
+        try:
+            _shared_put(mode, chain_id, key, {"chain": chain_id, "model": model, "stored_at": now, "data": data})
+        except Exception as e:
+            _STATS["shared_errors"] += 1
+            print(f"[MEMO][WARN] shared write failed ({mode}): {e}")
+    return data
+
+
+def invalidate_memo(chain_id: Optional[str] = None, *, shared: bool = False) -> int:
+    """
+    체인 결과 무효화 (chain_id=None이면 전부). shared=True면 공유 계층 객체도 지운다.
+    프롬프트 본문을 바꾼 경우는 키가 달라지므로 호출할 필요 없다.
+    """
+    with _LOCK:
+        keys = [k for k, v in _L1.items() if chain_id is None or v[1] == chain_id]
+        for k in keys:
+            _L1.pop(k, None)
+    n = len(keys)
+    mode = _shared_mode()
+    if shared and mode != "off":
+        chains = [chain_id] if chain_id else list(MEMO_CHAINS)
+        for c in chains:
+            try:
+                n += _shared_clear(mode, c)
+            except Exception as e:
+                print(f"[MEMO][WARN] shared clear failed ({mode}, {c}): {e}")
+    print(f"[MEMO] invalidated chain={chain_id or '*'} entries={n}")
+    return n
+
+
+def get_llm_memo_stats() -> dict:
+    with _LOCK:
+        size = len(_L1)
+    return {**_STATS, "entries": size, "shared": _shared_mode(), "ttl_s": _ttl_s()}
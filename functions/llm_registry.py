@@ -0,0 +1,170 @@
+# ================== LLM 클라이언트 / 체인 레지스트리 ==================
+# ChatOpenAI 객체와 그 위에 얹은 체인(프롬프트 | LLM, RunnableWithMessageHistory …)을
+# 설정별로 프로세스에서 1번만 만들고, 모든 OpenAI 호출이 keep-alive HTTP 연결 풀 하나를 공유한다.
+#
+#   llm   = get_llm(model="gpt-4o-mini", temperature=0.0, max_tokens=200, timeout=15)   # 같은 설정이면 같은 객체
+#   chain = get_chain("continuation", lambda: PROMPT | get_llm(...))                    # 이름별 1회 생성
+#   chain.invoke(inputs, config={"configurable": {"session_id": key}})                 # 요청별 값은 입력/config로
+#   PROMPT | deadline_llm("refine", model=..., timeout=15, max_retries=2)               # 요청 마감에 맞춘 timeout/재시도
+#
+# - 요청마다 달라지는 값(세션 키, 프롬프트 변수)은 체인을 다시 만들지 않고 invoke 입력/config로 넘긴다.
+# - 공유 HTTP 풀 (httpx.Client / httpx.AsyncClient, 프로세스당 1쌍):
+#     LLM_HTTP_MAX_CONNECTIONS (기본 64)  : 동시 연결 상한
+#     LLM_HTTP_MAX_KEEPALIVE   (기본 32)  : 유휴로 유지할 연결 수
+#     LLM_HTTP_KEEPALIVE_S     (기본 60)  : 유휴 연결 유지 시간
+#   요청 timeout은 ChatOpenAI(timeout=...)가 호출마다 넘긴다 (풀 설정과 별개).
+#   deadline_llm은 호출 시점의 요청 마감(request_deadline)으로 timeout을 줄여 넘기고(bind),
+#   재시도 횟수가 다른 설정은 get_llm 캐시에서 고른다 (설정당 1회 생성, 요청마다 새로 만들지 않음).
+#   비동기 클라이언트는 프로세스의 이벤트 루프 1개(asgi_app)에서 쓴다.
+# - get_llm_registry_stats(): 생성 횟수/생성 시간 합(build_ms)/재사용 횟수 + 풀에서 새로 연 연결 수
+#   → 웜 인스턴스에서 builds/connections_created가 늘지 않으면 객체 생성·연결 수립이 요청 경로에서 빠진 것
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from env_conf import env_float, env_int
+
+_LOCK = threading.RLock()
+_LLMS: Dict[str, Any] = {}
+_CHAINS: Dict[str, Any] = {}
+_HTTP: Dict[str, Any] = {}      # "sync" / "async" -> httpx 클라이언트
+_STATS = {"llm_builds": 0, "llm_hits": 0, "chain_builds": 0, "chain_hits": 0,
+          "build_ms": 0.0, "connections_created": 0}
+
+
+def _count_connections(transport) -> None:
+    """풀의 새 연결 생성 횟수 집계 (httpcore 풀 create_connection 감싸기, 실패하면 집계만 생략)"""
+    try:
+        pool = transport._pool
+        create = pool.create_connection
+
+        def _counting(origin):
+            with _LOCK:
+                _STATS["connections_created"] += 1
+            return create(origin)
+
+        pool.create_connection = _counting
+    except Exception:
+        pass
+
+
+def _http_client(kind: str):
+    """공유 httpx 클라이언트 (최초 호출 시 생성). httpx가 없으면 None → ChatOpenAI 기본 클라이언트"""
+    client = _HTTP.get(kind)
+    if client is not None:
+        return client
+    with _LOCK:
+        client = _HTTP.get(kind)
+        if client is None:
+            try:
+                import httpx
+            except ImportError:
+                return None
+            limits = httpx.Limits(
+                max_connections=env_int("LLM_HTTP_MAX_CONNECTIONS", 64, lo=1),
+                max_keepalive_connections=env_int("LLM_HTTP_MAX_KEEPALIVE", 32, lo=0),
+                keepalive_expiry=env_float("LLM_HTTP_KEEPALIVE_S", 60, lo=0),
+            )
+            if kind == "async":
+                transport = httpx.AsyncHTTPTransport(limits=limits)
+                client = httpx.AsyncClient(transport=transport)
+            else:
+                transport = httpx.HTTPTransport(limits=limits)
+                client = httpx.Client(transport=transport)
+            _count_connections(transport)
+            _HTTP[kind] = client
+            print(f"[LLM] shared http client ({kind}) max={limits.max_connections} "
+                  f"keepalive={limits.max_keepalive_connections}/{limits.keepalive_expiry}s")
+    return client
+
+
+def _llm_key(params: dict) -> str:
+    return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def get_llm(**params):
+    """
+    설정(ChatOpenAI 인자)별 공유 ChatOpenAI. openai_api_key를 주지 않으면 OPENAI_API_KEY.
+    같은 인자로 다시 부르면 만들어 둔 객체를 그대로 돌려준다.
+    """
+    key = _llm_key({k: v for k, v in params.items() if k != "openai_api_key"})
+    llm = _LLMS.get(key)
+    if llm is not None:
+        _STATS["llm_hits"] += 1
+        return llm
+    with _LOCK:
+        llm = _LLMS.get(key)
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+
+            t0 = time.perf_counter()
+            kwargs = dict(params)
+            kwargs.setdefault("openai_api_key", os.getenv("OPENAI_API_KEY"))
+            sync_client, async_client = _http_client("sync"), _http_client("async")
+            if sync_client is not None:
+                kwargs.setdefault("http_client", sync_client)
+                kwargs.setdefault("http_async_client", async_client)
+            llm = ChatOpenAI(**kwargs)
+            _LLMS[key] = llm
+            _STATS["llm_builds"] += 1
+            _STATS["build_ms"] += (time.perf_counter() - t0) * 1000
+            print(f"[LLM] built model={params.get('model')} temp={params.get('temperature')} "
+                  f"max_tokens={params.get('max_tokens')} ({len(_LLMS)} configs)")
+        else:
+            _STATS["llm_hits"] += 1
+    return llm
+
+
+def deadline_llm(stage: str, **params):
+    """
+    체인의 LLM 자리에 넣는 단계. 호출마다 현재 요청 마감(config configurable "deadline" → contextvar 순)을 보고
+    timeout=min(설정값, 남은 시간), max_retries=남은 시간에 들어가는 만큼으로 호출한다.
+    마감이 없으면(요청 밖, REQUEST_DEADLINE_S=0) get_llm(**params) 그대로.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    timeout = float(params.get("timeout") or 60)
+    retries = int(params.get("max_retries", 2))
+
+    def _pick(value, config):
+        from request_deadline import current_deadline
+
+        dl = ((config or {}).get("configurable") or {}).get("deadline") or current_deadline()
+        if dl is None:
+            return get_llm(**params)
+        t, r = dl.llm_policy(stage, timeout, retries)
+        llm = get_llm(**{**params, "max_retries": r})
+        return llm.bind(timeout=t) if t < timeout else llm
+
+    return RunnableLambda(_pick, name=f"llm:{stage}")
+
+
+def get_chain(name: str, build: Callable[[], Any]):
+    """이름별 공유 체인 (build()는 프로세스에서 1번만 호출). build가 None을 돌려주면 저장하지 않는다"""
+    chain = _CHAINS.get(name)
+    if chain is not None:
+        _STATS["chain_hits"] += 1
+        return chain
+    with _LOCK:
+        chain = _CHAINS.get(name)
+        if chain is None:
+            t0 = time.perf_counter()
+            chain = build()
+            if chain is None:
+                return None
+            _CHAINS[name] = chain
+            _STATS["chain_builds"] += 1
+            _STATS["build_ms"] += (time.perf_counter() - t0) * 1000
+            print(f"[LLM] chain built: {name}")
+        else:
+            _STATS["chain_hits"] += 1
+    return chain
+
+
+def get_llm_registry_stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "build_ms": round(_STATS["build_ms"], 1), "llms": len(_LLMS),
+                "chains": sorted(_CHAINS), "http_clients": sorted(_HTTP)}
@@ -4,6 +4,7 @@ import hashlib
 import logging
 import os
 import json
+import threading
 from typing import Optional, List, Tuple
 from dotenv import load_dotenv
 from functools import lru_cache
@@ -11,12 +12,18 @@ import time
 
 from conv_store import (
     set_current_user_context,
+    set_current_session,
     make_user_id_from_name,
     make_user_key,
     delete_current_user_store,
     get_current_user_id,
+    begin_store_session,
+    end_store_session,
+    load_session_tail,
+    get_session_manifest,
+    get_session_summary,
+    _text_hash,
     _resolve_store_path_for_user,
-    trim_session_history,
     MAX_TURNS
 )
 from creativeBrief import build_creative_brief
@@ -25,9 +32,20 @@ from creativeBrief import build_creative_brief
 from ganjiArray import extract_comparison_slices, format_comparison_block, parse_compare_specs
 from ganji_converter import Scope
 
-from regress_conversation import ISO_DATE_RE, KOR_ABS_DATE_RE, _db_load, _maybe_override_target_date, _today, ensure_session, record_turn_message, get_extract_chain, build_question_with_regression_context
+from regress_conversation import ISO_DATE_RE, KOR_ABS_DATE_RE, _db_load, _maybe_override_target_date, _today, ensure_session, record_turn_message, get_extract_chain, build_question_with_regression_context, set_request_meta, clear_request_meta
 from converting_time import extract_target_ganji_v2, convert_relative_time, parse_korean_date_safe
-from regress_Deixis import _make_bridge, build_regression_and_deixis_context
+from regress_Deixis import _make_bridge, build_regression_and_deixis_context, get_prev_assistant_text, _llm_detect_continuation_v2
+from stage_scheduler import StageScheduler, stage_timer
+from stage_graph import plan_request, request_mode
+from chat_history import evict_user_chat_histories, get_chat_history, get_chat_history_stats, history_key
+from single_flight import acquire_flight, complete_flight, wait_flight
+from request_replay import load_replay, replay_request_id, save_replay
+from answer_cache import answer_cache_key, canonical_question, get_cached_answer, invalidate_answer_cache, payload_fingerprint, save_cached_answer, session_generation
+from prompt_prefix import log_cache_usage, prefix_guard
+from prompt_budget import COUNSEL_BLOCKS, FORTUNE_BLOCKS, budget_inputs, fit_inputs
+from llm_registry import deadline_llm, get_chain, get_llm
+from request_deadline import degraded_stages, end_deadline, start_deadline
+from answer_stream import AnswerStream, PendingAnswer, request_clock, stream_format, stream_response
 from sip_e_un_sung import _branch_of, unseong_for, branch_for, pillars_unseong, seun_unseong, sinsal_for, pillars_sinsal
 from Sipsin import _norm_stem, branch_from_any, get_sipshin, get_ji_sipshin_only, stem_from_any
 from choshi_64 import GUA
@@ -44,7 +62,9 @@ from core.services import (
     make_saju_payload,
     category_to_korean,
     mirror_target_times_to_legacy,
-    style_seed_from_payload
+    style_seed_from_payload,
+    dump_payload,
+    record_payload_sample,
 )
 from prompts.saju_prompts import (
     DEV_MSG,
@@ -59,7 +79,7 @@ from langchain.memory import ConversationSummaryBufferMemory
 
 from langchain.chains import LLMChain
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories  import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain.schema import HumanMessage, AIMessage
 
 
@@ -97,25 +117,23 @@ openai_key = os.getenv("OPENAI_API_KEY")
 print("✅ OPENAI_API_KEY 로드 완료")
 
 # ============================================================================
-# 🔥 In-Memory 중복 추적 (빠른 중복 감지용)
+# 🔥 In-Memory 중복 요청 합치기 (single_flight.py)
 # ============================================================================
-# - GCS 로딩 없이 즉시 중복 체크 (0.001초)
-# - 동시 요청도 감지 가능
-_RECENT_REQUESTS = {}  # {"session:question": {"time": float, "status": str}}
+# - GCS 로딩 없이 즉시 중복 감지 (동시 요청/빠른 재시도)
+# - 같은 (사용자, 세션, 모드, 정규화 질문)이 처리 중이면 202 대신 먼저 온 요청의 답변을 기다려 그대로 돌려준다
 
 # ============================================================================
-# 📦 질문-답변 캐싱 시스템 (성능 최적화)
+# 📦 질문-답변 캐싱 시스템 (성능 최적화) → answer_cache.py
 # ============================================================================
 #
 # 목적:
-#   - 동일/유사 질문에 대해 OpenAI 재호출 없이 캐시된 답변 반환
-#   - 응답 시간: 30초 → 1초 이하
+#   - 같은 세션/같은 맥락의 같은 질문에 대해 OpenAI 재호출 없이 캐시된 답변 반환
 #   - Flutter에서 캐시 여부 확인 가능 (UI 표시용)
 #
-# 구현:
-#   - LRU 캐시 (메모리 기반, 최대 1000개)
-#   - TTL: 1시간 (3600초)
-#   - 질문 정규화: 공백/대소문자 제거 후 해시 생성
+# 구현 (answer_cache.py):
+#   - 키: 정규화한 updated_question + payload 지문(원국/대운/대상 시점/오늘 날짜) + 세션 + 세션 세대
+#   - O(1) LRU + TTL + 바이트 예산, 선택적 인스턴스 간 공유 계층 (ANSWER_CACHE_SHARED)
+#   - 조회는 payload를 만든 뒤(상담 분기), 저장은 이번 턴 기록 후
 #
 # 응답 형식:
 #   {
@@ -125,78 +143,19 @@ _RECENT_REQUESTS = {}  # {"session:question": {"time": float, "status": str}}
 #   }
 # ============================================================================
 
-# 캐시 저장소: {question_hash: (answer, timestamp)}
-_ANSWER_CACHE: dict[str, Tuple[str, float]] = {}
-CACHE_TTL_SECONDS = 3600  # 1시간
-CACHE_MAX_SIZE = 1000     # 최대 1000개 질문 캐시
-
-def normalize_question(question: str, session_id: str = "") -> str:
-    """
-    질문을 정규화하여 캐시 키 생성
-    
-    Args:
-        question: 사용자 질문
-        session_id: 세션 ID (선택)
-    
-    Returns:
-        str: 정규화된 질문의 SHA256 해시
-    """
-    # 공백/줄바꿈 제거, 소문자 변환
-    normalized = "".join(question.lower().split())
-    # 세션 ID 포함 (같은 질문이라도 세션별로 다른 캐시)
-    key = f"{session_id}:{normalized}"
-    return hashlib.sha256(key.encode('utf-8')).hexdigest()
-
-def get_cached_answer(question: str, session_id: str = "") -> Optional[Tuple[str, int]]:
-    """
-    캐시된 답변 조회
-    
-    Args:
-        question: 사용자 질문
-        session_id: 세션 ID
-    
-    Returns:
-        Optional[Tuple[str, int]]: (답변, 캐시 생성 후 경과 시간) 또는 None
-    """
-    cache_key = normalize_question(question, session_id)
-    
-    if cache_key not in _ANSWER_CACHE:
-        return None
-    
-    answer, timestamp = _ANSWER_CACHE[cache_key]
-    age = int(time.time() - timestamp)
-    
-    # TTL 체크
-    if age > CACHE_TTL_SECONDS:
-        del _ANSWER_CACHE[cache_key]
-        return None
-    
-    return (answer, age)
-
-def save_to_cache(question: str, answer: str, session_id: str = "") -> None:
-    """
-    답변을 캐시에 저장
-    
-    Args:
-        question: 사용자 질문
-        answer: OpenAI 답변
-        session_id: 세션 ID
-    """
-    global _ANSWER_CACHE
-    
-    # 캐시 크기 제한 (LRU 방식)
-    if len(_ANSWER_CACHE) >= CACHE_MAX_SIZE:
-        oldest_key = min(_ANSWER_CACHE.keys(), key=lambda k: _ANSWER_CACHE[k][1])
-        del _ANSWER_CACHE[oldest_key]
-    
-    cache_key = normalize_question(question, session_id)
-    _ANSWER_CACHE[cache_key] = (answer, time.time())
+# ============================================================================
+# ⏱️ 요청 마감 시간 예산 (request_deadline.py)
+# ============================================================================
+# - 요청 진입 시 REQUEST_DEADLINE_S(기본 60) 예산을 만들고, 모든 LLM 단계(deadline_llm)가 남은 시간으로 timeout/재시도를 정한다
+# - 보조 단계는 본 답변 몫(REQUEST_DEADLINE_RESERVE_S)을 남기고, 모자라면 선택 단계(회귀 판정/결론 정제/지시어 앵커)를 폴백으로 건너뜀
+# - 새로 생성한 답변 응답에 "degraded_stages": ["refine", ...] (건너뛴 선택 단계, 평소엔 [])
 
 
 # ============================================================================
 # 2. LLM 정의 (사주 + 점괘 응답용)
 # ============================================================================
-llm = ChatOpenAI(
+# 공유 HTTP 연결 풀 위의 설정별 공유 객체 (llm_registry.py)
+_LLM_PARAMS = dict(
     temperature=1.2,
     #model_kwargs={"top_p": 1.0},  # ✅ 이렇게
     top_p=0.9, 
@@ -205,6 +164,7 @@ llm = ChatOpenAI(
     timeout=25,
     max_retries=2,
 )#"gpt-4o-mini"
+llm = get_llm(**_LLM_PARAMS)
 print("✅ LLM 초기화 완료")
 
 # ============================================================================
@@ -228,8 +188,8 @@ print("✅ LLM 초기화 완료")
 #    - 총 개선: ~85초 절감
 # ============================================================================
 
-global_memory = ChatMessageHistory()
-print("✅ Memory 설정 완료 (ChatMessageHistory, 요약 생성 없음)")
+# ✅ [NEW] 세션별 히스토리: 프로세스 전역 1개 대신 (사용자, 세션)별 + 세션 LRU/메모리 예산 (chat_history.py)
+print("✅ Memory 설정 완료 (세션별 히스토리 레지스트리, 요약 생성 없음)")
 
 # ✅ fortune 전용 프롬프트
 
@@ -245,125 +205,101 @@ print("✅ Prompt & System loaded from modules")
 #
 # 📌 역할:
 #    - RunnableWithMessageHistory가 대화 이력을 가져올 때 호출
-#    - 모든 세션이 동일한 전역 메모리 공유 (단일 사용자 가정)
+#    - config의 session_id에는 history_key(session_id) = "<user_id>::<session_id>"를 넘긴다
+#      (다른 사용자의 같은 session_id와 섞이지 않음)
 #
 # ✅ 최적화:
-#    - 이전: global_memory.chat_memory (ConversationSummaryBufferMemory의 내부 객체)
-#    - 이후: global_memory (ChatMessageHistory 직접 반환)
+#    - 이전: 모든 세션/사용자가 전역 ChatMessageHistory 1개를 공유 → 메시지가 무한 증가
+#      (상담/점괘 프롬프트에는 {history} 자리가 없어 프롬프트 내용에는 영향 없음 — 메모리 문제)
+#    - 이후: 세션별 히스토리 (세션당 메시지 상한, 세션 LRU + 전체 바이트 예산으로 내보냄)
 # ============================================================================
 
-def get_session_history_func(session_id: str) -> ChatMessageHistory:
+def get_session_history_func(session_id: str) -> BaseChatMessageHistory:
     """
     세션 ID에 대한 메시지 히스토리 반환
     
     Args:
-        session_id: 세션 식별자 (현재는 사용하지 않음, 전역 메모리 공유)
+        session_id: 히스토리 키 (history_key(세션 ID))
     
     Returns:
-        ChatMessageHistory: 메시지 히스토리 객체
+        BaseChatMessageHistory: 세션별 메시지 히스토리 객체
     """
-    return global_memory  # ✅ ChatMessageHistory 직접 반환
-
-print("✅ Chain 구성 완료")
-
-# 1. 키워드 기반 카테고리 분류 함수
-
+    return get_chat_history(session_id)
 
 
 # ============================================================================
-# Hydration 함수 (대화 이력 복원) - 성능 최적화
+# 본 호출 체인 (상담 / 점괘)
 # ============================================================================
 #
 # 📌 역할:
-#    - GCS/JSON에 저장된 과거 대화 턴을 LangChain 메모리로 로드
-#    - 세션당 1회만 실행 (중복 방지)
-#
-# ⚡ 최적화 전 (71초 소요):
-#    - 각 턴마다 global_memory.save_context() 호출
-#    - save_context()가 LLM을 호출하여 요약 생성
-#    - 29턴 × 2.5초 = 71초
-#
-# ⚡ 최적화 후 (2초 소요):
-#    - 메시지만 history.add_user_message() / add_ai_message()로 추가
-#    - LLM 호출 없음
-#    - 단순 메모리 추가만 수행
-#
-# 📊 성능 개선:
-#    - 71초 → 2초 (35배 빠름)
-#    - 맥락 이해도는 동일 (전체 메시지는 OpenAI가 직접 받음)
+#    - 프롬프트 | LLM | RunnableWithMessageHistory를 프로세스에서 1번만 만든다 (llm_registry.get_chain)
+#    - 요청마다 달라지는 값은 체인 입력(프롬프트 변수)과 config의 session_id(history_key)로만 넘긴다
+#    - 모든 LLM이 llm_registry의 keep-alive HTTP 풀 하나를 공유
 # ============================================================================
 
-# 이미 하이드레이션 했는지(중복 방지) 추적
-_HYDRATED_SESSIONS: set[str] = set()
+_FORTUNE_TEMPLATE = """
+        너는 초씨역림(주역) 보조 해석가다.
+        아래 본괘/변괘의 '요지'만 참고해 사용자의 질문에 맞춘 **추가 풀이/조언**만 작성해라.
 
-def hydrate_history_from_store(session_id: str) -> int:
-    """
-    per-user JSON에 저장된 turns를 LangChain 히스토리에 주입 (성능 최적화).
-    
-    Args:
-        session_id: 복원할 세션 ID
-    
-    Returns:
-        int: 주입된 턴 수
-    
-    최적화 세부사항:
-        - 요약 생성 제거 (save_context 미사용)
-        - 메시지만 히스토리에 추가 (add_user_message / add_ai_message)
-        - 중복 주입 방지 (프로세스 생명주기 동안 1회만)
-    """
-    # ──────────────────────────────────────────────────────────────
-    # 1. 중복 방지: 이미 주입된 세션은 스킵
-    # ──────────────────────────────────────────────────────────────
-    if session_id in _HYDRATED_SESSIONS:
-        return 0
-
-    # ──────────────────────────────────────────────────────────────
-    # 2. GCS/JSON에서 세션 데이터 로드
-    # ──────────────────────────────────────────────────────────────
-    try:
-        db = _db_load()
-    except Exception:
-        return 0
-
-    sess = (db.get("sessions") or {}).get(session_id)
-    if not sess:
-        _HYDRATED_SESSIONS.add(session_id)
-        return 0
-
-    turns = list(sess.get("turns") or [])
-    if not turns:
-        _HYDRATED_SESSIONS.add(session_id)
-        return 0
-
-    # ──────────────────────────────────────────────────────────────
-    # 3. LangChain 히스토리 객체 획득
-    # ──────────────────────────────────────────────────────────────
-    history = get_session_history_func({"configurable": {"session_id": session_id}})
-
-    # ──────────────────────────────────────────────────────────────
-    # 4. 턴을 메시지로 변환하여 주입 (⚡ 최적화: LLM 호출 없음)
-    # ──────────────────────────────────────────────────────────────
-    injected = 0
-    for t in turns:
-        role = (t.get("role") or "").strip().lower()
-        text = t.get("text") or ""
-        if not text:
-            continue
-
-        # ✅ 최적화: add_user_message / add_ai_message만 사용
-        # ❌ 제거: global_memory.save_context() (LLM 호출하여 요약 생성)
-        if role == "user":
-            history.add_user_message(text)
-        elif role == "assistant":
-            history.add_ai_message(text)
-        else:
-            # 기타 role은 무시
-            continue
-        
-        injected += 1
+        규칙:
+        - 본괘/변괘의 번호·이름·요지·풀이를 다시 쓰지 마라(화면에 이미 표기됨).
+        - 답변은 **질문과 선택된 괘의 요지**에 **직접 연결**한다. 일반론/성향 일반화 금지.
+        - [풀이] 섹션 3~6문장.
+        - 마지막 줄은 '🔎 포인트: ...' 한 줄 요약.
+
+        [본괘 요지]
+        {ben_summary}
 
-    _HYDRATED_SESSIONS.add(session_id)
-    return injected
+        [변괘 요지]
+        {bian_summary}
+
+        [대화 요약]
+        {summary}
+
+        [사용자 질문]
+        {question}
+        """
+
+
+def _build_fortune_chain():
+    llm_only_prompt = ChatPromptTemplate.from_template(_FORTUNE_TEMPLATE)
+    # 입력 토큰 예산 (요지/요약이 길면 줄이고 블록별 토큰을 로그)
+    # timeout/재시도는 호출 시점의 요청 마감 기준 (request_deadline, 설정값이 상한)
+    base_chain = budget_inputs(llm_only_prompt, "fortune", FORTUNE_BLOCKS) | llm_only_prompt | deadline_llm("fortune", **_LLM_PARAMS)
+    return RunnableWithMessageHistory(
+        base_chain,
+        get_session_history_func,
+        input_messages_key="question",
+        history_messages_key="history"
+    )
+
+
+def _build_counsel_chain():
+    # 입력 토큰 예산은 호출 전에 ask_saju에서 fit_inputs로 맞춘다 (필수 블록을 뺀 답변은 캐시하지 않도록)
+    # 고정 prefix(system 규칙) hash 점검 → OpenAI 프롬프트 캐시가 깨지면 로그로 경고
+    # timeout/재시도는 호출 시점의 요청 마감 기준 (request_deadline, 아래 값이 상한)
+    chain = counseling_prompt | prefix_guard(counseling_prompt, "counsel") | deadline_llm(
+        "counsel",
+        temperature=1.2, 
+        #model_kwargs={"top_p": 0.9},
+        top_p = 0.9,
+        openai_api_key=openai_key,                
+        model="gpt-4o-mini",
+        max_tokens=600,
+        timeout=20,           # 25초 내 못 받으면 예외
+        max_retries=2,        # 재시도 안 함 (지연 방지)
+        stream_usage=True,    # 스트리밍 시 마지막 청크에 토큰 사용량 포함
+    )
+    return RunnableWithMessageHistory(
+        chain,
+        get_session_history_func,
+        input_messages_key="question",
+        history_messages_key="history",
+    )
+
+print("✅ Chain 구성 완료")
+
+# 1. 키워드 기반 카테고리 분류 함수
 
 
 
@@ -393,17 +329,119 @@ def get_summary_text() -> str:
 
 
 def get_session_brief_summary(session_id: str, n: int = 6) -> str:
-    db = _db_load()
-    sess = (db.get("sessions") or {}).get(session_id) or {}
-    turns = sess.get("turns") or []
+    # 최근 n턴만 필요 → segmented 포맷이면 끝쪽 세그먼트만 읽음
+    turns = load_session_tail(session_id, n)
     return "\n".join(f"{t.get('role','')}: {(t.get('text') or '').strip().replace('\n',' ')}"
-                     for t in turns[-n:])
+                     for t in turns)
 
 
 
     
 
 
+def _parse_personal_info(data: dict) -> dict:
+    """
+    요청 본문 → 개인맞춤입력(personal_info). 상담 payload를 만들 때만 호출 (stage_graph "profile")
+    """
+    # ⚠️ 중요: 요청에 개인맞춤입력 정보가 없으면 명시적으로 빈 값으로 초기화하여 이전 사용자 데이터가 남지 않도록 함
+    personal_info_keys = ["jobStatus", "jobName", "maritalStatus", "concerns", "lifeStage", 
+                         "moneyActivity", "relationshipStatus", "hobbies", "traits", 
+                         "hasHealthConcern", "note"]
+    found_keys = [key for key in personal_info_keys if key in data and data.get(key) not in (None, "", [])]
+    
+    personal_info_obj = None
+    if "personalInfo" in data:
+        personal_info_obj = data.get("personalInfo")
+        # 빈 딕셔너리나 None이면 None으로 설정
+        if personal_info_obj == {}:
+            personal_info_obj = None
+    elif "personal_info" in data:
+        personal_info_obj = data.get("personal_info")
+        # 빈 딕셔너리나 None이면 None으로 설정
+        if personal_info_obj == {}:
+            personal_info_obj = None
+    
+    # personal_info_obj가 있고 실제 값이 있는지 확인
+    has_personal_info_obj = False
+    if personal_info_obj and isinstance(personal_info_obj, dict):
+        # personal_info_obj에 실제 값이 있는지 확인
+        has_personal_info_obj = any(v for v in personal_info_obj.values() if v not in (None, "", [], {}))
+    
+    if found_keys:
+        # 요청의 개별 필드에서 직접 가져오기
+        personal_info = {
+            # A. 필수
+            "jobStatus": data.get("jobStatus") if "jobStatus" in data else None,
+            "jobName": data.get("jobName") if "jobName" in data else None,
+            "maritalStatus": data.get("maritalStatus") if "maritalStatus" in data else None,
+            "concerns": data.get("concerns") if "concerns" in data else [],
+            # B. 권장
+            "lifeStage": data.get("lifeStage") if "lifeStage" in data else None,
+            "moneyActivity": data.get("moneyActivity") if "moneyActivity" in data else None,
+            "relationshipStatus": data.get("relationshipStatus") if "relationshipStatus" in data else None,
+            # C. 보조(선택)
+            "hobbies": data.get("hobbies") if "hobbies" in data else [],
+            "traits": data.get("traits") if "traits" in data else {},
+            # D. 민감(제한 입력)
+            "hasHealthConcern": data.get("hasHealthConcern") if "hasHealthConcern" in data else None,
+            # E. 기타사항(선택)
+            "note": data.get("note") if "note" in data else None,
+        }
+    elif has_personal_info_obj:
+        # personal_info_obj에서 가져오기
+        personal_info = {
+            "jobStatus": personal_info_obj.get("jobStatus") or None,
+            "jobName": personal_info_obj.get("jobName") or None,
+            "maritalStatus": personal_info_obj.get("maritalStatus") or None,
+            "concerns": personal_info_obj.get("concerns") or [],
+            "lifeStage": personal_info_obj.get("lifeStage") or None,
+            "moneyActivity": personal_info_obj.get("moneyActivity") or None,
+            "relationshipStatus": personal_info_obj.get("relationshipStatus") or None,
+            "hobbies": personal_info_obj.get("hobbies") or [],
+            "traits": personal_info_obj.get("traits") or {},
+            "hasHealthConcern": personal_info_obj.get("hasHealthConcern") if "hasHealthConcern" in personal_info_obj else None,
+            "note": personal_info_obj.get("note") or None,
+        }
+    else:
+        # ⚠️ 요청에 개인맞춤입력 정보가 없으면 명시적으로 빈 값으로 초기화
+        # 이전 사용자의 데이터가 남지 않도록 모든 필드를 None 또는 빈 값으로 설정
+        personal_info = {
+            # A. 필수
+            "jobStatus": None,
+            "jobName": None,
+            "maritalStatus": None,
+            "concerns": [],
+            # B. 권장
+            "lifeStage": None,
+            "moneyActivity": None,
+            "relationshipStatus": None,
+            # C. 보조(선택)
+            "hobbies": [],
+            "traits": {},
+            # D. 민감(제한 입력)
+            "hasHealthConcern": None,
+            # E. 기타사항(선택)
+            "note": None,
+        }
+    
+    # ✅ 개인맞춤입력 정보 로그 (핵심 정보만)
+    personal_info_summary = []
+    if personal_info.get("jobStatus"):
+        personal_info_summary.append(f"직업상태:{personal_info.get('jobStatus')}")
+    if personal_info.get("jobName"):
+        personal_info_summary.append(f"직업명:{personal_info.get('jobName')}")
+    if personal_info.get("maritalStatus"):
+        personal_info_summary.append(f"혼인상태:{personal_info.get('maritalStatus')}")
+    if personal_info.get("concerns"):
+        concerns_str = ",".join(personal_info.get("concerns", []))[:30]  # 최대 30자
+        personal_info_summary.append(f"고민:{concerns_str}")
+    if personal_info_summary:
+        print(f"[개인맞춤입력] {', '.join(personal_info_summary)}")
+    else:
+        print(f"[개인맞춤입력] 없음 (초기화됨)")
+    return personal_info
+
+
 # ============================================================================
 # 상태 로그 함수 (디버깅용)
 # ============================================================================
@@ -413,11 +451,12 @@ def get_session_brief_summary(session_id: str, n: int = 6) -> str:
 #    - 메시지 수만 출력
 # ============================================================================
 
-def print_summary_state():
-    """현재 메모리 상태를 한 번에 로그 (성능 최적화 버전)"""
+def print_summary_state(key: str | None = None):
+    """현재 메모리 상태를 한 번에 로그 (세션 메시지 수 + 레지스트리 전체)"""
     try:
-        msg_count = len(global_memory.messages) if hasattr(global_memory, 'messages') else 0
-        print(f"\n🧠 메모리 내 메시지 수: {msg_count}")
+        st = get_chat_history_stats()
+        msg_count = len(get_chat_history(key).messages) if key else 0
+        print(f"\n🧠 세션 메시지 수: {msg_count} | 세션 {st['sessions']}개, {st['bytes']}B, evicted={st['evicted']}")
     except Exception as e:
         print(f"\n🧠 메모리 상태 확인 실패: {e}")
 
@@ -468,8 +507,69 @@ def record_turn(user_text: str, assistant_text: str, payload: dict | None = None
 # 5. Firebase 함수 엔드포인트
 @https_fn.on_request(memory=4096, timeout_sec=300)
 def ask_saju(req: https_fn.Request) -> https_fn.Response:
-    global _RECENT_REQUESTS  # ✅ 전역 변수 선언 (UnboundLocalError 방지)
+    # ASK_SAJU_ASYNC=1 이면 본 LLM 호출을 공유 이벤트 루프의 ainvoke로 실행 (asgi_app과 같은 비동기 경로)
+    if _ask_async_enabled():
+        from asgi_app import ask_saju_via_loop
+        return ask_saju_via_loop(req)
+    return _ask_saju_impl(req)
+
+
+def _ask_async_enabled() -> bool:
+    return (os.getenv("ASK_SAJU_ASYNC") or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _ask_saju_impl(req, *, defer: bool = False):
+    """
+    ask_saju 본체. req는 get_json/get_data/headers를 가진 요청 객체.
+    defer=True (비동기 경로): 본 LLM 호출 직전까지만 준비하고 PendingAnswer를 반환한다.
+      → 호출부가 ainvoke/astream으로 실행하고, 기록/정리(on_complete/on_close)는 같은 contextvars 컨텍스트에서 부른다.
+    조기 반환(캐시/중복/히스토리 조회 등)은 defer여도 그대로 https_fn.Response.
+    """
     _ctx = False
+    _store_token = None
+    _stages = None
+    _meta_token = None
+    _req_t0 = request_clock()
+    # [DEADLINE] 요청 전체 시간 예산 (단계 스레드/LLM 호출이 남은 시간으로 timeout·재시도·선택 단계 실행을 정함)
+    _deadline, _deadline_token = start_deadline()
+    _stream_fmt = None    # "sse" | "ndjson" | None (요청 "stream": true)
+    _handoff = False      # True면 요청 정리를 스트림 종료 시점(AnswerStream on_close)으로 넘김
+    _flight = None        # single-flight 리더일 때만 (후속 요청은 None)
+    _flight_result = None # 후속 요청에 그대로 돌려줄 응답 본문 (답변 확정 시 설정)
+    _replay = None        # (저장소 경로, request_id, session_id) — 요청에 request_id가 있을 때만
+    _plan = None          # 모드별 단계 실행 계획 (stage_graph.StagePlan)
+
+    def _finish_request():
+        """요청 정리: 단계 로그, 요청 메타 해제, 보류 변경 1회 기록, 사용자 컨텍스트 해제"""
+        # [STAGE][PLAN] 모드별 실행/건너뛴 단계 + LLM 단계 수 (마감으로 건너뛴 선택 단계 포함)
+        if _plan is not None:
+            if _deadline is not None:
+                for _s in _deadline.degraded_stages():
+                    _plan.skip(_s, "deadline")
+            _plan.log()
+        # [STAGE] 단계별 wall time / 동시 실행으로 줄어든 시간
+        if _stages is not None:
+            _stages.log()
+            _stages.close()
+        # [DEADLINE] 예산 대비 경과 + 줄이거나 건너뛴 단계
+        end_deadline(_deadline, _deadline_token)
+        if _meta_token is not None:
+            clear_request_meta(_meta_token)
+        # [UOW] 보류 중인 변경을 1회 기록 (응답 본문은 이미 만들어진 상태)
+        if _store_token is not None:
+            try:
+                end_store_session(_store_token)
+            except Exception as e:
+                print(f"[STORE][UOW][ERR] flush 실패: {e}")
+        # [NEW] 이 요청 동안 켜둔 사용자 컨텍스트 해제(프로세스 재사용 대비)
+        if _ctx:
+            set_current_user_context(reset=True)
+        # [REPLAY] request_id의 완료 응답을 저장소에 남김 (다른 인스턴스로 온 재전송 대비)
+        if _replay is not None and _flight_result is not None:
+            save_replay(_replay[0], _replay[1], _flight_result, session_id=_replay[2])
+        # [FLIGHT] 기다리던 같은 요청들에 결과 전달 (결과 없이 끝났으면 그쪽에서 직접 처리)
+        complete_flight(_flight, _flight_result)
+
     try:
         print("📥 요청 수신")
         # ✅ JSON 파싱을 안전하게 처리 (빈 요청 또는 잘못된 형식 대응)
@@ -506,169 +606,24 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
         # --- 안전한 입력 파싱 ---
         question = (data.get("question") or "").strip()
         user_name = data.get("name") or ""
-        sajuganji = data.get("sajuganji") or {}   # ✅ dict 기본값
         session_id = data.get("session_id") or "single_global_session"
         
         # ✅ [NEW] 모드 구분 (saju / fortune)
         mode = (data.get("mode") or "saju").strip().lower()
+        # ✅ [NEW] 스트리밍 응답 여부 ("stream": true → NDJSON, Accept: text/event-stream → SSE)
+        _stream_fmt = stream_format(data, req.headers)
 
-        # 사주 원국 기둥 (키 없을 수 있음)
-        year  = sajuganji.get("년주", "") or ""
-        month = sajuganji.get("월주", "") or ""
-        day         = sajuganji.get("일주", "") or ""
-        pillar_hour = sajuganji.get("시주", "") or ""      # ❗ time 변수명 피함
-
-        # ✅ [NEW] 대운 정보 (배열 형태 지원)
-        daewoon_raw = data.get("daewoon")
-        if isinstance(daewoon_raw, list):
-            daewoon = daewoon_raw  # 배열 그대로 사용
-            daewoon_str = ", ".join(daewoon_raw)  # 로그/표시용 문자열
-        else:
-            daewoon = daewoon_raw or ""  # 기존 문자열 형태
-            daewoon_str = daewoon_raw or ""
-        
-        current_daewoon = data.get("currentDaewoon") or ""
-        
-        # ✅ [NEW] 대운 시작 나이
-        first_luck_age = data.get("firstLuckAge")
-        if first_luck_age is not None:
-            try:
-                first_luck_age = int(first_luck_age)
-            except (ValueError, TypeError):
-                first_luck_age = None
-
-        # ✅ 십성 정보 (sipseong_info 객체 또는 개별 필드 지원)
-        sipseong_info = data.get("sipseong_info") or {}
-        
-        # sipseong_info 객체가 있으면 우선 사용, 없으면 기존 개별 필드 사용
-        yinYang = sipseong_info.get("yinYang") or data.get("yinYang", "") or ""
-        fiveElement = sipseong_info.get("fiveElement") or data.get("fiveElement", "") or ""
-        
-        # 년간/년지
-        yearGan = sipseong_info.get("yearGan") or sipseong_info.get("년주") or data.get("yearGan") or ""
-        yearJi  = sipseong_info.get("yearJi") or sipseong_info.get("년주") or data.get("yearJi") or ""
-        
-        # 월간/월지
-        wolGan  = sipseong_info.get("wolGan") or sipseong_info.get("월간") or data.get("wolGan") or ""
-        wolJi   = sipseong_info.get("wolJi") or sipseong_info.get("월지") or data.get("wolJi") or ""
-        
-        # 일간/일지
-        ilGan   = sipseong_info.get("ilGan") or sipseong_info.get("일주") or data.get("ilGan") or ""
-        ilJi    = sipseong_info.get("ilJi") or sipseong_info.get("일주") or data.get("ilJi") or ""
-        
-        # 시간/시지
-        siGan   = sipseong_info.get("siGan") or sipseong_info.get("시간") or data.get("siGan") or ""
-        siJi    = sipseong_info.get("siJi") or sipseong_info.get("시지") or data.get("siJi") or ""
-        
-        # 대운간/대운지
-        currDaewoonGan = sipseong_info.get("currDaewoonGan") or sipseong_info.get("대운간") or data.get("currDaewoonGan", "") or ""
-        currDaewoonJi  = sipseong_info.get("currDaewoonJi") or sipseong_info.get("대운지") or data.get("currDaewoonJi", "") or ""
-        
         # [ADD] 생년월일(YYYY-MM-DD 또는 YYYYMMDD). 앱에서 'birth' 또는 'birthday' 어느 키든 허용
         user_birth = (data.get("birth") or data.get("birthday") or "").strip()
         
         # [ADD] 앱 UID (새로운 경로 구조용)
         app_uid = (data.get("app_uid") or data.get("appUid") or data.get("uid") or "").strip()
-        
-        
-        # ✅ 개인맞춤입력 정보 (해석·조언의 현실 적합도 보정용)
-        # ⚠️ 중요: 요청에 개인맞춤입력 정보가 없으면 명시적으로 빈 값으로 초기화하여 이전 사용자 데이터가 남지 않도록 함
-        personal_info_keys = ["jobStatus", "jobName", "maritalStatus", "concerns", "lifeStage", 
-                             "moneyActivity", "relationshipStatus", "hobbies", "traits", 
-                             "hasHealthConcern", "note"]
-        found_keys = [key for key in personal_info_keys if key in data and data.get(key) not in (None, "", [])]
-        
-        personal_info_obj = None
-        if "personalInfo" in data:
-            personal_info_obj = data.get("personalInfo")
-            # 빈 딕셔너리나 None이면 None으로 설정
-            if personal_info_obj == {}:
-                personal_info_obj = None
-        elif "personal_info" in data:
-            personal_info_obj = data.get("personal_info")
-            # 빈 딕셔너리나 None이면 None으로 설정
-            if personal_info_obj == {}:
-                personal_info_obj = None
-        
-        # personal_info_obj가 있고 실제 값이 있는지 확인
-        has_personal_info_obj = False
-        if personal_info_obj and isinstance(personal_info_obj, dict):
-            # personal_info_obj에 실제 값이 있는지 확인
-            has_personal_info_obj = any(v for v in personal_info_obj.values() if v not in (None, "", [], {}))
-        
-        if found_keys:
-            # 요청의 개별 필드에서 직접 가져오기
-            personal_info = {
-                # A. 필수
-                "jobStatus": data.get("jobStatus") if "jobStatus" in data else None,
-                "jobName": data.get("jobName") if "jobName" in data else None,
-                "maritalStatus": data.get("maritalStatus") if "maritalStatus" in data else None,
-                "concerns": data.get("concerns") if "concerns" in data else [],
-                # B. 권장
-                "lifeStage": data.get("lifeStage") if "lifeStage" in data else None,
-                "moneyActivity": data.get("moneyActivity") if "moneyActivity" in data else None,
-                "relationshipStatus": data.get("relationshipStatus") if "relationshipStatus" in data else None,
-                # C. 보조(선택)
-                "hobbies": data.get("hobbies") if "hobbies" in data else [],
-                "traits": data.get("traits") if "traits" in data else {},
-                # D. 민감(제한 입력)
-                "hasHealthConcern": data.get("hasHealthConcern") if "hasHealthConcern" in data else None,
-                # E. 기타사항(선택)
-                "note": data.get("note") if "note" in data else None,
-            }
-        elif has_personal_info_obj:
-            # personal_info_obj에서 가져오기
-            personal_info = {
-                "jobStatus": personal_info_obj.get("jobStatus") or None,
-                "jobName": personal_info_obj.get("jobName") or None,
-                "maritalStatus": personal_info_obj.get("maritalStatus") or None,
-                "concerns": personal_info_obj.get("concerns") or [],
-                "lifeStage": personal_info_obj.get("lifeStage") or None,
-                "moneyActivity": personal_info_obj.get("moneyActivity") or None,
-                "relationshipStatus": personal_info_obj.get("relationshipStatus") or None,
-                "hobbies": personal_info_obj.get("hobbies") or [],
-                "traits": personal_info_obj.get("traits") or {},
-                "hasHealthConcern": personal_info_obj.get("hasHealthConcern") if "hasHealthConcern" in personal_info_obj else None,
-                "note": personal_info_obj.get("note") or None,
-            }
-        else:
-            # ⚠️ 요청에 개인맞춤입력 정보가 없으면 명시적으로 빈 값으로 초기화
-            # 이전 사용자의 데이터가 남지 않도록 모든 필드를 None 또는 빈 값으로 설정
-            personal_info = {
-                # A. 필수
-                "jobStatus": None,
-                "jobName": None,
-                "maritalStatus": None,
-                "concerns": [],
-                # B. 권장
-                "lifeStage": None,
-                "moneyActivity": None,
-                "relationshipStatus": None,
-                # C. 보조(선택)
-                "hobbies": [],
-                "traits": {},
-                # D. 민감(제한 입력)
-                "hasHealthConcern": None,
-                # E. 기타사항(선택)
-                "note": None,
-            }
-        
-        # ✅ 개인맞춤입력 정보 로그 (핵심 정보만)
-        personal_info_summary = []
-        if personal_info.get("jobStatus"):
-            personal_info_summary.append(f"직업상태:{personal_info.get('jobStatus')}")
-        if personal_info.get("jobName"):
-            personal_info_summary.append(f"직업명:{personal_info.get('jobName')}")
-        if personal_info.get("maritalStatus"):
-            personal_info_summary.append(f"혼인상태:{personal_info.get('maritalStatus')}")
-        if personal_info.get("concerns"):
-            concerns_str = ",".join(personal_info.get("concerns", []))[:30]  # 최대 30자
-            personal_info_summary.append(f"고민:{concerns_str}")
-        if personal_info_summary:
-            print(f"[개인맞춤입력] {', '.join(personal_info_summary)}")
-        else:
-            print(f"[개인맞춤입력] 없음 (초기화됨)")
-        
+
+        # [PLAN] 모드별 단계 그래프: 이 요청이 실제로 쓰는 출력을 만드는 단계만 실행 (stage_graph.py)
+        #   관리 요청은 사용자 컨텍스트만, 점괘는 메타 추출/회귀 없이 본 호출 1회, 상담은 전체
+        #   (개인맞춤입력 파싱은 상담 payload에서만 → _parse_personal_info)
+        _plan = plan_request(request_mode(data, question))
+
         # [NEW] 이 요청 동안만 '해당 사용자' 파일로 라우팅되도록 켠다
         #       (Cloud Run/Functions 재사용 프로세스 대비, 요청 끝나면 반드시 해제)
         
@@ -681,21 +636,22 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             app_uid=app_uid,                    # ★ 앱 UID (새 경로 구조용)
         )
         _ctx = True
-        
-        # ✅ reset 플래그를 유연하게 파싱 (문자/숫자/불리언 모두 허용)
-        raw_reset = data.get("reset", False)
-        reset_flag = False
-        if isinstance(raw_reset, bool):
-            reset_flag = raw_reset
-        else:
-            reset_flag = str(raw_reset).strip().lower() in ("1", "true", "t", "yes", "y")
+        # 활성 세션 (sessions 레이아웃에서는 이 세션 객체만 읽음)
+        set_current_session(data.get("session_id") or "single_global_session")
 
-        if reset_flag:
+        # [UOW] 이 요청 동안 사용자 파일은 1회만 읽고, 모든 변경(세션/턴/트림)은 끝에서 1회 기록
+        _store_token = begin_store_session()
+        
+        # ✅ reset (플래그는 문자/숫자/불리언 모두 허용 → stage_graph.request_mode)
+        if _plan.mode == "reset":
             # 현재 컨텍스트의 파일을 지운다 (gs://.../<user_id>.json 또는 로컬 파일)
             
             uid = get_current_user_id()
             target_path = _resolve_store_path_for_user(uid) if uid else "(no-uid)"
             ok = delete_current_user_store()
+            evict_user_chat_histories(uid)   # 지운 대화가 세션 히스토리로 프롬프트에 남지 않게
+            if uid:
+                invalidate_answer_cache(f"{uid}::")
 
             # 컨텍스트 정리 후 바로 종료
             set_current_user_context(reset=True)
@@ -705,15 +661,8 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                 headers={"Content-Type": "application/json; charset=utf-8"}
             )
         
-        # ✅ delete_history 플래그를 유연하게 파싱 (문자/숫자/불리언 모두 허용)
-        raw_delete_history = data.get("delete_history", False)
-        delete_history_flag = False
-        if isinstance(raw_delete_history, bool):
-            delete_history_flag = raw_delete_history
-        else:
-            delete_history_flag = str(raw_delete_history).strip().lower() in ("1", "true", "t", "yes", "y")
-
-        if delete_history_flag:
+        # ✅ delete_history (플래그는 문자/숫자/불리언 모두 허용 → stage_graph.request_mode)
+        if _plan.mode == "delete_history":
             # 현재 컨텍스트의 파일을 지운다 (gs://.../<user_id>.json 또는 로컬 파일)
             # name과 birth를 사용하여 user_id 생성 (파일명 형식: name__birth)
             # 사용자 컨텍스트 재설정 (삭제할 파일 경로를 정확히 지정하기 위해)
@@ -732,6 +681,9 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             uid = get_current_user_id()
             target_path = _resolve_store_path_for_user(uid) if uid else "(no-uid)"
             ok = delete_current_user_store()
+            evict_user_chat_histories(uid)   # 지운 대화가 세션 히스토리로 프롬프트에 남지 않게
+            if uid:
+                invalidate_answer_cache(f"{uid}::")
 
             # 컨텍스트 정리 후 바로 종료
             set_current_user_context(reset=True)
@@ -741,14 +693,43 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                 headers={"Content-Type": "application/json; charset=utf-8"}
             )
         
+        # (옵션) 클라이언트가 세션 목록만 요청하는 경우
+        # 세션 매니페스트(턴 수/마지막 시각/제목)만 읽는다 (턴 본문 X, 세션 생성/LLM 미실행)
+        if _plan.mode == "list_sessions":
+            try:
+                uid = get_current_user_id() or ""
+                sessions = [
+                    {k: e.get(k) for k in ("session_id", "title", "created_at", "turns",
+                                           "last_ts", "last_user_ts", "last_assistant_ts")}
+                    for e in get_session_manifest().values()
+                ]
+                sessions.sort(key=lambda e: e.get("last_ts") or "", reverse=True)
+                return https_fn.Response(
+                    response=json.dumps({"user_id": uid, "sessions": sessions}, ensure_ascii=False),
+                    status=200,
+                    headers={"Content-Type": "application/json; charset=utf-8"}
+                )
+            except Exception as e:
+                return https_fn.Response(
+                    response=json.dumps({
+                        "error": f"세션 목록 로드 실패: {str(e)}",
+                        "user_id": get_current_user_id() or "",
+                    }, ensure_ascii=False),
+                    status=500,
+                    headers={"Content-Type": "application/json; charset=utf-8"}
+                )
+
         # (옵션) 클라이언트가 'history'만 요청하는 경우
         # ✅ 사용자 컨텍스트가 설정된 후에 처리 (올바른 파일 로드)
-        if str(data.get("fetch_history", "")).lower() in ("1","true","yes","y"):
+        if _plan.mode == "fetch_history":
             # 저장소에서 그대로 읽어 반환 (세션 생성/LLM 미실행)
+            # 해당 세션 턴 + 매니페스트 요약만 읽는다 (sessions/segmented/sqlite는 다른 세션을 읽지 않음)
             try:
-                db = _db_load()
                 sess_id = (data.get("session_id") or "single_global_session")
-                sess = (db.get("sessions") or {}).get(sess_id) or {"meta": {"session_id": sess_id}, "turns": []}
+                summary = get_session_summary(sess_id) or {}
+                meta = {"session_id": sess_id}
+                if summary:
+                    meta.update(title=summary.get("title") or "", created_at=summary.get("created_at") or "")
                 uid = get_current_user_id() or ""
                 path = _resolve_store_path_for_user(uid) if uid else "unknown"
                 return https_fn.Response(
@@ -757,8 +738,8 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                             "user_id": uid,
                             "session_id": sess_id,
                             "path": path,
-                            "meta": sess.get("meta") or {},
-                            "turns": sess.get("turns") or [],
+                            "meta": meta,
+                            "turns": load_session_tail(sess_id) if summary else [],
                         }, ensure_ascii=False
                     ),
                     status=200,
@@ -775,83 +756,85 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                 )
 
 
-        # --- 세션 보장 (hydration은 중복 체크 후로 이동) ---
         session_id = data.get("session_id") or "single_global_session"
+
+        # ⭐ [REPLAY] 이미 완료된 request_id의 재전송이면 저장된 응답 그대로 (LLM 호출/턴 기록 없음)
+        # 기록은 사용자 경로 + session_id만 필요 → 세션 보장(사용자 문서 로드/세션 생성) 전에 조회
+        _replay_id = replay_request_id(data, req.headers)
+        if _replay_id and get_current_user_id():
+            _replay = (_resolve_store_path_for_user(get_current_user_id()), _replay_id, session_id)
+            _hit = load_replay(_replay[0], _replay_id)
+            if _hit is not None:
+                _replay = None   # 다시 저장하지 않음
+                _plan.stop("replay", after="user_context")
+                _body, _age = _hit
+                if _stream_fmt:
+                    return stream_response(AnswerStream(
+                        [_body.get("answer") or ""], fmt=_stream_fmt, t0=_req_t0, stage="replay",
+                        done_extra={**{k: v for k, v in _body.items() if k != "answer"}, "replayed": True},
+                    ))
+                return https_fn.Response(
+                    response=json.dumps({**_body, "replayed": True}, ensure_ascii=False),
+                    status=200,
+                    headers={"Content-Type": "application/json; charset=utf-8"}
+                )
+
+        # --- 세션 보장 ---
         session_id = ensure_session(session_id, title="사주 대화")
 
-        # ⭐ [FAST DEDUP] 메모리 기반 중복 체크 (GCS 로딩 전, 0.001초)
-        # - 동시 요청, 빠른 재시도 모두 감지
-        # - 60초 윈도우
-        from time import time
-        
-        request_key = f"{session_id}:{question}"
-        now = time()
-        
-        # 1) 오래된 항목 정리 (60초 초과)
-        _RECENT_REQUESTS = {k: v for k, v in _RECENT_REQUESTS.items() if now - v.get("time", 0) <= 60}
-        
-        # 2) 중복 체크
-        if request_key in _RECENT_REQUESTS:
-            last_req = _RECENT_REQUESTS[request_key]
-            delta = now - last_req["time"]
-            
-            if delta <= 60:
-                status = last_req.get("status", "processing")
-                
-                if status == "done":
-                    return https_fn.Response(
-                        response=json.dumps({
-                            "answer": "이전 요청을 처리 완료했습니다. 잠시 후 다시 시도해주세요.",
-                            "status": "duplicate_done"
-                        }, ensure_ascii=False),
-                        status=200,
-                        headers={"Content-Type": "application/json; charset=utf-8"}
-                    )
-                else:
-                    return https_fn.Response(
-                        response=json.dumps({
-                            "answer": "이전 요청을 처리 중입니다. 잠시만 기다려주세요.",
-                            "status": "processing"
-                        }, ensure_ascii=False),
-                        status=202,
-                        headers={"Content-Type": "application/json; charset=utf-8"}
-                    )
-        
-        # 3) 새 요청 기록
-        _RECENT_REQUESTS[request_key] = {"time": now, "status": "processing"}
+        # ⭐ [FAST DEDUP] 같은 요청이 처리 중이면 그 결과를 기다려 같은 답변 반환 (GCS 로딩 전)
+        # - 동시 요청, 빠른 재시도 모두 감지 (인스턴스 내)
+        # - 기다림 상한 SINGLE_FLIGHT_WAIT_S, 넘으면 기존처럼 202 "처리 중"
+        # - 키에 모드 포함: 같은 문장이라도 점괘/상담은 응답 본문(answer_type/필드)이 다르다
+        _flight_key = f"{history_key(session_id)}|{_plan.mode}|{canonical_question(question)}"
+        for _attempt in range(2):
+            _f, _leader = acquire_flight(_flight_key)
+            if _leader:
+                _flight = _f
+                break
+            print(f"[FLIGHT] 같은 요청 처리 중 → 결과 대기 (session={session_id})")
+            _body = wait_flight(_f)
+            if _body is not None:
+                _plan.stop("coalesced", after="user_context")
+                if _stream_fmt:
+                    return stream_response(AnswerStream(
+                        [_body.get("answer") or ""], fmt=_stream_fmt, t0=_req_t0, stage="coalesced",
+                        done_extra={k: v for k, v in _body.items() if k != "answer"},
+                    ))
+                return https_fn.Response(
+                    response=json.dumps(_body, ensure_ascii=False),
+                    status=200,
+                    headers={"Content-Type": "application/json; charset=utf-8"}
+                )
+            if not _f.done:
+                break   # 시간 초과
+            # 리더가 결과 없이 끝남(오류 등) → 한 번 더 시도해 직접 처리
+        if _flight is None:
+            return https_fn.Response(
+                response=json.dumps({
+                    "answer": "이전 요청을 처리 중입니다. 잠시만 기다려주세요.",
+                    "status": "processing"
+                }, ensure_ascii=False),
+                status=202,
+                headers={"Content-Type": "application/json; charset=utf-8"}
+            )
 
         # [ENHANCED] 중복 요청 방지 (Client Retry 방어 강화)
         # ⭐ Hydration 전에 먼저 체크 → 중복이면 30초 절약!
         try:
-            _db_dedup = _db_load()  # 한 번만 로드
-            _sess_dedup = (_db_dedup.get("sessions") or {}).get(session_id) or {}
-            _turns_dedup = _sess_dedup.get("turns") or []
-            
-            # 1) 마지막 User 턴 찾기 (역순 검색)
-            last_user_turn = None
-            last_asst_turn = None
-            for t in reversed(_turns_dedup):
-                if t.get("role") == "user" and last_user_turn is None:
-                    last_user_turn = t
-                elif t.get("role") == "assistant" and last_asst_turn is None:
-                    last_asst_turn = t
-                if last_user_turn and last_asst_turn:
-                    break
+            # 1) 세션 매니페스트의 마지막 User 턴 요약 (턴 목록 스캔 X)
+            _sum_dedup = get_session_summary(session_id) or {}
             
-            if last_user_turn:
-                last_q = (last_user_turn.get("text") or "").strip()
-                last_q_updated = (last_user_turn.get("updated_question") or "").strip()
-                
-                # 2) 같은 질문인지 확인 (원본 또는 변환된 질문 비교)
-                is_duplicate = (
-                    last_q == question or
-                    (last_q_updated and last_q_updated == question) or
-                    (last_q_updated and last_q == question)
+            if _sum_dedup.get("last_user_id"):
+                # 2) 같은 질문인지 확인 (원본 또는 변환된 질문의 해시 비교)
+                _q_hash = _text_hash(question)
+                is_duplicate = bool(_q_hash) and _q_hash in (
+                    _sum_dedup.get("last_user_hash"), _sum_dedup.get("last_user_uq_hash")
                 )
                 
                 if is_duplicate:
                     # 3) 시간 윈도우 체크 (60초 이내 중복 감지)
-                    last_ts_str = last_user_turn.get("ts") or ""
+                    last_ts_str = _sum_dedup.get("last_user_ts") or ""
                     try:
                         if last_ts_str:
                             if last_ts_str.endswith("+0900"):
@@ -866,10 +849,11 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                     
                     # 4) 60초 이내 중복이면 처리
                     if delta_sec <= 60:
-                        # 4-1) 이미 응답이 있는가?
-                        if (last_asst_turn and 
-                            _turns_dedup.index(last_asst_turn) > _turns_dedup.index(last_user_turn)):
-                            cached_answer = last_asst_turn.get("text") or ""
+                        _plan.stop("duplicate", after="user_context")
+                        # 4-1) 이미 응답이 있는가? (마지막 턴이 assistant = user 턴 뒤에 답변 있음)
+                        _tail_dedup = load_session_tail(session_id, 1) if _sum_dedup.get("last_role") == "assistant" else []
+                        if _tail_dedup and _tail_dedup[-1].get("role") == "assistant":
+                            cached_answer = _tail_dedup[-1].get("text") or ""
                             return https_fn.Response(
                                 response=json.dumps({"answer": cached_answer}, ensure_ascii=False),
                                 status=200,
@@ -888,26 +872,23 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
         except Exception:
             pass
 
-        # ⭐ [CACHE CHECK] 캐시된 답변 확인
-        cached_result = get_cached_answer(question, session_id)
-        if cached_result:
-            cached_answer, cache_age = cached_result
-            
-            set_current_user_context(reset=True)
-            _ctx = False
-            
-            return https_fn.Response(
-                response=json.dumps({
-                    "answer": cached_answer,
-                    "cached": True,
-                    "cache_age_seconds": cache_age
-                }, ensure_ascii=False),
-                status=200,
-                headers={"Content-Type": "application/json; charset=utf-8"}
-            )
-
-        # Hydration 실행
-        hydrate_history_from_store(session_id)
+        # [STAGE] 서로 독립인 응답 전 단계를 동시에 실행 (_plan에 있는 단계만 — 점괘는 store_load만)
+        #   extract_meta : 메타 추출 + 상대시간 변환 (LLM, 백그라운드)
+        #   store_load   : 세션 요약 + 직전 답변 조회 (저장소, 현재 스레드)
+        #   answer_cache : payload + 캐시 조회 (extract_meta 직후, 적중하면 여기서 반환)
+        #   continuation : 회귀 판정 (LLM, 캐시 미스일 때만 백그라운드)
+        # 회귀 빌더/본 상담은 필요한 시점에 결과를 기다린다.
+        _stages = StageScheduler()
+        if _plan.runs("extract_meta"):
+            _stages.submit("extract_meta", extract_meta_and_convert, question)
+
+        with stage_timer("store_load"):
+            _hist_key = history_key(session_id)
+            _has_history = int((get_session_summary(session_id) or {}).get("turns") or 0) > 0
+            _need_prev = _has_history and _plan.runs("continuation")
+            _prev_assistant_text = get_prev_assistant_text(session_id) if _need_prev else ""
+        if not _has_history:
+            _plan.skip("continuation", "first_turn")
                 
                 
         # ---------- (A) 메타 추출 체인 실행 ----------
@@ -919,14 +900,69 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
         #parsed_meta = extract_meta_and_convert(question)
         #updated_question = parsed_meta.get("updated_question", question) #"updated_question" 값이 없다면 원래 질문 "question"을 리턴함
         
-        # 2. 메타 추출 및 시간 변환
-        parsed_meta, updated_question = extract_meta_and_convert(question)  # ✔ 튜플 언팩
+        # 2. 메타 추출 및 시간 변환 (위에서 백그라운드로 시작한 단계 결과 대기)
+        if _plan.runs("extract_meta"):
+            parsed_meta, updated_question = _stages.result("extract_meta")  # ✔ 튜플 언팩
+
+            # updated_question이 비어오면 안전하게 원문으로 폴백
+            updated_question = updated_question or parsed_meta.get("updated_question") or question
+            # 요청 메타 등록: 이후 회귀/지시어 빌더·턴 기록의 _extract_meta(같은 질문)는 LLM 재호출 없이 이 값을 쓴다
+            _meta_token = set_request_meta(parsed_meta, question, updated_question)
+
+            print(f"[CRT] abs={parsed_meta.get('absolute_keywords')} / updated='{updated_question}'")
+            print(f"[간지 변환] 원본 질문: '{question}' → 변환된 질문: '{updated_question}'")
+
+            # 기존 라우팅 유지: 원문에 없던 점괘 키워드가 변환된 질문에 생기면 점괘로 (payload/캐시/회귀 전에)
+            if _plan.mode == "counsel" and is_fortune_query(updated_question):
+                _plan.reroute("fortune", after="extract_meta")
+                print(f"[STAGE] updated_question 점괘 키워드 → fortune으로 전환")
+        else:
+            # 점괘: 메타/시간 변환 결과를 쓰지 않음 → 원문 질문 그대로
+            parsed_meta, updated_question = {}, question
+
+        # ---------- 사주 payload + 답변 캐시 (상담만) ----------
+        if _plan.runs("payload"):
+            focus = data.get("focus") or "종합운"
+
+            # ✅ [NEW] personal_info를 data에 포함시켜 make_saju_payload에 전달
+            data["personal_info"] = _parse_personal_info(data)
+
+            user_payload = make_saju_payload(data, focus, updated_question)
+            # ✅ app_uid를 payload에 추가 (record_turn_message에서 사용)
+            if app_uid:
+                user_payload["app_uid"] = app_uid
+            print(json.dumps(user_payload.get("meta", {}).get("daewoon_by_age"), ensure_ascii=False))
 
-        # updated_question이 비어오면 안전하게 원문으로 폴백
-        updated_question = updated_question or parsed_meta.get("updated_question") or question
+            # ⭐ [CACHE CHECK] 같은 세션·같은 맥락(세대)·같은 사주/대상 시점의 같은 질문이면 캐시 답변
+            # 키는 updated_question + payload 지문 + 세션 세대만 쓰므로 회귀 판정/회귀 빌더(LLM) 전에 확인한다
+            _payload_fp = payload_fingerprint(user_payload)
+            _answer_key = answer_cache_key(updated_question, _payload_fp, _hist_key,
+                                           session_generation(get_session_summary(session_id)))
+            cached_result = get_cached_answer(_answer_key)
+            if cached_result:
+                cached_answer, cache_age = cached_result
+                print(f"[ANSWER_CACHE] hit age={cache_age}s")
+                _plan.stop("cache_hit", after="answer_cache")
+                _flight_result = {"answer": cached_answer, "cached": True, "cache_age_seconds": cache_age}
+                if _stream_fmt:
+                    # 캐시 답변은 한 덩어리 delta + done으로 내려준다 (클라이언트 파싱 경로 통일)
+                    return stream_response(AnswerStream(
+                        [cached_answer], fmt=_stream_fmt, t0=_req_t0, stage="cached",
+                        done_extra={"cached": True, "cache_age_seconds": cache_age},
+                    ))
+                return https_fn.Response(
+                    response=json.dumps({
+                        "answer": cached_answer,
+                        "cached": True,
+                        "cache_age_seconds": cache_age
+                    }, ensure_ascii=False),
+                    status=200,
+                    headers={"Content-Type": "application/json; charset=utf-8"}
+                )
 
-        print(f"[CRT] abs={parsed_meta.get('absolute_keywords')} / updated='{updated_question}'")
-        print(f"[간지 변환] 원본 질문: '{question}' → 변환된 질문: '{updated_question}'")
+        # 캐시 미스 → 회귀 판정 시작 (질문 + 직전 답변만 필요, 회귀 빌더가 결과를 기다림)
+        if _need_prev and _plan.runs("continuation"):
+            _stages.submit("continuation", _llm_detect_continuation_v2, question, _prev_assistant_text)
         
         # ✅ 요청 수신 로그 (간소화)
         print(f"📥 요청 수신: {user_name} | 모드: {mode} | 질문: {question[:50]}{'...' if len(question) > 50 else ''}")
@@ -986,21 +1022,24 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
         #print(f"summary_text : {summary_text}")
         
         
-        # --- 회귀(이전 대화 회수) ---
+        # --- 회귀(이전 대화 회수) --- (상담만: 점괘는 reg_prompt를 쓰지 않음)
         # ✅ 회귀 판단 + 맥락 결합 (키워드 리스트 따로 만들 필요 없음)
-        reg_prompt, reg_dbg = build_regression_and_deixis_context(
-                                        question=updated_question,
-                                        summary_text=summary_text,
-                                        session_id=session_id,   # ★ 반드시 전달 → [JSON_SCAN] sid=None 방지
-                                    )
-        print(f"[REG] 최종 회귀 상태: {reg_dbg}")
+        if _plan.runs("regression"):
+            reg_prompt, reg_dbg = build_regression_and_deixis_context(
+                                            question=updated_question,
+                                            summary_text=summary_text,
+                                            session_id=session_id,   # ★ 반드시 전달 → [JSON_SCAN] sid=None 방지
+                                            continuation=_stages.result("continuation") if _stages.has("continuation") else None,
+                                            meta_now=parsed_meta,    # 요청 메타 재사용 → 메타 LLM 재호출 없음
+                                        )
+            print(f"[REG] 최종 회귀 상태: {reg_dbg}")
 
         #1차 분류
         #category = classify_question(updated_question)
         #print(f"📂 최종 분류 결과: {category}")
         # ──────────────────────────────── fortune(점괘) 분기 ────────────────────────────────
-        # ✅ mode가 명시적으로 'fortune'이면 우선 사용, 아니면 키워드 기반 판단
-        is_fortune = (mode == "fortune") or is_fortune_query(updated_question)
+        # ✅ mode가 명시적으로 'fortune'이면 우선 사용, 아니면 키워드 기반 판단 (stage_graph.request_mode)
+        is_fortune = _plan.mode == "fortune"
         print(f"🔮 모드 판단: mode={mode}, is_fortune={is_fortune}")
         
         if is_fortune:
@@ -1045,80 +1084,63 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                     f"풀이: {bian_detail_txt}\n\n"
                 )
 
-                llm_only_prompt = ChatPromptTemplate.from_template("""
-        너는 초씨역림(주역) 보조 해석가다.
-        아래 본괘/변괘의 '요지'만 참고해 사용자의 질문에 맞춘 **추가 풀이/조언**만 작성해라.
-
-        규칙:
-        - 본괘/변괘의 번호·이름·요지·풀이를 다시 쓰지 마라(화면에 이미 표기됨).
-        - 답변은 **질문과 선택된 괘의 요지**에 **직접 연결**한다. 일반론/성향 일반화 금지.
-        - [풀이] 섹션 3~6문장.
-        - 마지막 줄은 '🔎 포인트: ...' 한 줄 요약.
-
-        [본괘 요지]
-        {ben_summary}
-
-        [변괘 요지]
-        {bian_summary}
-
-        [대화 요약]
-        {summary}
-
-        [사용자 질문]
-        {question}
-        """)
-
-                base_chain = llm_only_prompt | llm
-                chat_with_memory = RunnableWithMessageHistory(
-                    base_chain,
-                    get_session_history_func,
-                    input_messages_key="question",
-                    history_messages_key="history"
-                )
-
-                result = chat_with_memory.invoke(
-                    {
-                        "ben_summary": ben_summary_txt,
-                        "bian_summary": bian_summary_txt,
-                        "summary": summary_text,
-                        "question": updated_question,
+                # 점괘 체인: 프로세스에서 1번만 생성 (llm_registry), 요청별 값은 입력/config로
+                chat_with_memory = get_chain("fortune", _build_fortune_chain)
+
+                fortune_inputs = {
+                    "ben_summary": ben_summary_txt,
+                    "bian_summary": bian_summary_txt,
+                    "summary": summary_text,
+                    "question": updated_question,
+                }
+                fortune_fields = {
+                    "answer_type": "fortune",
+                    "degraded_stages": degraded_stages(),   # 요청 마감으로 건너뛴 선택 단계
+                    "ben_number": ben_n,
+                    "bian_number": bian_n,
+                    # 필요하면 구조화 필드도 함께 내려주기 좋음
+                    "ben": {
+                        "number": ben_n,
+                        "name_ko": ben_name_ko,
+                        "name_hanja": ben_name_hanja,
+                        "summary": ben_summary_txt,
+                        "detail": ben_detail_txt,
                     },
-                    config={"configurable": {"session_id": session_id}},
-                )
-
-                final_text = f"{fixed_header}[풀이]\n{result.content}"
-
-                # ✅ 최적화: 메모리 저장 제거 (LLM 호출 제거)
-                # 실제 저장은 JSON 파일에서 처리됨
-
-                
-                # 상태 로그
-                print_summary_state()
-                return https_fn.Response(
-                    response=json.dumps({
-                        "answer_type": "fortune",
-                        "ben_number": ben_n,
-                        "bian_number": bian_n,
-                        # 필요하면 구조화 필드도 함께 내려주기 좋음
-                        "ben": {
-                            "number": ben_n,
-                            "name_ko": ben_name_ko,
-                            "name_hanja": ben_name_hanja,
-                            "summary": ben_summary_txt,
-                            "detail": ben_detail_txt,
-                        },
-                        "bian": {
-                            "number": bian_n,
-                            "name_ko": bian_name_ko,
-                            "name_hanja": bian_name_hanja,
-                            "summary": bian_summary_txt,
-                            "detail": bian_detail_txt,
-                        },
-                        "answer": final_text,
-                    }, ensure_ascii=False),
-                    status=200,
-                    headers={"Content-Type": "application/json; charset=utf-8"}
+                    "bian": {
+                        "number": bian_n,
+                        "name_ko": bian_name_ko,
+                        "name_hanja": bian_name_hanja,
+                        "summary": bian_summary_txt,
+                        "detail": bian_detail_txt,
+                    },
+                }
+
+                def _fortune_done(text: str, usage: Optional[dict]) -> dict:
+                    nonlocal _flight_result
+                    # ✅ 최적화: 메모리 저장 제거 (LLM 호출 제거)
+                    # 실제 저장은 JSON 파일에서 처리됨
+
+                    # 상태 로그
+                    print_summary_state(_hist_key)
+                    _flight_result = {**fortune_fields, "answer": f"{fixed_header}[풀이]\n{text}"}
+                    return {"answer": _flight_result["answer"]}
+
+                pending = PendingAnswer(
+                    chat_with_memory, fortune_inputs,
+                    config={"configurable": {"session_id": _hist_key, "deadline": _deadline}},
+                    stage="fortune", t0=_req_t0, fields=fortune_fields,
+                    # 스트리밍: 괘 정보(meta) + 고정 헤더를 LLM 첫 토큰 전에 먼저 보내고 풀이만 토큰 단위로
+                    prefix_events=[("meta", fortune_fields), ("header", {"text": f"{fixed_header}[풀이]\n"})],
+                    on_complete=_fortune_done, on_close=_finish_request,
+                    done_extra={"answer_type": "fortune", "degraded_stages": fortune_fields["degraded_stages"]},
                 )
+                if defer:
+                    _handoff = True
+                    return pending
+                if _stream_fmt:
+                    _handoff = True
+                    return pending.stream(_stream_fmt)
+                return pending.respond()
 
             except Exception as e:
                 import traceback; traceback.print_exc()
@@ -1136,16 +1158,6 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             # 최근 대화 요약은 get_session_brief_summary()로 대체
             summary_text = get_session_brief_summary(session_id)
 
-            focus = data.get("focus") or "종합운"
-
-            # ✅ [NEW] personal_info를 data에 포함시켜 make_saju_payload에 전달
-            data["personal_info"] = personal_info
-
-            user_payload = make_saju_payload(data, focus, updated_question)
-            # ✅ app_uid를 payload에 추가 (record_turn_message에서 사용)
-            if app_uid:
-                user_payload["app_uid"] = app_uid
-            print(json.dumps(user_payload.get("meta", {}).get("daewoon_by_age"), ensure_ascii=False))
             # → prompt 호출 시 {comparison_block}에 주입
 
             #비교 블록 만들기
@@ -1192,23 +1204,8 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             creative_brief = build_creative_brief(user_payload, updated_question)
             style_seed = style_seed_from_payload(user_payload)
 
-            chain = counseling_prompt | ChatOpenAI(
-                temperature=1.2, 
-                #model_kwargs={"top_p": 0.9},
-                top_p = 0.9,
-                openai_api_key=openai_key,                
-                model="gpt-4o-mini",
-                max_tokens=600,
-                timeout=20,           # 25초 내 못 받으면 예외
-                max_retries=2,        # 재시도 안 함 (지연 방지)
-            )
-
-            chat_with_memory = RunnableWithMessageHistory(
-                chain,
-                get_session_history_func,
-                input_messages_key="question",
-                history_messages_key="history",
-            )
+            # 상담 체인: 프로세스에서 1번만 생성 (llm_registry), 세션 키는 invoke config로
+            chat_with_memory = get_chain("counsel", _build_counsel_chain)
             
             # [중요] 사용자 메시지 기록(+메타 자동추출) — 같은 사용자 파일에 기록됨
             session_id = ensure_session(session_id, title="사주 대화")
@@ -1228,6 +1225,8 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                 "event_time": parsed_meta.get("time"),  # DB 필드명 매핑 (time -> event_time)
                 "kind": parsed_meta.get("kind"),
                 "notes": parsed_meta.get("notes"),
+                "timing_structure": parsed_meta.get("timing_structure"),
+                "absolute_keywords": parsed_meta.get("absolute_keywords") or None,
                 "updated_question": updated_question,  # [DEDUP] 정규화된 질문 저장 (간지 변환 후)
             }
 
@@ -1240,6 +1239,7 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
                 auto_meta=False,   # [FIX] 중복 LLM 호출 방지 (약 3~5초 절약)
                 extra_meta=meta_reuse,
                 payload=user_payload,
+                max_turns=max_history,   # hot 구간은 요청의 max_history까지 (기록 시 1회 트림)
             )
             
             # 회귀 빌더에서 만든 질문(맥락 포함) 사용; 없으면 updated_question
@@ -1357,77 +1357,96 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             current_date_obj = datetime.now(timezone(timedelta(hours=9)))
             current_date_str = current_date_obj.strftime("%Y년 %m월 %d일 %A")
             
-            result = chat_with_memory.invoke(
-                {
-                    "current_date": current_date_str,                   # 현재 날짜 정보 (날짜 관련 질문 처리용)
-                    "context": enhanced_context,                        # 회귀/컨텍스트 전문 + 나이대별 대운
-                    "facts": facts_json,                                # 구조화 FACT
-                    "summary": summary_text,                            # moving_summary_buffer
-                    "question": effective_question,         # 히스토리 키
-                    "bridge": bridge_text,                             # ★ 첫 문장 강제
-                    "payload": json.dumps(user_payload, ensure_ascii=False),
-                    # ★ 비교 전용 추가 파라미터
-                    "comparison_block": comparison_block,               # 사람이 읽을 요약 문자열
-                    "target_times": user_payload.get("target_times", []),# 원본 배열(모델이 표/비교 생성용으로 사용)
-
-                    "creative_brief": json.dumps(creative_brief, ensure_ascii=False),  # ★ 추가
-                    "style_seed": style_seed, 
-                },
-                config={"configurable": {"session_id": session_id}},
-            )
-            answer_text = getattr(result, "content", str(result))
-            
-            # ✅ 토큰 사용량 로깅
-            usage = getattr(result, "usage_metadata", None) or getattr(result, "response_metadata", {}).get("token_usage") if hasattr(result, "response_metadata") else None
-            try:
-                if isinstance(usage, dict):
-                    in_tok = usage.get("input_tokens") or usage.get("prompt_tokens")
-                    out_tok = usage.get("output_tokens") or usage.get("completion_tokens")
-                    total_tok = usage.get("total_tokens") or (in_tok or 0) + (out_tok or 0)
-                    print(f"[USAGE][COUNSEL] model=gpt-4o-mini input={in_tok} output={out_tok} total={total_tok}")
-                else:
-                    print(f"[USAGE][COUNSEL] usage_metadata 없음 또는 형식 미지원: {usage}")
-            except Exception as ue:
-                print(f"[USAGE][COUNSEL] 토큰 로깅 중 예외: {ue}")
-            
-            # 메모리 저장(옵션)
-            record_turn(updated_question, result.content, payload=user_payload)
-            
-            
-            # [중요] 어시스턴트 메시지 기록(메타 추출 불필요)
-            record_turn_message(
-                session_id=session_id,
-                role="assistant",
-                text=answer_text,
-                mode="SAJU",
-                auto_meta=False,
-                payload=user_payload,
-            )
+            record_payload_sample(user_payload)   # PAYLOAD_CORPUS_PATH 설정 시에만 (압축 효과 비교용 표본)
+
+            counsel_inputs = {
+                "current_date": current_date_str,                   # 현재 날짜 정보 (날짜 관련 질문 처리용)
+                "context": enhanced_context,                        # 회귀/컨텍스트 전문 + 나이대별 대운
+                "facts": facts_json,                                # 구조화 FACT
+                "summary": summary_text,                            # moving_summary_buffer
+                "question": effective_question,         # 히스토리 키
+                "bridge": bridge_text,                             # ★ 첫 문장 강제
+                "payload": dump_payload(user_payload),               # 중복/빈 값 제거한 압축 JSON (PAYLOAD_FORMAT)
+                # ★ 비교 전용 추가 파라미터
+                "comparison_block": comparison_block,               # 사람이 읽을 요약 문자열
+                "target_times": user_payload.get("target_times", []),# 원본 배열(모델이 표/비교 생성용으로 사용)
+
+                "creative_brief": json.dumps(creative_brief, ensure_ascii=False),  # ★ 추가
+                "style_seed": style_seed, 
+            }
 
-            # 세션 히스토리를 max_history 개까지만 유지
-            try:
-                trim_session_history(session_id, max_history)
-            except Exception:
-                pass
+            # 입력 토큰 예산: 우선순위 낮은 블록(creative_brief → payload 중복 키 → summary → context)부터 줄임.
+            # payload는 통째로 버리지 않는다. facts까지 비워야 하면 _budget_drops에 남는다
+            _budget_drops: list = []
+            counsel_inputs = fit_inputs(counseling_prompt, counsel_inputs, stage="counsel",
+                                        blocks=COUNSEL_BLOCKS, degraded=_budget_drops)
+
+            # 요청 마감으로 건너뛴 선택 단계 (회귀 판정/결론 정제/지시어 앵커) + 예산으로 비운 필수 블록 → 응답 필드
+            # (degraded 답변은 캐시에 저장하지 않는다)
+            _degraded = degraded_stages() + [f"prompt_budget:{b}" for b in _budget_drops]
+
+            def _finalize_counsel(answer_text: str, usage) -> dict:
+                """답변 확정 후 1회: 사용량 로깅, 턴 기록, 히스토리 트림, 중복요청 상태, 답변 캐시 (스트리밍이면 스트림 끝에서)"""
+                nonlocal _flight_result
+                # ✅ 토큰 사용량 로깅
+                try:
+                    if isinstance(usage, dict):
+                        in_tok = usage.get("input_tokens") or usage.get("prompt_tokens")
+                        out_tok = usage.get("output_tokens") or usage.get("completion_tokens")
+                        total_tok = usage.get("total_tokens") or (in_tok or 0) + (out_tok or 0)
+                        print(f"[USAGE][COUNSEL] model=gpt-4o-mini input={in_tok} output={out_tok} total={total_tok}")
+                        log_cache_usage("counsel", usage)   # 프롬프트 캐시 적중 토큰
+                    else:
+                        print(f"[USAGE][COUNSEL] usage_metadata 없음 또는 형식 미지원: {usage}")
+                except Exception as ue:
+                    print(f"[USAGE][COUNSEL] 토큰 로깅 중 예외: {ue}")
                 
-            # 요청 완료 - 메모리 상태 업데이트
-            _req_key = f"{session_id}:{question}"
-            if _req_key in _RECENT_REQUESTS:
-                _RECENT_REQUESTS[_req_key]["status"] = "done"
-            
-            # 답변을 캐시에 저장
-            answer_text = result.content
-            save_to_cache(question, answer_text, session_id)
-            
-            return https_fn.Response(
-                response=json.dumps({
-                    "answer": answer_text,
-                    "cached": False,           # ✅ 새로 생성된 답변
-                    "cache_age_seconds": 0     # ✅ 방금 생성
-                }, ensure_ascii=False),
-                status=200,
-                headers={"Content-Type": "application/json; charset=utf-8"}
+                # 메모리 저장(옵션)
+                record_turn(updated_question, answer_text, payload=user_payload)
+                
+                
+                # [중요] 어시스턴트 메시지 기록(메타 추출 불필요)
+                record_turn_message(
+                    session_id=session_id,
+                    role="assistant",
+                    text=answer_text,
+                    mode="SAJU",
+                    auto_meta=False,
+                    payload=user_payload,
+                    max_turns=max_history,   # 세션 히스토리를 max_history 개까지만 유지 (기록 시 트림)
+                )
+
+                # 요청 완료 - 같은 요청을 기다리는 쪽에 같은 본문 전달 (_finish_request에서)
+                _flight_result = {"cached": False, "cache_age_seconds": 0, "degraded_stages": _degraded, "answer": answer_text}
+
+                # 답변을 캐시에 저장 (이번 턴 기록 후 세대 → 같은 질문 재시도는 적중, 다음 턴이 오면 무효)
+                # 마감으로 선택 단계를 건너뛰었거나 예산으로 필수 블록을 비운 답변은 저장하지 않는다 (재시도 때 온전한 답변을 다시 만든다)
+                if _degraded:
+                    return {}
+                _gen_after = session_generation(get_session_summary(session_id))
+                save_cached_answer(
+                    answer_cache_key(updated_question, _payload_fp, _hist_key, _gen_after),
+                    answer_text, session_key=_hist_key, question=updated_question, generation=_gen_after,
+                )
+                return {}
+
+            pending = PendingAnswer(
+                chat_with_memory, counsel_inputs,
+                config={"configurable": {"session_id": _hist_key, "deadline": _deadline}},
+                stage="counsel", t0=_req_t0,
+                fields={"cached": False, "cache_age_seconds": 0, "degraded_stages": _degraded},   # ✅ 새로 생성된 답변
+                prefix_events=[("meta", {"answer_type": "counsel"})],
+                on_complete=_finalize_counsel, on_close=_finish_request,
+                done_extra={"degraded_stages": _degraded},
             )
+            if defer:
+                _handoff = True
+                return pending
+            if _stream_fmt:
+                # 스트리밍: 토큰을 생성되는 대로 전송, 기록/캐시/사용량은 스트림이 끝난 뒤 1회
+                _handoff = True
+                return pending.stream(_stream_fmt)
+            return pending.respond()
         
     except Exception as e:
         print(f"❌ 에러 발생: {e}")
@@ -1440,9 +1459,9 @@ def ask_saju(req: https_fn.Request) -> https_fn.Response:
             headers={"Content-Type": "application/json"}
         )
     finally:
-        # [NEW] 이 요청 동안 켜둔 사용자 컨텍스트 해제(프로세스 재사용 대비)
-        if _ctx:
-            set_current_user_context(reset=True)
+        # 스트리밍 응답이면 턴 기록/flush가 스트림 뒤에 일어나므로 정리도 그때 한다
+        if not _handoff:
+            _finish_request()
 
 # [END askSaju]
 # [END all]
@@ -0,0 +1,246 @@
+# ================== 프롬프트 입력 토큰 예산 ==================
+# 본 LLM 호출(상담/점괘)에 들어가는 블록(context, facts, payload, summary, creative_brief …)을
+# 로컬 토크나이저로 세고, 입력 토큰 예산을 넘으면 우선순위가 낮은 블록부터 줄인다.
+#
+#   chain = budget_inputs(llm_only_prompt, "fortune", FORTUNE_BLOCKS) | llm_only_prompt | llm
+#   (RunnableWithMessageHistory 안쪽 체인 맨 앞 → 실제 프롬프트에 들어갈 입력을 본다)
+#   inputs = fit_inputs(counseling_prompt, inputs, stage="counsel", blocks=COUNSEL_BLOCKS, degraded=dropped)
+#   (상담은 호출 전에 직접 → 필수 블록을 뺐으면 dropped로 알려 응답 degraded_stages에 싣고 답변 캐시에 저장하지 않는다)
+#
+# - 토크나이저: tiktoken (langchain-openai 의존성, 모델 인코딩 o200k_base). 못 쓰면 근사치
+#   (ASCII 4자당 1토큰, 그 외 문자 1자당 1토큰 → 한글 프롬프트 기준 약간 넉넉하게 잡힘)
+# - PROMPT_INPUT_BUDGET (기본 16000): 고정 프롬프트 + 블록 합 상한. 0이면 측정/로그만 (줄이지 않음)
+# - 블록 = (우선순위, 방식). 우선순위 숫자가 작은 블록부터 줄인다. 목록에 없는 변수(question, bridge 등)는 건드리지 않는다.
+#     text     : 앞부분만 남기고 뒤를 자름 (context, summary)
+#     drop     : 통째로 비움 (없어도 답변이 성립하는 선택 블록, JSON은 자르면 깨지므로)
+#     json     : 사주 payload. 통째로 버리지 않고 PAYLOAD_TRIM_PATHS(다른 블록에 같은 내용이 있는 키)만 뺀다
+#     required : 최후에만 비움 → degraded 목록에 이름을 남긴다 (facts)
+# - 요청마다 블록별 토큰 내역을 [PROMPT][BUDGET] 한 줄로 남긴다.
+#   (프롬프트에 렌더링되지 않는 입력은 세지 않는다. 예: 상담/점괘 프롬프트에는 {history} 자리가 없음)
+
+import json
+import string
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from env_conf import env_int
+
+_ENC: Any = None          # tiktoken Encoding | False(사용 불가)
+_ENC_LOCK = threading.Lock()
+_STATIC: Dict[tuple, Tuple[int, Dict[str, int], frozenset]] = {}   # 템플릿 본문 -> (고정 토큰, 변수 등장 수, 메시지 변수)
+
+_MSG_OVERHEAD = 4         # 채팅 메시지 1개당 역할/구분 토큰
+_TRUNC_MARK = "\n…(생략)"
+
+# 상담 프롬프트 블록: 우선순위 낮은 것부터 줄임
+COUNSEL_BLOCKS: Dict[str, Tuple[int, str]] = {
+    "creative_brief": (0, "drop"),
+    "payload": (1, "json"),
+    "summary": (2, "text"),
+    "context": (3, "text"),
+    "facts": (4, "required"),
+}
+
+# payload(json)에서 예산 초과 시 빼는 키 (앞에서부터). 모두 [CONTEXT]/질문에 같은 내용이 들어가 있다
+#   daewoon_by_age → [나이대별 대운 정보], personal_info → [개인맞춤입력 정보], question → 사용자 질문
+PAYLOAD_TRIM_PATHS: Tuple[Tuple[str, ...], ...] = (
+    ("meta", "daewoon_by_age"),
+    ("meta", "personal_info"),
+    ("meta", "daewoon_list"),
+    ("meta", "question"),
+)
+
+# 점괘 프롬프트 블록
+FORTUNE_BLOCKS: Dict[str, Tuple[int, str]] = {
+    "summary": (0, "text"),
+    "bian_summary": (1, "text"),
+    "ben_summary": (2, "text"),
+}
+
+
+def _encoder():
+    global _ENC
+    if _ENC is None:
+        with _ENC_LOCK:
+            if _ENC is None:
+                try:
+                    import tiktoken
+                    try:
+                        _ENC = tiktoken.encoding_for_model("gpt-4o-mini")
+                    except KeyError:
+                        _ENC = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"[PROMPT][WARN] tiktoken 사용 불가 → 근사 토큰 수 사용: {e}")
+                    _ENC = False
+    return _ENC
+
+
+def count_tokens(text: Any) -> int:
+    """문자열 토큰 수 (tiktoken 없으면 근사치)"""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    enc = _encoder()
+    if enc:
+        return len(enc.encode(text, disallowed_special=()))
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
+
+
+def _message_tokens(messages: Any) -> list:
+    """메시지 목록 → 메시지별 토큰 수"""
+    out = []
+    for m in messages or []:
+        content = getattr(m, "content", m)
+        out.append(count_tokens(content if isinstance(content, str) else str(content)) + _MSG_OVERHEAD)
+    return out
+
+
+def _prompt_shape(prompt) -> Tuple[int, Dict[str, int], frozenset]:
+    """(변수를 비운 프롬프트 토큰, 변수별 등장 횟수, 메시지 목록 변수) — 템플릿 본문별로 1회 계산"""
+    from langchain_core.prompts import MessagesPlaceholder
+
+    parts = []   # 템플릿 문자열 또는 ("messages", 변수명)
+    for m in getattr(prompt, "messages", None) or [prompt]:
+        if isinstance(m, MessagesPlaceholder):
+            parts.append(("messages", m.variable_name))
+            continue
+        tmpl = getattr(getattr(m, "prompt", m), "template", None)
+        if isinstance(tmpl, str):
+            parts.append(tmpl)
+    key = tuple(parts)   # 요청마다 새로 만드는 프롬프트(점괘)도 본문이 같으면 같은 키
+    shape = _STATIC.get(key)
+    if shape is not None:
+        return shape
+
+    occurrences: Dict[str, int] = {}
+    msg_vars = set()
+    static = 0
+    for part in parts:
+        if isinstance(part, tuple):
+            msg_vars.add(part[1])
+            occurrences[part[1]] = 1
+            continue
+        literal = []
+        for text, field, _, _ in string.Formatter().parse(part):
+            literal.append(text)
+            if field:
+                occurrences[field] = occurrences.get(field, 0) + 1
+        static += count_tokens("".join(literal)) + _MSG_OVERHEAD
+
+    shape = (static, occurrences, frozenset(msg_vars))
+    _STATIC[key] = shape
+    return shape
+
+
+def _truncate_text(text: str, max_tokens: int) -> str:
+    """앞부분을 max_tokens 안쪽으로 남긴다"""
+    if max_tokens <= count_tokens(_TRUNC_MARK):
+        return ""
+    enc = _encoder()
+    keep = max_tokens - count_tokens(_TRUNC_MARK)
+    if enc:
+        return enc.decode(enc.encode(text, disallowed_special=())[:keep]) + _TRUNC_MARK
+    lo, hi = 0, len(text)   # 근사 토큰 수는 길이에 단조 → 이분 탐색
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= keep:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + _TRUNC_MARK
+
+
+def _trim_json(text: str, over: int) -> Tuple[str, int]:
+    """PAYLOAD_TRIM_PATHS를 앞에서부터 빼서 over 토큰 이상 줄인다. (새 문자열, 뺀 키 수). JSON이 아니면 그대로"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return text, 0
+    before, cut = count_tokens(text), 0
+    for path in PAYLOAD_TRIM_PATHS:
+        node = data
+        for k in path[:-1]:
+            node = node.get(k) if isinstance(node, dict) else None
+        if not isinstance(node, dict) or path[-1] not in node:
+            continue
+        node.pop(path[-1])
+        cut += 1
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        if before - count_tokens(text) >= over:
+            break
+    return text, cut
+
+
+def fit_inputs(
+    prompt,
+    inputs: Dict[str, Any],
+    *,
+    stage: str,
+    blocks: Dict[str, Tuple[int, str]],
+    budget: Optional[int] = None,
+    degraded: Optional[list] = None,
+) -> Dict[str, Any]:
+    """
+    prompt에 렌더링될 inputs의 토큰을 세고, 예산 초과 시 blocks 우선순위대로 줄인 새 dict를 돌려준다.
+    예산 안이면 inputs를 그대로 돌려준다. 로그: [PROMPT][BUDGET]
+    degraded: 넘기면 비운 required 블록 이름을 덧붙인다 (호출부가 답변을 캐시하지 않게)
+    """
+    budget = env_int("PROMPT_INPUT_BUDGET", 16000, lo=0) if budget is None else budget
+    static, occurrences, msg_vars = _prompt_shape(prompt)
+
+    sizes: Dict[str, int] = {}
+    for var, n in occurrences.items():
+        if var not in inputs:
+            continue
+        if var in msg_vars:
+            sizes[var] = sum(_message_tokens(inputs[var]))
+        else:
+            sizes[var] = count_tokens(inputs[var]) * n
+    total = static + sum(sizes.values())
+    before = total
+
+    out = inputs
+    trimmed = []
+    if budget and total > budget:
+        out = dict(inputs)
+        for var, (_, mode) in sorted(blocks.items(), key=lambda kv: kv[1][0]):
+            if total <= budget:
+                break
+            if not sizes.get(var):
+                continue
+            over = total - budget
+            if mode == "json":
+                out[var], cut = _trim_json(str(out[var]), over)
+                new = count_tokens(out[var]) * occurrences[var]
+                trimmed.append(f"{var}-{cut}keys")
+            elif mode == "text":
+                n = occurrences[var]
+                keep = max(0, (sizes[var] - over) // n)
+                out[var] = _truncate_text(str(out[var]), keep)
+                new = count_tokens(out[var]) * n
+                trimmed.append(f"{var}~{new}")
+            else:
+                out[var] = ""
+                new = 0
+                trimmed.append(f"{var}-drop")
+                if mode == "required" and degraded is not None:
+                    degraded.append(var)
+            total += new - sizes[var]
+            sizes[var] = new
+
+    detail = " ".join(f"{k}={v}" for k, v in sorted(sizes.items(), key=lambda kv: -kv[1]) if v)
+    print(f"[PROMPT][BUDGET] stage={stage} total={total} budget={budget or '-'} static={static} {detail}"
+          + (f" | trimmed {before}->{total}: {','.join(trimmed)}" if trimmed else ""))
+    if budget and total > budget:
+        print(f"[PROMPT][WARN] stage={stage} 필수 블록만으로 예산 초과 ({total}>{budget})")
+    return out
+
+
+def budget_inputs(prompt, stage: str, blocks: Dict[str, Tuple[int, str]]):
+    """체인 앞에 붙이는 Runnable: inputs → fit_inputs(...)"""
+    from langchain_core.runnables import RunnableLambda
+
+    return RunnableLambda(lambda inputs: fit_inputs(prompt, inputs, stage=stage, blocks=blocks),
+                          name=f"prompt_budget_{stage}")
@@ -0,0 +1,112 @@
+# ================== 프롬프트 prefix 캐시 점검 ==================
+# OpenAI는 요청 앞부분(1024토큰 이상)이 이전 요청과 바이트 단위로 같으면 캐시해 입력 비용/첫 토큰 지연을 줄인다.
+# 상담 프롬프트는 고정 규칙(system)을 앞에, 요청별 값을 마지막 human 메시지에 둔다 (prompts/saju_prompts.py).
+#
+#   chain = ... | counseling_prompt | prefix_guard(counseling_prompt, "counsel") | llm
+#   log_cache_usage("counsel", usage)   # 답변 확정 후 (usage_metadata / token_usage)
+#
+# - prefix_guard: 변수가 없는 앞쪽 메시지들을 렌더링 결과 그대로 sha256 → 단계별 첫 값과 다르면 경고.
+#   (누군가 system 메시지에 {변수}를 넣거나 요청마다 바뀌는 값을 섞으면 바로 드러난다)
+#   첫 요청에서 [PROMPT][PREFIX] 로그로 hash를 남김 → 인스턴스/배포 간 비교 가능
+# - log_cache_usage: 입력 토큰 중 캐시된 토큰 수(cached_tokens / cache_read)와 누적 적중률 로그
+
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+_LOCK = threading.Lock()
+_EXPECTED: Dict[str, str] = {}   # stage -> prefix hash (프로세스 첫 요청 기준)
+_STATS: Dict[str, Dict[str, int]] = {}
+
+
+def static_prefix_len(prompt) -> int:
+    """앞에서부터 변수가 하나도 없는 메시지 개수"""
+    n = 0
+    for m in getattr(prompt, "messages", None) or []:
+        if getattr(m, "input_variables", None) or not hasattr(m, "prompt"):
+            break   # 변수 있는 템플릿 / MessagesPlaceholder
+        n += 1
+    return n
+
+
+def prefix_hash(messages, n: int) -> str:
+    h = hashlib.sha256()
+    for m in list(messages)[:n]:
+        content = m.content if isinstance(m.content, str) else str(m.content)
+        h.update(f"{m.type}\x00{content}\x00".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _stats(stage: str) -> Dict[str, int]:
+    return _STATS.setdefault(stage, {"requests": 0, "prefix_changed": 0, "input_tokens": 0, "cached_tokens": 0, "hits": 0})
+
+
+def check_prefix(stage: str, messages, n: int) -> str:
+    """렌더링된 메시지의 고정 prefix hash 확인 (첫 값과 다르면 경고 후 새 값으로 교체)"""
+    digest = prefix_hash(messages, n)
+    with _LOCK:
+        st = _stats(stage)
+        st["requests"] += 1
+        expected = _EXPECTED.get(stage)
+        if expected is None:
+            _EXPECTED[stage] = digest
+        elif expected != digest:
+            st["prefix_changed"] += 1
+            _EXPECTED[stage] = digest
+    if expected is None:
+        print(f"[PROMPT][PREFIX] stage={stage} static_messages={n} hash={digest}")
+    elif expected != digest:
+        print(f"[PROMPT][PREFIX][WARN] stage={stage} 고정 prefix 변경 {expected}->{digest} (프롬프트 캐시 무효)")
+    return digest
+
+
+def prefix_guard(prompt, stage: str):
+    """prompt 다음에 붙이는 Runnable: PromptValue를 그대로 넘기며 고정 prefix hash를 점검"""
+    from langchain_core.runnables import RunnableLambda
+
+    n = static_prefix_len(prompt)
+
+    def _guard(value):
+        try:
+            check_prefix(stage, value.to_messages(), n)
+        except Exception as e:
+            print(f"[PROMPT][PREFIX][WARN] stage={stage} 점검 실패: {e}")
+        return value
+
+    return RunnableLambda(_guard, name=f"prefix_guard_{stage}")
+
+
+def cached_tokens(usage: Any) -> Optional[int]:
+    """usage에서 캐시된 입력 토큰 수 (usage_metadata.input_token_details.cache_read 또는 token_usage.prompt_tokens_details.cached_tokens)"""
+    if not isinstance(usage, dict):
+        return None
+    details = usage.get("input_token_details") or {}
+    if isinstance(details, dict) and details.get("cache_read") is not None:
+        return int(details["cache_read"])
+    details = usage.get("prompt_tokens_details") or {}
+    if isinstance(details, dict) and details.get("cached_tokens") is not None:
+        return int(details["cached_tokens"])
+    return None
+
+
+def log_cache_usage(stage: str, usage: Any) -> Optional[int]:
+    """캐시 토큰 로그 + 누적 적중률. 반환: 캐시 토큰 수 (응답에 세부 정보가 없으면 None)"""
+    if not isinstance(usage, dict):
+        return None
+    in_tok = usage.get("input_tokens") or usage.get("prompt_tokens") or 0
+    cached = cached_tokens(usage)
+    with _LOCK:
+        st = _stats(stage)
+        st["input_tokens"] += int(in_tok)
+        if cached:
+            st["cached_tokens"] += cached
+            st["hits"] += 1
+        ratio = st["cached_tokens"] / st["input_tokens"] if st["input_tokens"] else 0.0
+    print(f"[USAGE][CACHE] stage={stage} input={in_tok} cached={cached if cached is not None else '-'} "
+          f"cum_ratio={ratio:.1%} prefix={_EXPECTED.get(stage, '-')}")
+    return cached
+
+
+def get_prefix_cache_stats() -> dict:
+    with _LOCK:
+        return {stage: {**st, "prefix_hash": _EXPECTED.get(stage)} for stage, st in _STATS.items()}
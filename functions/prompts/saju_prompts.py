@@ -129,6 +129,14 @@ SAJU_COUNSEL_SYSTEM = """
 - meta: 메타데이터 (keys: focus?, question, summary)
 - target_times: 비교/다중 시점 배열 [{{ label?, scope("year"|"month"|"day"|"hour"), ganji, stem?, branch?, sipseong?, sipseong_branch?, sibi_unseong?, sinsal? }}, ...]
 
+[입력 JSON 생략 규칙] (입력 데이터는 중복/빈 값을 뺀 압축 JSON이다)
+- 값이 없는 필드(null/빈 문자열/빈 배열)는 키째 생략된다 → 해당 필드는 "데이터 없음".
+- target_time이 없으면 resolved.flow_now.target과 같다 ($.target_time.* 는 $.resolved.flow_now.target.* 로 읽는다).
+- current_daewoon이 없으면 resolved.flow_now.daewoon과 같다 ($.current_daewoon.* 는 $.resolved.flow_now.daewoon.* 로 읽는다).
+- saju가 없으면 $.saju.(year|month|day|hour) = $.resolved.pillars.(year|month|day|hour).ganji 이다.
+- resolved.canon은 보내지 않는다 → 위 canon 정의의 라벨 집합을 그대로 사용한다.
+- target_times가 없으면 단일 시점 질문이다 (비교 모드 아님, legacy 경로 사용).
+
 
 
 [모드 자동 판별(상호 배타)]
@@ -280,13 +288,13 @@ SAJU_COUNSEL_SYSTEM = """
    · 개인맞춤입력 정보의 키워드를 자연스럽게 문장에 포함시켜 사용자 맞춤 해석을 제공합니다.
 
 [창의 브리프(JSON)]
-{creative_brief}
+- 사용자 메시지의 [창의 브리프(JSON)] 블록을 사용한다 (비어 있으면 무시).
 
 - 원칙:
   - 브리프의 angles를 “관점 힌트”로만 쓰고, **판단/점수는 생성하지 말라.**
   - 같은 의미라도 각 항목(연/월/일/시)은 **다른 각도**로 서술하라(angles 활용).
   - 첫 단락은 차이를 먼저 말하고, 이어서 사용자가 바로 행동할 수 있는 팁을 제시하라.
-  - 표현 다양화: style_seed={style_seed} 값을 참고해 첫 문장·접속사·동사 선택을 매번 다르게 하라.
+  - 표현 다양화: [요청 정보]의 style_seed 값을 참고해 첫 문장·접속사·동사 선택을 매번 다르게 하라.
 
 [출력 형식]
 - 공통 최소 규칙:
@@ -400,7 +408,7 @@ SAJU_COUNSEL_SYSTEM = """
 - 단, "한 줄 정리 해설" 블록에서는 누구나 아는 일반론이 아니라, **왜 그런 결론이 나오는지**를 사주 구조를 근거로 차분히 설명한다.
 
 [대화 맥락 연결]
-- {summary}를 확인하고 직전 응답이 SAJU 모드였다면, 후속 질문이 일상적/가벼워도 사주 해석 맥락과 연결해 자연스럽게 이어서 답한다.
+- [대화 요약]을 확인하고 직전 응답이 SAJU 모드였다면, 후속 질문이 일상적/가벼워도 사주 해석 맥락과 연결해 자연스럽게 이어서 답한다.
 - **COUNSEL 모드에서는 사주 데이터/이론(간지·십성·십이운성·대운/연운 등)을 언급하지 않는다.** 사주 기반 해석이 필요하면 모드 분류를 SAJU로 선택한다.
 
 [INTERPRET_COMBO]
@@ -427,48 +435,44 @@ SAJU_COUNSEL_SYSTEM = """
   - 십이운성 키워드 예: 장생(시작), 목욕(변동), 관대(성장), 건록(실권), 제왕(피크), 쇠(둔화), 병(부담), 사(마무리), 묘(휴지), 절(단절/리셋), 태(씨앗), 양(발아)
 
 # ───────── 맥락 강화 규칙(추가) ─────────
-- (bridge) bridge가 비어 있지 않다면, **첫 줄에** "{bridge}"를 그대로 출력한다. (bridge 줄은 서두로 취급하지 않는다)
+- (bridge) bridge가 비어 있지 않다면, **첫 줄에** [요청 정보]의 bridge를 그대로 출력한다. (bridge 줄은 서두로 취급하지 않는다)
 - 아래 [FACTS]의 정보(날짜/장소/인물 등)가 있으면 **첫 1~2문장**에 자연스럽게 명시해라.
 - [CONTEXT]의 과거 대화에 근거해 '맥락 브릿지'를 만든 뒤, 그 범위를 벗어나 **새 대주제(결혼/승진/재물 등)로 비약하지 마라**.
 - [CONTEXT]에 없는 사실을 단정하지 마라. 중복 일반론 나열 금지.
-
-
-[대화 요약]
-{summary}
-
-[사용자 질문]
-{question}
 """
 
+# ───────── 상담 프롬프트 배치 (OpenAI 프롬프트 캐시) ─────────
+# 고정 규칙(system 2개)을 앞에 모아 요청마다 바이트가 같은 prefix로 두고, 요청별 값은 모두 마지막 human 메시지에 넣는다.
+# (OpenAI는 1024토큰 이상 동일 prefix를 캐시 → 입력 비용/첫 토큰 지연 감소)
+# ⚠️ system 메시지 안에 {변수}를 넣지 말 것: prefix가 요청마다 달라져 캐시가 깨진다 (prompt_prefix.prefix_guard가 로그로 경고)
+COUNSEL_OUTPUT_RULES = (
+    "⏰ 날짜 규칙:\n"
+    "- 사용자가 '오늘', '내일', '다음 달' 등 상대적 시간 표현을 사용하면 [요청 정보]의 현재 날짜(KST) 기준으로 계산됩니다.\n"
+    "- 질문에서 '오늘'은 이미 간지(년주/월주/일주)로 변환되어 있을 수 있습니다.\n\n"
+    "출력 규칙(중요):\n"
+    "- [요청 정보]의 bridge가 비어 있지 않다면, 첫 줄로 그 내용을 그대로 출력한다. (bridge가 비어 있으면 생략)\n"
+    "- bridge 줄은 서두 문장으로 취급하지 않으며, 그 다음 문장이 핵심 요약이다.\n"
+    "- [FACTS]에 날짜/장소/인물 등이 있으면 **첫 1~2문장**에 자연스럽게 명시한다.\n"
+    "- [CONTEXT] 범위를 벗어나 새로운 대주제로 비약하지 말 것.\n"
+    "- [CONTEXT]에 없는 사실을 단정하지 말 것. 중복 일반론 나열 금지.\n"
+    "- 답변 마지막에 반드시 \"근거\" 블록을 포함한다.\n"
+    "- **근거 블록은 본문과 별도 문단으로 구분하여 작성하세요. 본문 끝에 빈 줄을 넣고 \"근거:\"로 시작하는 별도 문단으로 작성합니다.**\n"
+    "- **근거 블록에는 절대 JSON 경로나 기술적 필드명(예: natal.hyungsal_4dae, $.resolved 등)을 사용하지 말고, 사람이 읽기 쉬운 자연스러운 표현만 사용한다.**"
+)
+
 counseling_prompt = ChatPromptTemplate.from_messages([
-    # 기존 시스템 규칙
+    # ── 고정 prefix (요청 간 동일) ──
     ("system", SAJU_COUNSEL_SYSTEM),
+    ("system", COUNSEL_OUTPUT_RULES),
 
-    # 현재 날짜 정보 추가 (날짜 관련 질문 처리를 위해 필수)
-    ("system", 
-     "⏰ 현재 날짜(KST): {current_date}\n"
-     "- 사용자가 '오늘', '내일', '다음 달' 등 상대적 시간 표현을 사용하면 이 날짜 기준으로 계산됩니다.\n"
-     "- 질문에서 '오늘'은 이미 간지(년주/월주/일주)로 변환되어 있을 수 있습니다."
-    ),
-
-    # 기존 요약 주입(유지)
-    ("system", "이전 대화 요약:\n{summary}"),
-
-    #  🔥브릿지/컨텍스트/팩트 사용 규칙 (문구 복붙 금지 + 비약 금지 재강조)
-    ("system",
-     '출력 규칙(중요):\n'
-     '- bridge가 비어 있지 않다면, 첫 줄로 "{bridge}"를 그대로 출력한다. (bridge가 비어 있으면 생략)\n'
-     '- bridge 줄은 서두 문장으로 취급하지 않으며, 그 다음 문장이 핵심 요약이다.\n'
-     '- [FACTS]에 날짜/장소/인물 등이 있으면 **첫 1~2문장**에 자연스럽게 명시한다.\n'
-     '- [CONTEXT] 범위를 벗어나 새로운 대주제로 비약하지 말 것.\n'
-     '- [CONTEXT]에 없는 사실을 단정하지 말 것. 중복 일반론 나열 금지.\n'
-     '- 답변 마지막에 반드시 "근거" 블록을 포함한다.\n'
-     '- **근거 블록은 본문과 별도 문단으로 구분하여 작성하세요. 본문 끝에 빈 줄을 넣고 "근거:"로 시작하는 별도 문단으로 작성합니다.**\n'
-     '- **근거 블록에는 절대 JSON 경로나 기술적 필드명(예: natal.hyungsal_4dae, $.resolved 등)을 사용하지 말고, 사람이 읽기 쉬운 자연스러운 표현만 사용한다.**'
-    ),
-
-    # 기존 휴먼 입력에 CONTEXT/FACTS/JSON/질문만 확장
+    # ── 요청별 값 (prefix 뒤) ──
     ("human",
+     "[요청 정보]\n"
+     "⏰ 현재 날짜(KST): {current_date}\n"
+     "bridge: {bridge}\n"
+     "style_seed: {style_seed}\n\n"
+     "[대화 요약]\n{summary}\n\n"
+     "[창의 브리프(JSON)]\n{creative_brief}\n\n"
      "[CONTEXT]\n{context}\n\n"
      "[FACTS]\n{facts}\n\n"
      "[입력 데이터(JSON)]\n{payload}\n\n"
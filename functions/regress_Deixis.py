@@ -15,11 +15,15 @@ from datetime import datetime
 
 from langchain_core.prompts import ChatPromptTemplate
 from regress_conversation import _extract_meta, _llm_detect_regression, _db_load
+from conv_store import get_session_summary, load_session_tail
+from stage_scheduler import stage_timer
+from llm_memo import memo_json
+from request_deadline import allow_stage
 
 # ─────────────────────────────────────────────────────────────
 # 외부 제공/기존 함수(이미 프로젝트에 있는 것으로 가정)
 # - _db_load(): conversations.json 로드
-# - _extract_meta(text): msg_keywords/kind/notes 등 메타 추출(OpenAI 사용)
+# - _extract_meta(text): msg_keywords/kind/notes 등 메타 추출(OpenAI 사용, 요청 메타 등록돼 있으면 재사용)
 # - _llm_detect_regression(question, summary_text, hist): 회귀 여부/키워드/이유 등
 # - _to_text(): LangChain/OpenAI 응답을 문자열로 정규화
 # ※ 없으면 기존 구현 임포트하세요.
@@ -54,11 +58,10 @@ def _get_history_stats(*, session_id: str) -> dict:
     """
     현재 세션의 과거 턴 수를 기준으로 '히스토리 존재 여부' 판단.
     - 반드시 session_id를 받아서 sid=None 문제를 원천 차단.
+    - 턴 목록 대신 세션 매니페스트의 턴 수만 본다.
     """
-    db = _db_load()
-    sess = (db.get("sessions") or {}).get(session_id) or {}
-    turns = (sess.get("turns") or [])
-    return {"has_history": len(turns) > 0, "history_turns": len(turns)}
+    n = int((get_session_summary(session_id) or {}).get("turns") or 0)
+    return {"has_history": n > 0, "history_turns": n}
 
 # ─────────────────────────────────────────────────────────────
 # 과거 맥락 선택: 키워드 Jaccard + kind 보너스
@@ -258,6 +261,14 @@ JSON만 출력.""")
 ])
 
 
+def get_prev_assistant_text(session_id: str, n: int = 500) -> str:
+    """직전 assistant 답변 (앞 n자). 세션 끝쪽 몇 턴만 읽는다"""
+    for t in reversed(load_session_tail(session_id, 4)):
+        if t.get("role") == "assistant":
+            return (t.get("text") or "")[:n]
+    return ""
+
+
 def _llm_detect_continuation_v2(question: str, prev_assistant_text: str) -> dict:
     """
     LLM으로 회귀 여부 판정 (의미 기반, 마커/룰 없음)
@@ -273,9 +284,17 @@ def _llm_detect_continuation_v2(question: str, prev_assistant_text: str) -> dict
             "reason": str
         }
     """
+    # 요청 마감이 가까우면 판정 생략 → 회귀 아님 (선택 단계, request_deadline)
+    if not allow_stage("continuation"):
+        return {
+            "is_continuation": False,
+            "confidence": 0.0,
+            "reason": "deadline"
+        }
+
     try:
         import os
-        from langchain_openai import ChatOpenAI
+        from llm_registry import deadline_llm, get_chain
         
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
@@ -286,23 +305,27 @@ def _llm_detect_continuation_v2(question: str, prev_assistant_text: str) -> dict
                 "reason": "api_key_missing"
             }
         
-        llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.0,
-            max_tokens=200,
-            timeout=15,
-            openai_api_key=api_key,
-            model_kwargs={"response_format": {"type": "json_object"}}
-        )
-        
-        chain = _CONTINUATION_DETECT_PROMPT | llm
-        result = chain.invoke({
+        inputs = {
             "prev_assistant_text": prev_assistant_text[:300],  # 최근 300자만
             "current_question": question
-        })
-        
-        import json
-        data = json.loads(result.content if hasattr(result, "content") else str(result))
+        }
+
+        def _invoke() -> dict:
+            # 판정 체인은 프로세스에서 1번만 생성 (공유 HTTP 풀, timeout/재시도는 요청 마감 기준)
+            chain = get_chain("continuation", lambda: _CONTINUATION_DETECT_PROMPT | deadline_llm(
+                "continuation",
+                model="gpt-4o-mini",
+                temperature=0.0,
+                max_tokens=200,
+                timeout=15,
+                openai_api_key=api_key,
+                model_kwargs={"response_format": {"type": "json_object"}}
+            ))
+            result = chain.invoke(inputs)
+            return json.loads(result.content if hasattr(result, "content") else str(result))
+
+        # temperature=0 JSON 판정 → 같은 (직전 답변, 질문)이면 메모 결과 재사용
+        data = memo_json("continuation", inputs, _invoke, model="gpt-4o-mini", prompt=_CONTINUATION_DETECT_PROMPT)
         
         # 기본값 보정
         data.setdefault("is_continuation", False)
@@ -380,33 +403,41 @@ def _refine_conclusions_with_llm(rows_fmt: List[dict], current_question: str) ->
     
     assistant_text = "\n\n".join([f"[답변{i+1}] {m.get('text', '')[:200]}" for i, m in enumerate(assistant_msgs)])
     
+    # 요청 마감이 가까우면 정제 생략 → 빈 결론 (confidence 0 → 주입 안 함)
+    if not allow_stage("refine"):
+        return {"decisions": [], "key_points": [], "open_questions": [], "constraints": [], "confidence": 0.0}
+
     try:
         # LLM 호출
         import os
-        from langchain_openai import ChatOpenAI
+        from llm_registry import deadline_llm, get_chain
         
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             print("[REFINE] OPENAI_API_KEY not set")
             return {"decisions": [], "key_points": [], "open_questions": [], "constraints": [], "confidence": 0.0}
         
-        llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.0,
-            max_tokens=400,
-            timeout=15,
-            openai_api_key=api_key,
-            model_kwargs={"response_format": {"type": "json_object"}}
-        )
-        
-        chain = _REFINE_CONCLUSIONS_PROMPT | llm
-        result = chain.invoke({
+        inputs = {
             "assistant_messages": assistant_text,
             "current_question": current_question
-        })
-        
-        import json
-        data = json.loads(result.content if hasattr(result, "content") else str(result))
+        }
+
+        def _invoke() -> dict:
+            # 정제 체인은 프로세스에서 1번만 생성 (공유 HTTP 풀, timeout/재시도는 요청 마감 기준)
+            chain = get_chain("refine", lambda: _REFINE_CONCLUSIONS_PROMPT | deadline_llm(
+                "refine",
+                model="gpt-4o-mini",
+                temperature=0.0,
+                max_tokens=400,
+                timeout=15,
+                openai_api_key=api_key,
+                model_kwargs={"response_format": {"type": "json_object"}}
+            ))
+            result = chain.invoke(inputs)
+            return json.loads(result.content if hasattr(result, "content") else str(result))
+
+        # temperature=0 JSON 정제 → 같은 (답변 묶음, 질문)이면 메모 결과 재사용
+        data = memo_json("refine", inputs, _invoke, model="gpt-4o-mini", prompt=_REFINE_CONCLUSIONS_PROMPT)
         
         # 기본값 보정
         data.setdefault("decisions", [])
@@ -436,6 +467,9 @@ def _resolve_deixis_and_make_facts(question: str, *, session_id: str, meta_now:
     facts: dict = {}
     if not _has_deixis(question):
         return facts
+    # 요청 마감이 가까우면 앵커 복원(대화 전체 스캔) 생략 → FACT 없음 (선택 단계, request_deadline)
+    if not allow_stage("deixis"):
+        return facts
 
     hints = tuple(meta_now.get("msg_keywords") or []) + ("여행","만남","일정","장소","호텔","도시")
 
@@ -474,6 +508,8 @@ def build_regression_and_deixis_context(
     summary_text: str,
     *,
     session_id: str,
+    continuation: Optional[dict] = None,
+    meta_now: Optional[dict] = None,
 ) -> Tuple[str, dict]:
     """
     🎯 하이브리드 회귀 처리 (Rule + LLM 정제)
@@ -483,6 +519,10 @@ def build_regression_and_deixis_context(
       Step B: LLM 이전 결론 정제 (의미 기반, 토픽 키워드 ❌)
       Step C: 조건부 memory_summary 주입 (confidence ≥ 임계치)
     
+    continuation: 호출부가 Step A(_llm_detect_continuation_v2)를 메타 추출과 동시에 미리 돌렸으면
+                  그 결과. 주면 여기서는 직전 답변 조회/판정을 다시 하지 않는다.
+    meta_now: 요청 메타(extract_meta_and_convert 결과). 주면 Step B에서 메타 LLM을 다시 부르지 않는다.
+    
     Returns:
         (프롬프트, 디버그메타)
     """
@@ -506,20 +546,13 @@ def build_regression_and_deixis_context(
     # ─────────────────────────────────────────────────────────
     # Step A: LLM 회귀 판정 (의미 기반)
     # ─────────────────────────────────────────────────────────
-    # 직전 assistant 답변 가져오기
-    from regress_conversation import _db_load
-    db = _db_load()
-    sessions = db.get("sessions") or {}
-    sess = sessions.get(session_id) or {}
-    turns = list(sess.get("turns") or [])
-    
-    prev_assistant_text = ""
-    for t in reversed(turns):
-        if t.get("role") == "assistant":
-            prev_assistant_text = t.get("text", "")[:500]  # 최근 500자
-            break
-    
-    continuation_result = _llm_detect_continuation_v2(question, prev_assistant_text)
+    if continuation is not None:
+        continuation_result = continuation
+    else:
+        # 직전 assistant 답변 가져오기
+        prev_assistant_text = get_prev_assistant_text(session_id)
+        with stage_timer("continuation"):
+            continuation_result = _llm_detect_continuation_v2(question, prev_assistant_text)
     print(f"[REG][STEP-A] is_continuation={continuation_result['is_continuation']} "
           f"confidence={continuation_result['confidence']:.2f} "
           f"reason='{continuation_result['reason']}'")
@@ -541,8 +574,9 @@ def build_regression_and_deixis_context(
     # Step B: LLM 이전 결론 정제 (회귀일 때만 호출)
     # ─────────────────────────────────────────────────────────
     # 최근 대화 컨텍스트 가져오기
-    from regress_conversation import _extract_meta
-    meta_now = _extract_meta(question)
+    if meta_now is None:
+        with stage_timer("deixis_meta"):
+            meta_now = _extract_meta(question)
     
     # 과거 맥락 검색 (키워드 기반, 상위 4개만)
     merged_kws = meta_now.get("msg_keywords", [])
@@ -558,7 +592,8 @@ def build_regression_and_deixis_context(
         rows_fmt, scan_dbg = [], {}
     
     # LLM 정제
-    refined = _refine_conclusions_with_llm(rows_fmt, question)
+    with stage_timer("refine"):
+        refined = _refine_conclusions_with_llm(rows_fmt, question)
     decisions_count = len(refined.get("decisions", []))
     print(f"[REG][STEP-B] refined_confidence={refined['confidence']:.2f} decisions_count={decisions_count}")
     
@@ -8,15 +8,17 @@
 # 3) 반환 debug에는 LLM 판정, JSON 검색 요약, FACT 주입 정보까지 모두 담아 로깅/저장 가능.
 # -------------------------------------------------
 from functools import lru_cache
+from contextvars import ContextVar
 import time
 from langchain_core.prompts import ChatPromptTemplate
 #from __future__ import annotations
 from typing import Any, Dict, List, Tuple, Optional
-import os, re, json
+import os, re, json, uuid
 from datetime import date, datetime, timedelta
-from langchain_openai import ChatOpenAI
+from llm_registry import deadline_llm
+from llm_memo import memo_json
 
-from conv_store import _CUR_USER_ID, _db_load, _db_save, _is_gs_path, _max_turns, _parse_gs_path, _resolve_store_path_for_user, _trim_session_turns, get_current_user_id, get_current_app_uid, make_user_key, set_current_user_context, user_from_payload
+from conv_store import _CUR_USER_ID, _db_apply, _db_load, _db_save, _is_gs_path, _max_turns, _parse_gs_path, _resolve_store_path_for_user, _trim_session_turns, get_current_user_id, get_session_manifest, get_current_app_uid, make_user_key, set_current_user_context, user_from_payload
 try:
     from zoneinfo import ZoneInfo  # Py3.9+
 except Exception:
@@ -88,7 +90,8 @@ def _get_regression_chain():
     temp  = float(os.environ.get("REG_TEMPERATURE", "0.0"))
     #print(f"[CHAIN] 회귀판정 체인 초기화: model={model}, temp={temp}")
 
-    llm = ChatOpenAI(
+    llm = deadline_llm(
+        "regression",
         model=model,
         temperature=temp,
         max_tokens=350,
@@ -350,7 +353,8 @@ def get_extract_chain():
         print("[META] OPENAI_API_KEY not set — meta extraction will be skipped")
         return None
 
-    llm = ChatOpenAI(
+    llm = deadline_llm(
+        "extract_meta",
         model=os.environ.get("EXTRACT_MODEL", "gpt-4o-mini"),
         temperature=float(os.environ.get("EXTRACT_TEMPERATURE", "0.0")),
         max_tokens=500,
@@ -363,32 +367,45 @@ def get_extract_chain():
 
 
 
-def _extract_meta(text: str) -> Dict[str, Any]:
-    """
-    OpenAI로 msg_keywords/target_date/time/kind/notes 추출.
-    - get_extract_chain()은 JSON 응답(response_format=json_object) 강제된 체인이어야 함.
-    - 키가 빠져도 기본값 세팅.
-    """    
-    data = {}
+# ───────── 요청 단위 메타 ─────────
+# 한 요청에서 질문 메타는 extract_meta_and_convert()가 한 번만 뽑는다.
+# 호출부(main)가 set_request_meta()로 등록하면, 같은 요청 안의 _extract_meta(질문)
+# (회귀/지시어 빌더, record_turn_message(auto_meta=True))는 LLM을 다시 부르지 않고 이 값을 쓴다.
+# texts: 같은 메타로 간주할 문장들 (원문 질문 + 상대시간 치환된 updated_question)
+_CUR_REQUEST_META: ContextVar[dict | None] = ContextVar("_CUR_REQUEST_META", default=None)
+
+
+def set_request_meta(meta: Dict[str, Any], *texts: str):
+    """요청 메타 등록. 반환 토큰은 clear_request_meta()에 넘긴다"""
+    keys = tuple(dict.fromkeys(t.strip() for t in texts if t and t.strip()))
+    return _CUR_REQUEST_META.set({"meta": dict(meta or {}), "texts": keys})
+
+
+def clear_request_meta(token=None) -> None:
+    if token is not None:
+        try:
+            _CUR_REQUEST_META.reset(token)
+            return
+        except ValueError:
+            pass
+    _CUR_REQUEST_META.set(None)
 
-    try:
-        extract_chain = get_extract_chain()     # ← 키 없으면 None 반환하도록 구현되어 있다면 체크
-        if not extract_chain:
-            print("[META] 추출 체인 없음(OPENAI_API_KEY 미설정 등) → 폴백")
-            raise RuntimeError("no extract chain")
-        res = extract_chain.invoke({"text": text})
-        raw = _to_text(res)
-        payload = _extract_json_block(raw)      # ← 이미 있던 헬퍼(없으면 raw 그대로)
-        data = _safe_json_loads(payload)        # ← 안전 파싱(없으면 json.loads 예외 잡기)
-        if data:
-            print(f"[META] JSON 파싱 성공: {data}")
-        else:
-            print(f"[META] JSON 파싱 실패 → 폴백 사용")
-    except Exception as e:
-        print(f"[META] 예외 → 폴백: {e}")
-        data = {}
 
-    # 누락 키 보정(일관된 스키마 유지)
+def get_request_meta(text: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """등록된 요청 메타(복사본). text를 주면 그 문장이 등록된 질문일 때만 반환"""
+    cur = _CUR_REQUEST_META.get()
+    if not cur:
+        return None
+    if text is not None and (text or "").strip() not in cur["texts"]:
+        return None
+    return dict(cur["meta"])
+
+
+def _normalize_meta(text: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    메타 스키마 보정 (in-place): 누락 키 기본값, 키워드 정규화, kind 소문자, timing_structure.
+    _extract_meta와 core.services.extract_meta_and_convert가 같은 규칙을 쓰도록 공용화.
+    """
     data.setdefault("msg_keywords", [])
     data.setdefault("target_date", None)
     data.setdefault("time", None)
@@ -407,13 +424,51 @@ def _extract_meta(text: str) -> Dict[str, Any]:
     data["msg_keywords"] = _norm_kw_list(data.get("msg_keywords"))
     if data.get("kind"):
         data["kind"] = str(data["kind"]).strip().lower()
-    
+
     # ✅ [NEW] 시간 질문 구조화
     data["timing_structure"] = _structure_timing_question(text, data)
-
     return data
 
 
+def _extract_meta(text: str) -> Dict[str, Any]:
+    """
+    OpenAI로 msg_keywords/target_date/time/kind/notes 추출.
+    - get_extract_chain()은 JSON 응답(response_format=json_object) 강제된 체인이어야 함.
+    - 키가 빠져도 기본값 세팅.
+    - 현재 요청에 등록된 메타(set_request_meta)가 이 문장 것이면 LLM 호출 없이 그대로 반환.
+    """    
+    reused = get_request_meta(text)
+    if reused is not None:
+        print(f"[META] 요청 메타 재사용 (LLM 생략): kws={reused.get('msg_keywords')}")
+        return reused
+
+    data = {}
+
+    try:
+        extract_chain = get_extract_chain()     # ← 키 없으면 None 반환하도록 구현되어 있다면 체크
+        if not extract_chain:
+            print("[META] 추출 체인 없음(OPENAI_API_KEY 미설정 등) → 폴백")
+            raise RuntimeError("no extract chain")
+        # temperature=0 JSON 체인 → 같은 문장이면 메모이제이션 결과 재사용 (llm_memo)
+        data = memo_json(
+            "extract", {"text": text},
+            # _extract_json_block: 이미 있던 헬퍼(없으면 raw 그대로) / _safe_json_loads: 안전 파싱
+            lambda: _safe_json_loads(_extract_json_block(_to_text(extract_chain.invoke({"text": text})))),
+            model=os.environ.get("EXTRACT_MODEL", "gpt-4o-mini"),
+            prompt=_EXTRACT_PROMPT,
+        )
+        if data:
+            print(f"[META] JSON 파싱 성공: {data}")
+        else:
+            print(f"[META] JSON 파싱 실패 → 폴백 사용")
+    except Exception as e:
+        print(f"[META] 예외 → 폴백: {e}")
+        data = {}
+
+    # 누락 키 보정(일관된 스키마 유지) + 시간 질문 구조화
+    return _normalize_meta(text, data)
+
+
 def _structure_timing_question(text: str, meta: dict) -> dict | None:
     """
     "언제쯤 수익이 날까?" 같은 시간 질문을 구조화
@@ -486,15 +541,20 @@ def _structure_timing_question(text: str, meta: dict) -> dict | None:
 def _llm_detect_regression(question: str, summary_text: str, hist: dict) -> dict:
     try:
         #print(f"_llm_detect_regression() Q : {question} : {summary_text}")
-        res = _REG_CHAIN.invoke({
+        inputs = {
             # 프롬프트가 요구하는 입력만 필수로 넣자
             "summary": summary_text or "",
             "question": question,
             # (선택) 프롬프트에 반영한다면 같이 사용
             "has_history": hist.get("has_history", False),
             "history_turns": hist.get("history_turns", 0),
-        })
-        data = json.loads(_to_text(res))
+        }
+        data = memo_json(
+            "regression", inputs,
+            lambda: json.loads(_to_text(_REG_CHAIN.invoke(inputs))),
+            model=os.environ.get("REG_MODEL", "gpt-4o-mini"),
+            prompt=_REG_PROMPT,
+        )
     except Exception as e:
         print(f"[REG] 회귀 LLM 예외 → False 폴백: {e}")
         data = {
@@ -521,22 +581,20 @@ def _get_history_stats(session_id: Optional[str] = None) -> Dict[str, Any]:
     - history_turns: 턴 개수
     - session_id: 사용된 세션 ID (없으면 첫 세션을 자동 선택)
 
-    주의: 여기서는 무거운 의존성 없이 conversations.json만 확인합니다.
+    주의: 턴 목록은 읽지 않고 세션 매니페스트(턴 수 요약)만 확인합니다.
     """
-    db = _db_load()
-    sessions = db.get("sessions") or {}
+    manifest = get_session_manifest()
 
     # 세션이 지정되지 않았다면 첫 세션을 선택 (서비스 정책에 맞게 조정 가능)
     if session_id is None:
-        session_id = next(iter(sessions), None)
+        session_id = next(iter(manifest), None)
 
-    sess = sessions.get(session_id) or {}
-    turns = (sess.get("turns") or [])
-    print(f"turns {turns}")
+    n = int((manifest.get(session_id) or {}).get("turns") or 0)
+    print(f"[HIST] session='{session_id}' turns={n}")
 
     return {
-        "has_history": len(turns) > 0,
-        "history_turns": len(turns),
+        "has_history": n > 0,
+        "history_turns": n,
         "session_id": session_id,
     }
     
@@ -649,8 +707,6 @@ def build_question_with_regression_context(
     # 아무 맥락도 못 붙였으면 그냥 원문 반환(디버그로 회귀 흔적만 남음)
     return question, debug
 
-from contextvars import ContextVar
-
 #def _is_gs_path(p: str) -> bool:
 #    return isinstance(p, str) and p.startswith("gs://")
 
@@ -690,13 +746,14 @@ def record_turn_message(
     extra_meta: Optional[Dict[str, Any]] = None,
     user: Optional[Dict[str, Any]] = None,      # {"id","name","birth"} 직접 전달
     payload: Optional[Dict[str, Any]] = None,   # {"user":{"name","birth"}} 형태
+    max_turns: Optional[int] = None,            # 요청의 hot 구간 한도 (max_history). 없으면 CONVO_MAX_TURNS
 ) -> None:
     """
     한 턴(메시지)을 JSON DB에 기록.
     - auto_meta=True: OpenAI로 메타 자동 추출
     - extra_meta: 간지 등 추가 필드를 dict로 전달하면 turn에 합쳐 저장
-    - N은 CONVO_MAX_TURNS 환경변수(기본 300)
-    - GCS에 전체 JSON을 다시 업로드(덮어쓰기)하므로, 오래된 턴은 자연스럽게 사라진다(밀어내기).
+    - hot 구간 N은 max_turns(요청의 max_history), 없으면 CONVO_MAX_TURNS 환경변수(기본 MAX_TURNS)
+    - N을 넘은 오래된 턴은 세션 cold 아카이브로 옮겨진다 (load_session_archive로 조회).
     - user / payload를 주면 해당 호출 스코프에서만 사용자 컨텍스트를 임시 설정한다.
     - 설정하지 않으면 현재 컨텍스트(_CUR_USER_ID) 또는 전역 파일 사용.
     """
@@ -759,12 +816,13 @@ def record_turn_message(
         db = _db_load()
         if session_id not in db["sessions"]:
             print(f"[WARN] 세션 {session_id} 없음 → 자동 생성")
-            db["sessions"][session_id] = {
+            _db_apply(db, {
+                "op": "session", "sid": session_id,
                 "meta": {"session_id": session_id, "created_at": _now_utc_iso(), "title": "사주 대화"},
-                "turns": []
-            }
+            })
 
         turn = {
+            "id": uuid.uuid4().hex[:12],
             "ts": _local_ts(),
             "date": _local_date(),
             "time": _local_time(),
@@ -789,16 +847,19 @@ def record_turn_message(
             print(f"[META-EXTRA] 추가 메타: {extra_meta}")
 
         # ── [D] append → 오래된 턴 컷 → 저장(덮어쓰기) ─────────────────────────
-        db["sessions"][session_id]["turns"].append(turn)
+        # 요청 세션(begin_store_session)이 열려 있으면 저장은 요청 끝에 1회만 일어난다.
+        _db_apply(db, {"op": "append", "sid": session_id, "turn": turn})
 
         cur_len = len(db["sessions"][session_id]["turns"])
         print(f"[STORE] session='{session_id}' appended -> len={cur_len}")
-        # removed = _trim_session_turns(db, session_id, max_turns=_max_turns())
-        # if removed:
-        #     kept = len(db["sessions"][session_id]["turns"])
-        #     print(f"[TRIM] session='{session_id}' removed={removed} kept={kept} (limit={_max_turns()})")
+        # hot 구간 유지: 한도(max_turns → CONVO_MAX_TURNS)를 넘은 오래된 턴은 cold 아카이브로 (같은 요청 기록에 합쳐짐)
+        limit = max_turns or _max_turns()
+        moved = _trim_session_turns(db, session_id, max_turns=limit)
+        if moved:
+            kept = len(db["sessions"][session_id]["turns"])
+            print(f"[TRIM] session='{session_id}' cold+={moved} kept={kept} (limit={limit})")
 
-        _db_save(db)  # GCS에 전체 JSON 재업로드 → 앞쪽(오래된) 턴은 파일에서 제거됨
+        _db_save(db)  # 요청 세션 없으면 즉시 전체 JSON 재업로드, 있으면 요청 끝에 1회
 
     finally:
         # ── [C] 이 함수 내부에서 컨텍스트를 세팅했다면 끝나고 해제 ────────────────
@@ -827,10 +888,10 @@ def ensure_session(sid: str, title: str = "사주 대화", *, user: dict | None
         if not isinstance(db.get("sessions"), dict):
             db["sessions"] = {}  # 방어
         if sid not in db["sessions"]:
-            db["sessions"][sid] = {
+            _db_apply(db, {
+                "op": "session", "sid": sid,
                 "meta": {"session_id": sid, "created_at": _now_utc_iso(), "title": title},
-                "turns": []
-            }
+            })
             _db_save(db)
             print(f"[SESSION] 새 세션 생성: {sid}")
         return sid
@@ -0,0 +1,161 @@
+# ================== 요청 마감 시간 (deadline budget) ==================
+# ask_saju 요청 1건에 전체 시간 예산을 두고, 모든 단계가 '남은 시간'을 보고 timeout/재시도/실행 여부를 정한다.
+# 느린 보조 단계(회귀 판정, 결론 정제 …)가 본 답변 시간을 먹어 p99가 함수 한도(300s)까지 늘어나는 것을 막는다.
+#
+#   dl, token = start_deadline()                    # 요청 진입 시 1회 (contextvar → 단계 스레드에도 전달)
+#   if allow_stage("refine"): ...                   # 선택 단계: 예산이 모자라면 건너뛰고 폴백 (degraded 기록)
+#   t, r = dl.llm_policy("extract_meta", 45, 2)     # LLM 호출 timeout/재시도 (llm_registry.deadline_llm이 호출마다)
+#   degraded_stages()                               # 응답 필드 "degraded_stages" (건너뛴 선택 단계)
+#   end_deadline(dl, token)                         # 요청 정리 시 ([DEADLINE] 로그)
+#
+# - REQUEST_DEADLINE_S (기본 60): 요청 전체 예산. 0이면 끔 (기존 고정 timeout/재시도)
+# - REQUEST_DEADLINE_RESERVE_S (기본 25): 본 답변(counsel/fortune) 몫. 보조 단계는 '남은 시간 - 이 값'만 쓴다
+# - REQUEST_DEADLINE_MIN_CALL_S (기본 3): LLM 호출 1회 timeout 하한 (예산이 바닥나도 본 답변은 이만큼 시도)
+# - 선택 단계(OPTIONAL_STAGES)와 최소 필요 시간: 보조 예산이 이보다 적으면 건너뜀. 모두 안전한 폴백이 있다
+#     continuation : 회귀 아님으로 처리      refine : 이전 결론 주입 안 함      deixis : 지시어 FACT 없음
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from env_conf import env_float
+
+# 본 답변 단계 (예비 몫을 쓸 수 있음)
+ANSWER_STAGES = frozenset({"counsel", "fortune"})
+
+# 선택 단계 → 실행에 필요한 최소 보조 예산(초)
+OPTIONAL_STAGES: Dict[str, float] = {
+    "continuation": 4.0,
+    "refine": 4.0,
+    "deixis": 1.0,
+}
+
+_CUR_DEADLINE: ContextVar["Deadline | None"] = ContextVar("_CUR_DEADLINE", default=None)
+
+_LOCK = threading.Lock()
+_STATS = {"requests": 0, "degraded_requests": 0, "skipped": 0, "tightened": 0, "overruns": 0}
+
+
+class Deadline:
+    """요청 1건의 마감 시각 + 줄이거나 건너뛴 단계 기록 (단계 스레드에서 같이 쓴다)"""
+
+    def __init__(self, budget_s: float, *, reserve_s: float = 0.0, min_call_s: float = 3.0):
+        self.budget_s = budget_s
+        self.reserve_s = min(reserve_s, budget_s)
+        self.min_call_s = min_call_s
+        self._t0 = time.monotonic()
+        self._expires = self._t0 + budget_s
+        self._lock = threading.Lock()
+        self.degraded: Dict[str, str] = {}        # stage -> 이유 (skipped: 실행 안 함)
+        self.tightened: Dict[str, str] = {}       # stage -> "t=..s r=.." (기본보다 줄인 호출)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._t0
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires - time.monotonic())
+
+    def available(self, stage: str) -> float:
+        """이 단계가 쓸 수 있는 시간 (보조 단계는 본 답변 몫을 남긴다)"""
+        if stage in ANSWER_STAGES:
+            return self.remaining()
+        return max(0.0, self.remaining() - self.reserve_s)
+
+    def allows(self, stage: str) -> bool:
+        """선택 단계 실행 여부. 예산이 모자라면 degraded에 남기고 False"""
+        need = OPTIONAL_STAGES.get(stage)
+        if need is None:
+            return True
+        left = self.available(stage)
+        if left >= need:
+            return True
+        with self._lock:
+            first = stage not in self.degraded
+            self.degraded[stage] = "skipped"
+        if first:
+            print(f"[DEADLINE] skip {stage}: 남은 보조 예산 {left:.1f}s < {need:.1f}s")
+        return False
+
+    def llm_policy(self, stage: str, timeout: float, retries: int) -> Tuple[float, int]:
+        """
+        (호출 1회 timeout, 재시도 횟수). 기본값 안에서 남은 시간에 들어가는 만큼만.
+        예산이 바닥나도 timeout은 min_call_s 이상 (요청은 실패 대신 늦게라도 답한다)
+        """
+        left = self.available(stage)
+        t = max(min(timeout, left), min(self.min_call_s, timeout))
+        r = max(0, min(retries, int(left // t) - 1)) if t > 0 else 0
+        if t < timeout or r < retries:
+            with self._lock:
+                self.tightened[stage] = f"t={t:.1f}s r={r}"
+        return round(t, 1), r
+
+    def degraded_stages(self) -> List[str]:
+        with self._lock:
+            return list(self.degraded)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"budget_s": self.budget_s, "elapsed_ms": round(self.elapsed() * 1000, 1),
+                    "degraded": dict(self.degraded), "tightened": dict(self.tightened)}
+
+    def log(self) -> dict:
+        r = self.report()
+        degraded = ",".join(f"{k}({v})" for k, v in r["degraded"].items())
+        tightened = ",".join(f"{k}({v})" for k, v in r["tightened"].items())
+        print(f"[DEADLINE] budget={self.budget_s:.0f}s elapsed={r['elapsed_ms']}ms "
+              f"degraded={degraded or '-'} tightened={tightened or '-'}")
+        return r
+
+
+def start_deadline() -> Tuple[Optional[Deadline], object]:
+    """요청 진입 시 1회. (Deadline | None(끔), contextvar 토큰)"""
+    budget = env_float("REQUEST_DEADLINE_S", 60, lo=0)
+    dl = None
+    if budget > 0:
+        dl = Deadline(
+            budget,
+            reserve_s=env_float("REQUEST_DEADLINE_RESERVE_S", 25, lo=0),
+            min_call_s=env_float("REQUEST_DEADLINE_MIN_CALL_S", 3, lo=0),
+        )
+    return dl, _CUR_DEADLINE.set(dl)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _CUR_DEADLINE.get()
+
+
+def allow_stage(stage: str) -> bool:
+    """현재 요청의 선택 단계 실행 여부 (요청 밖/마감 끔이면 항상 True)"""
+    dl = _CUR_DEADLINE.get()
+    return dl is None or dl.allows(stage)
+
+
+def degraded_stages() -> List[str]:
+    """현재 요청에서 마감 때문에 건너뛴 선택 단계 (응답 필드 "degraded_stages")"""
+    dl = _CUR_DEADLINE.get()
+    return dl.degraded_stages() if dl is not None else []
+
+
+def end_deadline(dl: Optional[Deadline], token) -> Optional[dict]:
+    """요청 정리: [DEADLINE] 로그 + 통계, contextvar 해제 (스트림 종료처럼 다른 스레드에서 불려도 dl 기준)"""
+    try:
+        _CUR_DEADLINE.reset(token)
+    except ValueError:
+        _CUR_DEADLINE.set(None)   # 다른 컨텍스트에서 정리되는 경우 (스트림 종료 등)
+    if dl is None:
+        return None
+    r = dl.log()
+    with _LOCK:
+        _STATS["requests"] += 1
+        _STATS["degraded_requests"] += 1 if r["degraded"] else 0
+        _STATS["skipped"] += len(r["degraded"])
+        _STATS["tightened"] += len(r["tightened"])
+        _STATS["overruns"] += 1 if r["elapsed_ms"] > dl.budget_s * 1000 else 0
+    return r
+
+
+def get_request_deadline_stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "budget_s": env_float("REQUEST_DEADLINE_S", 60, lo=0),
+                "reserve_s": env_float("REQUEST_DEADLINE_RESERVE_S", 25, lo=0)}
@@ -0,0 +1,105 @@
+# ================== 요청 재전송 응답 재사용 (request_id 멱등성) ==================
+# 앱이 요청마다 request_id(본문 "request_id" 또는 Idempotency-Key 헤더)를 붙이면, 그 요청의 완료 응답을
+# 대화 저장소(사용자 문서 옆)에 남긴다. 같은 id가 다시 오면 — 다른 인스턴스여도 — LLM 호출/턴 기록 없이
+# 저장된 응답을 그대로 돌려준다. (네트워크 끊김 후 재전송, 콜드스타트 타임아웃 재시도 등)
+#
+#   rid = replay_request_id(data, req.headers)            # 없으면 None → 기존 동작
+#   hit = load_replay(store_path, rid)                    # (응답 본문, 경과 초) | None
+#   save_replay(store_path, rid, body, session_id=...)    # 답변 확정 후 요청 정리 시 1회
+#
+# - 저장 위치: ConversationStore.save_replay/load_replay (conv_backends 참고)
+#     gcs/local: <user_id>.replay/<hash>.json, sqlite: replays 테이블, memory: dict
+# - REQUEST_REPLAY_TTL_S (기본 86400): 이보다 오래된 기록은 무시하고 지운다. 0이면 끔
+# - single-flight(인스턴스 내 진행 중 합치기)와 답변 캐시(같은 맥락의 같은 질문)와는 별개:
+#   이쪽은 '같은 요청'의 응답을 저장소 기준으로 보장한다 (첫 요청이 끝난 뒤의 재전송)
+
+import re
+import threading
+import time
+from typing import Optional, Tuple
+
+from env_conf import env_int
+
+_MAX_ID_LEN = 128
+_ID_RE = re.compile(r"^[\w.:\-]+$")
+
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "rejected": 0, "errors": 0}
+
+
+def _ttl_s() -> int:
+    return env_int("REQUEST_REPLAY_TTL_S", 86400, lo=0)
+
+
+def _bump(name: str) -> None:
+    with _LOCK:
+        _STATS[name] += 1
+
+
+def replay_request_id(data: dict, headers=None) -> Optional[str]:
+    """본문 request_id → Idempotency-Key 헤더 순. 형식이 맞지 않으면 None (기존 동작)"""
+    raw = data.get("request_id")
+    if raw in (None, "") and headers is not None:
+        try:
+            raw = headers.get("Idempotency-Key")
+        except Exception:
+            raw = None
+    if raw in (None, ""):
+        return None
+    rid = str(raw).strip()
+    if not rid or len(rid) > _MAX_ID_LEN or not _ID_RE.match(rid):
+        _bump("rejected")
+        print(f"[REPLAY][WARN] request_id 형식 오류 → 무시: {rid[:40]!r}")
+        return None
+    return rid
+
+
+def _store():
+    from conv_store import _conversation_store
+    return _conversation_store()
+
+
+def load_replay(store_path: str, request_id: Optional[str]) -> Optional[Tuple[dict, int]]:
+    """(저장된 응답 본문, 저장 후 경과 초) 또는 None"""
+    ttl = _ttl_s()
+    if not request_id or ttl <= 0:
+        return None
+    try:
+        rec = _store().load_replay(store_path, request_id)
+    except Exception as e:
+        _bump("errors")
+        print(f"[REPLAY][WARN] 기록 조회 실패: {e}")
+        return None
+    if not rec or not isinstance(rec.get("body"), dict):
+        _bump("misses")
+        return None
+    age = time.time() - float(rec.get("stored_at") or 0)
+    if age > ttl:
+        _bump("expired")
+        try:
+            _store().delete_replay(store_path, request_id)
+        except Exception as e:
+            print(f"[REPLAY][WARN] 만료 기록 삭제 실패: {e}")
+        return None
+    _bump("hits")
+    print(f"[REPLAY] hit request_id={request_id} age={int(age)}s session={rec.get('session_id') or '-'}")
+    return rec["body"], int(age)
+
+
+def save_replay(store_path: str, request_id: Optional[str], body: Optional[dict], *, session_id: str = "") -> None:
+    """완료 응답 기록 (실패해도 응답에는 영향 없음)"""
+    ttl = _ttl_s()
+    if not request_id or not body or ttl <= 0:
+        return
+    rec = {"request_id": request_id, "stored_at": time.time(), "session_id": session_id, "body": body}
+    try:
+        _store().save_replay(store_path, request_id, rec, ttl_s=ttl)
+        _bump("stores")
+    except Exception as e:
+        _bump("errors")
+        print(f"[REPLAY][WARN] 기록 저장 실패: {e}")
+
+
+def get_request_replay_stats() -> dict:
+    with _LOCK:
+        return {**_STATS, "ttl_s": _ttl_s()}
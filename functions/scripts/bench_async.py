@@ -0,0 +1,121 @@
+# ================== ask_saju 동기/비동기 경로 부하 벤치마크 ==================
+# 실행 중인 엔드포인트 여러 개에 같은 부하(동시 C개, 총 N건)를 걸어 인스턴스당 처리량을 비교한다.
+#   동기  : firebase emulators:start (HTTPS 함수 ask_saju, 기본 동기 경로)
+#   비동기: uvicorn asgi_app:app --port 8080   (또는 ASK_SAJU_ASYNC=1로 띄운 HTTPS 함수)
+#
+# 예)
+#   python scripts/bench_async.py \
+#       --url sync=http://127.0.0.1:5001/<project>/us-central1/ask_saju \
+#       --url async=http://127.0.0.1:8080/ask_saju --concurrency 32 --requests 200
+#   python scripts/bench_async.py --url async=http://127.0.0.1:8080/ask_saju --stream   # TTFB도 측정
+#
+# - 요청마다 session_id/질문 끝을 달리해 답변 캐시·중복 요청 차단에 걸리지 않게 한다.
+# - --payload로 실제 앱 요청 JSON을 넣을 수 있다 (question/session_id는 덮어씀).
+# - 실제 OpenAI 호출이 일어나므로 비용이 든다. 작은 --requests로 먼저 확인할 것.
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import httpx
+
+_DEFAULT_PAYLOAD = {
+    "name": "벤치",
+    "birth": "19900101",
+    "mode": "saju",
+    "question": "올해 재물운 어때?",
+    "sajuganji": {"년주": "경오", "월주": "무인", "일주": "갑자", "시주": "병인"},
+}
+
+
+def _pct(xs: list, p: float):
+    if not xs:
+        return None
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, max(0, int(len(xs) * p) - 1))], 1)
+
+
+async def _one(client: httpx.AsyncClient, url: str, base: dict, i: int, stream: bool) -> dict:
+    body = dict(base)
+    body["session_id"] = f"bench-{uuid.uuid4().hex[:8]}"
+    body["question"] = f"{base.get('question', '')} ({i})"
+    if stream:
+        body["stream"] = True
+    t0 = time.perf_counter()
+    ttfb = None
+    try:
+        if stream:
+            async with client.stream("POST", url, json=body) as r:
+                async for _ in r.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = (time.perf_counter() - t0) * 1000
+                ok = r.status_code == 200
+        else:
+            r = await client.post(url, json=body)
+            ttfb = (time.perf_counter() - t0) * 1000
+            ok = r.status_code == 200
+    except Exception as e:
+        print(f"[BENCH][ERR] {url}: {e}")
+        ok = False
+    return {"ok": ok, "ms": (time.perf_counter() - t0) * 1000, "ttfb_ms": ttfb}
+
+
+async def _run(name: str, url: str, base: dict, total: int, concurrency: int, stream: bool, timeout: float) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def _guarded(i: int):
+            async with sem:
+                return await _one(client, url, base, i, stream)
+
+        t0 = time.perf_counter()
+        rows = await asyncio.gather(*[_guarded(i) for i in range(total)])
+        wall = time.perf_counter() - t0
+
+    ok = [r for r in rows if r["ok"]]
+    lat = [r["ms"] for r in ok]
+    ttfb = [r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None]
+    return {
+        "name": name,
+        "ok": len(ok),
+        "err": len(rows) - len(ok),
+        "rps": round(len(ok) / wall, 2) if wall > 0 else 0.0,
+        "p50_ms": round(statistics.median(lat), 1) if lat else None,
+        "p95_ms": _pct(lat, 0.95),
+        "ttfb_p50_ms": round(statistics.median(ttfb), 1) if ttfb else None,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="ask_saju 동기/비동기 처리량 비교")
+    ap.add_argument("--url", action="append", required=True, help="이름=URL (여러 번 지정)")
+    ap.add_argument("--requests", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--payload", help="요청 JSON 파일 (기본: 예시 사주 요청)")
+    ap.add_argument("--stream", action="store_true", help='"stream": true로 요청 (TTFB 측정)')
+    ap.add_argument("--timeout", type=float, default=120.0)
+    args = ap.parse_args()
+
+    base = dict(_DEFAULT_PAYLOAD)
+    if args.payload:
+        with open(args.payload, "r", encoding="utf-8") as f:
+            base.update(json.load(f))
+
+    targets = []
+    for spec in args.url:
+        name, sep, url = spec.partition("=")
+        targets.append((name, url) if sep else (url, url))
+
+    print(f"[BENCH] requests={args.requests} concurrency={args.concurrency} stream={args.stream}")
+    rows = [asyncio.run(_run(n, u, base, args.requests, args.concurrency, args.stream, args.timeout)) for n, u in targets]
+    print(f"{'target':<12}{'ok':>6}{'err':>6}{'rps':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'ttfb50':>10}")
+    for r in rows:
+        print(f"{r['name']:<12}{r['ok']:>6}{r['err']:>6}{r['rps']:>8}{str(r['p50_ms']):>10}{str(r['p95_ms']):>10}{str(r['ttfb_p50_ms']):>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,84 @@
+# ================== 저장소 백엔드 벤치마크 ==================
+# 같은 워크로드(사용자 U명 × 턴 T쌍)를 백엔드/포맷별로 돌려
+# 요청 1건(로드 → 유저/어시스턴트 턴 추가 → 트림 → flush) 지연을 비교한다.
+# 클라우드 의존성 없이 로컬에서 실행 가능 (gcs는 GCS_BUCKET + 인증이 있을 때만 지정).
+#
+# 예)
+#   python scripts/bench_store.py
+#   python scripts/bench_store.py --backends local:doc,local:segmented,sqlite,memory --users 20 --turns 40
+#   python scripts/bench_store.py --write-mode async   # 지연 기록: 응답 경로에서 빠진 기록 시간(saved) 확인
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _run(spec: str, users: int, turns: int, max_turns: int) -> dict:
+    import conv_store as cs
+    import conv_backends
+
+    backend, _, fmt = spec.partition(":")
+    os.environ["CONVO_BACKEND"] = backend
+    os.environ["CONVO_STORE_FORMAT"] = fmt or "doc"
+    conv_backends.reset_conversation_stores()
+
+    saved0 = cs.get_write_behind_stats()["saved_ms_total"]
+    lat = []
+    for i in range(turns):
+        for u in range(users):
+            cs.set_current_user_context(name=f"bench{u}", birth="19900101", app_uid="bench")
+            cs.set_current_session("s1")
+            t0 = time.perf_counter()
+            with cs.store_session():
+                db = cs._db_load()
+                for role in ("user", "assistant"):
+                    cs._db_apply(db, {"op": "append", "sid": "s1",
+                                      "turn": {"role": role, "text": f"{role} {i} " + "가" * 200, "ts": f"{i:06d}{role[0]}"}})
+                cs._db_apply(db, {"op": "trim", "sid": "s1", "max_turns": max_turns})
+                cs._db_save(db)
+            lat.append((time.perf_counter() - t0) * 1000)
+    for u in range(users):
+        cs.set_current_user_context(name=f"bench{u}", birth="19900101", app_uid="bench")
+        cs.delete_current_user_store()
+    cs.set_current_user_context(reset=True)
+    cs.drain_write_behind()
+    wb = cs.get_write_behind_stats()
+    lat.sort()
+    return {
+        "spec": spec,
+        "requests": len(lat),
+        "p50_ms": round(statistics.median(lat), 2),
+        "p95_ms": round(lat[int(len(lat) * 0.95) - 1], 2),
+        "total_s": round(sum(lat) / 1000, 2),
+        "saved_s": round((wb["saved_ms_total"] - saved0) / 1000, 2),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="ConversationStore 백엔드 비교")
+    ap.add_argument("--backends", default="local:doc,local:segmented,local:sessions,sqlite,memory")
+    ap.add_argument("--users", type=int, default=5)
+    ap.add_argument("--turns", type=int, default=30, help="사용자당 요청(유저+어시스턴트 턴 쌍) 수")
+    ap.add_argument("--max-turns", type=int, default=30)
+    ap.add_argument("--write-mode", choices=("sync", "async"), default="sync", help="CONVO_WRITE_MODE")
+    args = ap.parse_args()
+    os.environ["CONVO_WRITE_MODE"] = args.write_mode
+
+    os.environ.setdefault("CONVO_BASE", tempfile.mkdtemp(prefix="convo-bench-"))
+    os.environ.setdefault("CONVO_SQLITE_PATH", os.path.join(os.environ["CONVO_BASE"], "bench.sqlite3"))
+    print(f"[BENCH] base={os.environ['CONVO_BASE']} users={args.users} turns={args.turns} write_mode={args.write_mode}")
+
+    rows = [_run(spec.strip(), args.users, args.turns, args.max_turns) for spec in args.backends.split(",") if spec.strip()]
+    print(f"{'backend':<20}{'reqs':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'total(s)':>10}{'saved(s)':>10}")
+    for r in rows:
+        print(f"{r['spec']:<20}{r['requests']:>6}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['total_s']:>10}{r['saved_s']:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
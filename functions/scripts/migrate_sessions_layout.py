@@ -0,0 +1,50 @@
+# ================== 세션 단위 레이아웃 마이그레이션 ==================
+# 기존 사용자 문서(users/<앱UID>/profiles/<user_id>.json)를
+#   users/<앱UID>/profiles/<user_id>/index.json
+#   users/<앱UID>/profiles/<user_id>/sessions/<session_id>.json
+# 로 나눈다. 이후 CONVO_STORE_FORMAT=sessions 로 배포하면 활성 세션만 읽는다.
+#
+# 예)
+#   python scripts/migrate_sessions_layout.py --root gs://chatsaju-5cd67-convos/users
+#   python scripts/migrate_sessions_layout.py --root ./data/users --delete-source
+#
+# (인덱스가 없는 사용자는 sessions 포맷에서도 기존 문서를 그대로 읽고 첫 기록 때 나뉘므로,
+#  이 스크립트는 일괄 전환/원본 정리를 원할 때만 실행하면 된다.)
+
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conv_store import _store_list  # noqa: E402
+from conv_formats import migrate_document  # noqa: E402
+
+_DOC_RE = re.compile(r"[/\\]profiles[/\\][^/\\]+\.json$")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="v1 사용자 문서를 세션 단위 객체로 분리")
+    ap.add_argument("--root", required=True, help="gs://<bucket>/users 또는 <CONVO_BASE>/users")
+    ap.add_argument("--delete-source", action="store_true", help="분리 후 원본 문서 삭제")
+    ap.add_argument("--dry-run", action="store_true", help="대상 목록만 출력")
+    args = ap.parse_args()
+
+    docs = [p for p in _store_list(args.root) if _DOC_RE.search(p)]
+    print(f"[MIGRATE] 대상 문서 {len(docs)}개 (root={args.root})")
+    moved = 0
+    for path in docs:
+        if args.dry_run:
+            print(f"  - {path}")
+            continue
+        try:
+            moved += migrate_document(path, delete_source=args.delete_source)
+        except Exception as e:
+            print(f"[MIGRATE][ERR] {path} — {e}")
+    print(f"[MIGRATE] 완료: 세션 {moved}개 이동")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+# ================== payload 직렬화 토큰 비교 ==================
+# 상담 프롬프트 {payload}에 들어가는 JSON을 기존(full) / 압축(compact) 방식으로 직렬화해 토큰 수를 비교한다.
+# 토큰 수는 prompt_budget.count_tokens (tiktoken o200k_base, 없으면 근사치 — 결과 첫 줄에 표시).
+#
+# 표본(corpus) 모으기: 서버를 PAYLOAD_CORPUS_PATH=./payloads.jsonl 로 띄우고 실제 요청을 보내면
+#   make_saju_payload 결과가 한 줄씩 쌓인다 (개인정보 포함 → 개발 환경에서만).
+# 예)
+#   python scripts/payload_tokens.py payloads.jsonl
+#   python scripts/payload_tokens.py payloads.jsonl requests/ --show 3
+#
+# - 입력: .jsonl(한 줄 1건) / .json(객체 또는 배열) / 디렉터리(안의 *.json, *.jsonl)
+# - 각 항목이 payload(resolved 키 있음)면 그대로, ask_saju 요청 본문이면 make_saju_payload로 만든다
+#   (요청 본문의 updated_question이 있으면 사용, 없으면 question — 상대시간 변환 LLM은 호출하지 않음)
+
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _iter_records(path: str):
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith((".json", ".jsonl")):
+                yield from _iter_records(os.path.join(path, name))
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    yield from (data if isinstance(data, list) else [data])
+
+
+def _to_payload(rec: dict) -> dict:
+    if "resolved" in rec:
+        return rec
+    from core.services import make_saju_payload
+    question = rec.get("updated_question") or rec.get("question") or ""
+    return make_saju_payload(dict(rec), rec.get("focus") or "종합운", question)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="payload full/compact 토큰 비교")
+    ap.add_argument("corpus", nargs="+", help="payload/요청 JSON(L) 파일 또는 디렉터리")
+    ap.add_argument("--show", type=int, default=0, help="압축 결과 예시 N건 출력")
+    args = ap.parse_args()
+
+    from core.services import compact_payload, dump_payload
+    from prompt_budget import _encoder, count_tokens
+
+    print(f"[PAYLOAD] tokenizer={'tiktoken' if _encoder() else 'approx'}")
+    rows = []
+    for path in args.corpus:
+        for rec in _iter_records(path):
+            try:
+                payload = _to_payload(rec)
+            except Exception as e:
+                print(f"[PAYLOAD][SKIP] {path}: {e}")
+                continue
+            full, compact = dump_payload(payload, "full"), dump_payload(payload, "compact")
+            rows.append((count_tokens(full), count_tokens(compact), len(full.encode("utf-8")), len(compact.encode("utf-8"))))
+            if len(rows) <= args.show:
+                print(json.dumps(compact_payload(payload), ensure_ascii=False, indent=1))
+
+    if not rows:
+        print("[PAYLOAD] 표본 없음")
+        return 1
+    full_t = [r[0] for r in rows]
+    comp_t = [r[1] for r in rows]
+    saved = [1 - c / f for f, c in zip(full_t, comp_t) if f]
+    print(f"{'':<10}{'full':>10}{'compact':>10}")
+    print(f"{'tokens p50':<10}{statistics.median(full_t):>10}{statistics.median(comp_t):>10}")
+    print(f"{'tokens max':<10}{max(full_t):>10}{max(comp_t):>10}")
+    print(f"{'bytes p50':<10}{statistics.median(r[2] for r in rows):>10}{statistics.median(r[3] for r in rows):>10}")
+    print(f"[PAYLOAD] n={len(rows)} total {sum(full_t)} -> {sum(comp_t)} tokens "
+          f"(saved {1 - sum(comp_t) / sum(full_t):.1%}, per-request median {statistics.median(saved):.1%})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,118 @@
+# ================== 중복 요청 단일 실행 (single-flight) ==================
+# 같은 (사용자, 세션, 모드, 정규화 질문) 요청이 처리 중에 또 오면(앱 재시도/연타) 새로 처리하지 않고
+# 먼저 온 요청(리더)의 결과를 기다렸다가 같은 답변을 돌려준다 → 중복 LLM 호출/중복 턴 기록 제거 (인스턴스 단위).
+#
+#   flight, leader = acquire_flight(key)
+#   if leader:  ... 처리 ...; complete_flight(flight, body)   # 요청 정리 시 1회 (body 없으면 실패로 간주)
+#   else:       body = wait_flight(flight)                  # 리더 결과 dict | None(시간 초과/리더 실패)
+#
+# - SINGLE_FLIGHT_WAIT_S (기본 45): 후속 요청이 리더를 기다리는 최대 시간 (넘으면 기존처럼 202 "처리 중")
+# - SINGLE_FLIGHT_WINDOW_S (기본 60): 리더가 끝난 뒤에도 이 시간 동안은 같은 결과를 바로 돌려준다 (빠른 재전송)
+# - SINGLE_FLIGHT_STALE_S (기본 300): 이보다 오래 끝나지 않은 리더는 버리고 새 리더를 세운다 (정리 누락 대비)
+# - 완료 항목 만료: 완료 시각 순 deque 앞쪽만 확인 → 요청당 O(1) 분할 상환 (전체 dict 재생성 없음)
+# - 리더가 결과 없이 끝나면(오류/조기 반환) 기다리던 요청은 스스로 처리한다 (acquire_flight 재시도)
+
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+from env_conf import env_float
+
+
+class Flight:
+    """리더 요청 1건 (후속 요청은 event를 기다린다)"""
+
+    __slots__ = ("key", "started_at", "done_at", "result", "waiters", "event")
+
+    def __init__(self, key: str, now: float):
+        self.key = key
+        self.started_at = now
+        self.done_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.waiters = 0
+        self.event = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.done_at is not None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._flights: dict[str, Flight] = {}
+        self._expiry: deque = deque()    # (만료 시각, key, flight) — 완료 순서 = 만료 순서
+        self.stats = {"leaders": 0, "coalesced": 0, "timeouts": 0, "takeovers": 0, "expired": 0}
+
+    def _sweep(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            _, key, flight = self._expiry.popleft()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+                self.stats["expired"] += 1
+
+    def acquire(self, key: str) -> Tuple[Flight, bool]:
+        """(flight, 리더 여부). 처리 중/최근 완료된 같은 키가 있으면 그 flight를 돌려준다"""
+        now = time.monotonic()
+        with self.lock:
+            self._sweep(now)
+            flight = self._flights.get(key)
+            if flight is not None and not flight.done and now - flight.started_at > env_float("SINGLE_FLIGHT_STALE_S", 300, lo=0):
+                flight = None
+                self.stats["takeovers"] += 1
+            if flight is None:
+                flight = self._flights[key] = Flight(key, now)
+                self.stats["leaders"] += 1
+                return flight, True
+            flight.waiters += 1
+            return flight, False
+
+    def complete(self, flight: Flight, result: Optional[dict]) -> None:
+        """리더 종료. result가 있으면 WINDOW 동안 재사용, 없으면 바로 제거 (기다리던 요청이 직접 처리)"""
+        now = time.monotonic()
+        with self.lock:
+            if flight.done:
+                return
+            flight.result = result
+            flight.done_at = now
+            if result is not None:
+                self._expiry.append((now + env_float("SINGLE_FLIGHT_WINDOW_S", 60, lo=0), flight.key, flight))
+            elif self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.event.set()
+
+    def wait(self, flight: Flight, timeout: Optional[float] = None) -> Optional[dict]:
+        if timeout is None:
+            timeout = env_float("SINGLE_FLIGHT_WAIT_S", 45, lo=0)
+        if not flight.event.wait(timeout):
+            self.stats["timeouts"] += 1
+            return None
+        if flight.result is not None:
+            self.stats["coalesced"] += 1
+        return flight.result
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            inflight = sum(1 for f in self._flights.values() if not f.done)
+            return {**self.stats, "inflight": inflight, "recent": len(self._flights) - inflight}
+
+
+_FLIGHTS = SingleFlight()
+
+
+def acquire_flight(key: str) -> Tuple[Flight, bool]:
+    return _FLIGHTS.acquire(key)
+
+
+def complete_flight(flight: Optional[Flight], result: Optional[dict]) -> None:
+    if flight is not None:
+        _FLIGHTS.complete(flight, result)
+
+
+def wait_flight(flight: Flight, timeout: Optional[float] = None) -> Optional[dict]:
+    return _FLIGHTS.wait(flight, timeout)
+
+
+def get_single_flight_stats() -> dict:
+    return _FLIGHTS.snapshot()
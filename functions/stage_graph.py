@@ -0,0 +1,200 @@
+# ================== 모드별 단계 그래프 (stage graph) ==================
+# ask_saju 요청 1건이 거칠 수 있는 단계를 (입력 → 출력)으로 선언하고,
+# 모드마다 목표 단계의 입력을 거슬러 올라가 '실제로 쓰는 출력'을 만드는 단계만 실행한다.
+#
+#   plan = plan_request(request_mode(data, question))   # 요청 본문 → 모드 → 실행 계획
+#   if plan.runs("extract_meta"): ...                   # 계획에 없는 단계는 건너뜀
+#   plan.skip("continuation", "first_turn")             # 실행 중에 빠진 단계 (조건부)
+#   plan.stop("replay", after="user_context")          # 조기 반환: 이후 단계 전부 skip
+#   plan.reroute("fortune", after="extract_meta")       # 변환된 질문이 점괘 → 이후 단계를 점괘 계획으로
+#   plan.log()   # [STAGE][PLAN] mode=fortune run=store_load,fortune skipped=... llm=1
+#
+# - 단계 = Stage(입력, 출력, llm). 입력 이름은 다른 단계의 출력 또는 요청 값(REQUEST_INPUTS)
+# - 모드 = 목표 단계 1개 (MODES). 점괘는 메타 추출/회귀 판정/회귀 빌더 없이 본 호출 1회
+# - 관리 요청(reset/delete_history/list_sessions/fetch_history)은 사용자 컨텍스트만 만들고 끝난다
+#   (개인맞춤입력/사주 파싱, 저장소 히스토리 주입, LLM 없음)
+# - llm: 그 단계가 LLM을 부를 수 있는지. 로그의 llm= 는 실행 예정(조건부 skip 제외) 단계 수
+
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+
+# 요청 본문에서 바로 얻는 값 (단계가 만들지 않음)
+REQUEST_INPUTS = frozenset({"request", "question", "session_id"})
+
+
+class Stage(NamedTuple):
+    inputs: Tuple[str, ...]
+    outputs: Tuple[str, ...]
+    llm: bool = False
+
+
+STAGES: Dict[str, Stage] = {
+    # 사용자/세션 컨텍스트 (저장소 경로 결정)
+    "user_context": Stage(("request", "session_id"), ("user",)),
+    # 최근 대화 요약 + 직전 답변
+    "store_load": Stage(("user", "session_id"), ("summary", "prev_answer")),
+    # 메타 추출 + 상대시간 변환
+    "extract_meta": Stage(("question",), ("parsed_meta", "updated_question"), llm=True),
+    # 개인맞춤입력 파싱 (상담 payload 전용)
+    "profile": Stage(("request",), ("personal_info",)),
+    # 사주 payload
+    "payload": Stage(("request", "personal_info", "updated_question"), ("payload",)),
+    # 답변 캐시 조회 (적중하면 이후 단계 — 회귀 판정/회귀 빌더/counsel — 전부 건너뜀)
+    "answer_cache": Stage(("payload", "updated_question", "user"), ("cached_answer",)),
+    # 회귀 판정 (첫 턴/캐시 적중이면 건너뜀)
+    "continuation": Stage(("question", "prev_answer", "cached_answer"), ("continuation",), llm=True),
+    # 회귀/지시어 맥락 (회귀면 결론 정제 LLM)
+    "regression": Stage(("updated_question", "summary", "continuation", "parsed_meta"), ("reg_prompt", "reg_facts"), llm=True),
+    # 본 상담 호출
+    "counsel": Stage(
+        ("payload", "reg_prompt", "reg_facts", "summary", "parsed_meta"),
+        ("answer",), llm=True,
+    ),
+    # 점괘 본 호출 (괘 선택 + 풀이 1회)
+    "fortune": Stage(("question", "summary"), ("answer",), llm=True),
+    # 관리 요청
+    "reset": Stage(("user",), ("response",)),
+    "delete_history": Stage(("user",), ("response",)),
+    "list_sessions": Stage(("user",), ("response",)),
+    "fetch_history": Stage(("user", "session_id"), ("response",)),
+}
+
+# 모드 → 목표 단계 (선언 순서 = 실행 순서)
+MODES: Dict[str, str] = {
+    "counsel": "counsel",
+    "fortune": "fortune",
+    "reset": "reset",
+    "delete_history": "delete_history",
+    "list_sessions": "list_sessions",
+    "fetch_history": "fetch_history",
+}
+
+_TRUE = ("1", "true", "t", "yes", "y")
+
+
+def _flag(value, loose: bool = True) -> bool:
+    """불리언/문자/숫자 플래그 (reset/delete_history는 "t"도 허용, list/fetch는 기존 규칙)"""
+    if isinstance(value, bool):
+        return value
+    return str(value if value is not None else "").strip().lower() in (_TRUE if loose else ("1", "true", "yes", "y"))
+
+
+def request_mode(data: dict, question: str) -> str:
+    """
+    요청 본문 → 모드. 관리 플래그 → 점괘(mode=fortune 또는 점괘 키워드) → 상담 순
+    (원문 질문 기준. 상담으로 정한 요청도 메타 변환 뒤 updated_question에 점괘 키워드가 있으면
+     ask_saju가 StagePlan.reroute로 점괘로 바꾼다 — 기존 is_fortune_query(updated_question) 판정 유지)
+    """
+    if _flag(data.get("reset", False)):
+        return "reset"
+    if _flag(data.get("delete_history", False)):
+        return "delete_history"
+    if _flag(data.get("list_sessions", ""), loose=False):
+        return "list_sessions"
+    if _flag(data.get("fetch_history", ""), loose=False):
+        return "fetch_history"
+    from core.services import is_fortune_query
+
+    mode = (data.get("mode") or "saju").strip().lower()
+    return "fortune" if mode == "fortune" or is_fortune_query(question) else "counsel"
+
+
+def _producers() -> Dict[str, str]:
+    out = {}
+    for name, st in STAGES.items():
+        for o in st.outputs:
+            out.setdefault(o, name)
+    return out
+
+
+@lru_cache(maxsize=None)
+def required_stages(target: str) -> Tuple[str, ...]:
+    """목표 단계와 그 입력을 만드는 단계들 (선언 순서, 목표별 1회 계산)"""
+    producers = _producers()
+    need, todo = set(), [target]
+    while todo:
+        name = todo.pop()
+        if name in need:
+            continue
+        need.add(name)
+        for inp in STAGES[name].inputs:
+            if inp in REQUEST_INPUTS:
+                continue
+            src = producers.get(inp)
+            if src is None:
+                raise KeyError(f"stage '{name}' input '{inp}' has no producer")
+            todo.append(src)
+    return tuple(name for name in STAGES if name in need)
+
+
+class StagePlan:
+    """요청 1건의 실행 계획 + 실행 중 건너뛴 단계 기록"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.target = MODES[mode]
+        self.planned = required_stages(self.target)
+        # 다른 모드의 목표 단계는 빼고, 이 모드에서 쓰지 않는 단계만 기록
+        targets = set(MODES.values())
+        self.skipped: Dict[str, str] = {n: "unused" for n in STAGES if n not in self.planned and n not in targets}
+
+    def runs(self, stage: str) -> bool:
+        return stage in self.planned and stage not in self.skipped
+
+    def skip(self, stage: str, reason: str) -> None:
+        """계획에 있던 단계를 실행 중 조건으로 건너뜀 (첫 턴, 캐시 적중 등)"""
+        if stage in self.planned and stage not in self.skipped:
+            self.skipped[stage] = reason
+
+    def stop(self, reason: str, after: str) -> None:
+        """조기 반환 (재전송/중복 합치기 등): after 다음 단계부터 전부 건너뜀"""
+        order = list(self.planned)
+        for n in order[order.index(after) + 1:] if after in order else order:
+            self.skip(n, reason)
+
+    def reroute(self, mode: str, after: str) -> None:
+        """after까지 실행한 뒤 모드 변경: 이미 실행한 단계는 유지, 새 목표에 필요 없는 나머지는 skip(rerouted)"""
+        order = list(self.planned)
+        done = order[:order.index(after) + 1] if after in order else []
+        self.mode = mode
+        self.target = MODES[mode]
+        need = set(done) | set(required_stages(self.target))
+        self.planned = tuple(n for n in STAGES if n in need)
+        for n in order:
+            if n not in need:
+                self.skipped[n] = "rerouted"
+        for n in self.planned:
+            if self.skipped.get(n) == "unused":
+                del self.skipped[n]
+        self.skipped.pop(self.target, None)
+
+    @property
+    def ran(self) -> List[str]:
+        return [n for n in self.planned if n not in self.skipped]
+
+    @property
+    def llm_stages(self) -> List[str]:
+        return [n for n in self.ran if STAGES[n].llm]
+
+    def report(self) -> dict:
+        return {"mode": self.mode, "ran": self.ran, "skipped": dict(self.skipped), "llm_stages": self.llm_stages}
+
+    def log(self) -> dict:
+        r = self.report()
+        skipped = ",".join(f"{n}({why})" for n, why in r["skipped"].items())
+        print(f"[STAGE][PLAN] mode={self.mode} run={','.join(r['ran'])} skipped={skipped or '-'} "
+              f"llm={len(r['llm_stages'])}({','.join(r['llm_stages']) or '-'})")
+        return r
+
+
+def plan_request(mode: str) -> StagePlan:
+    return StagePlan(mode)
+
+
+def get_stage_graph() -> Dict[str, dict]:
+    """모드별 실행/건너뜀 단계 (확인용)"""
+    out = {}
+    for mode in MODES:
+        plan = StagePlan(mode)
+        out[mode] = {"run": plan.planned, "skipped": sorted(plan.skipped), "llm_stages": plan.llm_stages}
+    return out
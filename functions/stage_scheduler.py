@@ -0,0 +1,137 @@
+# ================== 응답 전 단계(stage) 스케줄러 ==================
+# ask_saju는 본 상담 호출 전에 보조 LLM 호출(메타 추출, 회귀 판정, 결론 정제 …)을 여러 번 한다.
+# 서로 의존하지 않는 단계는 공용 스레드 풀에서 동시에 돌리고, 의존 단계는 future를 기다린다.
+#
+#   stages = StageScheduler()
+#   stages.submit("extract_meta", extract_meta_and_convert, question)   # 백그라운드
+#   with stage_timer("store_load"): ...                                  # 현재 스레드 (시간만 기록)
+#   parsed_meta, uq = stages.result("extract_meta")                     # 필요한 시점에 대기
+#   stages.log()   # [STAGE] 단계별 wall time + 직렬 합계 대비 절약 시간
+#
+# - 단계는 submit 시점의 contextvars(사용자/세션/저장소 컨텍스트)를 복사해 실행한다.
+#   같은 요청 저장소 세션(StoreSession)을 공유하므로, 백그라운드 단계에서는 저장소를 쓰지 않는다.
+# - STAGE_POOL_SIZE (기본 8): 프로세스 공용 풀 크기. 0이면 submit이 즉시 현재 스레드에서 실행 (직렬 비교용)
+# - 요청 안에서 호출된 다른 모듈은 stage_timer()로 현재 스케줄러에 시간을 남길 수 있다.
+
+import threading
+import time
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from env_conf import env_int
+
+_POOL: ThreadPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+
+_CUR_STAGES: ContextVar["StageScheduler | None"] = ContextVar("_CUR_STAGES", default=None)
+
+
+def _pool_size() -> int:
+    return env_int("STAGE_POOL_SIZE", 8, lo=0)
+
+
+def _stage_pool() -> ThreadPoolExecutor | None:
+    global _POOL
+    if _pool_size() == 0:
+        return None
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ThreadPoolExecutor(max_workers=_pool_size(), thread_name_prefix="stage")
+    return _POOL
+
+
+class StageScheduler:
+    """요청 1건의 단계 실행/대기 + 단계별 시간 기록"""
+
+    def __init__(self, name: str = "ask_saju"):
+        self.name = name
+        self._t0 = time.perf_counter()
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.timings: dict[str, dict] = {}      # stage -> {"start_ms", "wall_ms", "wait_ms"?}
+        self._token = _CUR_STAGES.set(self)
+
+    def record(self, stage: str, start: float, end: float) -> None:
+        """stage 구간 시간 기록 (다른 스레드/이벤트 루프에서 실행한 구간도 직접 남길 수 있다)"""
+        with self._lock:
+            self.timings[stage] = {
+                "start_ms": round((start - self._t0) * 1000, 1),
+                "wall_ms": round((end - start) * 1000, 1),
+            }
+
+    def submit(self, stage: str, fn, *args, **kwargs) -> Future:
+        """fn(*args, **kwargs)를 백그라운드 단계로 실행. 결과는 result(stage)로 받는다"""
+        ctx = contextvars.copy_context()
+
+        def _run():
+            start = time.perf_counter()
+            try:
+                return ctx.run(fn, *args, **kwargs)
+            finally:
+                self.record(stage, start, time.perf_counter())
+
+        pool = _stage_pool()
+        if pool is None:
+            fut: Future = Future()
+            try:
+                fut.set_result(_run())
+            except Exception as e:
+                fut.set_exception(e)
+        else:
+            fut = pool.submit(_run)
+        self._futures[stage] = fut
+        return fut
+
+    def has(self, stage: str) -> bool:
+        return stage in self._futures
+
+    def result(self, stage: str, timeout: float | None = None):
+        """단계 결과 대기 (예외는 그대로 전달). 기다린 시간은 wait_ms로 남는다"""
+        start = time.perf_counter()
+        try:
+            return self._futures[stage].result(timeout=timeout)
+        finally:
+            waited = round((time.perf_counter() - start) * 1000, 1)
+            with self._lock:
+                self.timings.setdefault(stage, {})["wait_ms"] = waited
+
+    def summary(self) -> dict:
+        """elapsed_ms: 스케줄러 시작~지금, serial_ms: 단계 wall time 합(직렬이었다면), saved_ms: 그 차이"""
+        elapsed = round((time.perf_counter() - self._t0) * 1000, 1)
+        with self._lock:
+            stages = {k: dict(v) for k, v in self.timings.items()}
+        serial = round(sum(v.get("wall_ms") or 0.0 for v in stages.values()), 1)
+        return {"stages": stages, "elapsed_ms": elapsed, "serial_ms": serial,
+                "saved_ms": round(max(0.0, serial - elapsed), 1)}
+
+    def log(self) -> dict:
+        s = self.summary()
+        parts = " ".join(f"{k}={v.get('wall_ms', 0)}ms@{v.get('start_ms', 0)}" for k, v in s["stages"].items())
+        print(f"[STAGE] {self.name} {parts} | elapsed={s['elapsed_ms']}ms serial={s['serial_ms']}ms saved={s['saved_ms']}ms")
+        return s
+
+    def close(self) -> None:
+        """요청 끝: 현재 스케줄러 해제 (아직 안 끝난 단계는 결과를 버린다)"""
+        try:
+            _CUR_STAGES.reset(self._token)
+        except ValueError:
+            _CUR_STAGES.set(None)
+
+
+def current_stages() -> StageScheduler | None:
+    return _CUR_STAGES.get()
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """현재 스레드에서 실행하는 구간의 시간을 현재 스케줄러에 기록 (스케줄러 없으면 아무것도 안 함)"""
+    sched = _CUR_STAGES.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if sched is not None:
+            sched.record(stage, start, time.perf_counter())